@@ -0,0 +1,214 @@
+# .\aggregates.py
+
+import logging
+
+from sqlalchemy import and_, case, delete, event, func, insert, or_, select, true, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased
+
+from extensions import db
+from leaderboard_cache import mark_changed
+from models import Answer, DimensionClosure, LeaderboardAggregate, Question, Rating
+
+logger = logging.getLogger('aggregates')
+
+KEY_COLUMNS = ('llm_id', 'l1_dim_id', 'l2_dim_id', 'l3_dim_id', 'question_type')
+VALUE_COLUMNS = ('score_sum', 'rating_count', 'responsive_count')
+
+
+# --- 1. 维度路径 ---
+
+# One alias per level, built once: fresh aliases per call would also miss the statement cache
+_ANCESTOR_ALIASES = {level: aliased(DimensionClosure, name=f'ancestor_l{level}') for level in (1, 2)}
+
+
+def _ancestor_at(level: int, dimension_column):
+    """Closure row joining a dimension to its ancestor on `level`: one indexed equality join."""
+    closure = _ANCESTOR_ALIASES[level]
+    return closure, and_(closure.descendant_id == dimension_column, closure.ancestor_level == level)
+
+
+def _question_paths(*columns):
+    """Question with the L1/L2 ancestors of its dimension; the returned columns precede the path columns."""
+    level1, on_level1 = _ancestor_at(1, Question.dimension_id)
+    level2, on_level2 = _ancestor_at(2, Question.dimension_id)
+    return select(
+        *columns,
+        level1.ancestor_id.label('l1_dim_id'),
+        level2.ancestor_id.label('l2_dim_id'),
+        Question.dimension_id.label('l3_dim_id'),
+        Question.question_type
+    ).select_from(Question)\
+     .join(level1, on_level1)\
+     .join(level2, on_level2)
+
+
+def _grouped_ratings(*criteria):
+    """Ratings of current answers matching `criteria`, summed per aggregate key."""
+    level1, on_level1 = _ancestor_at(1, Question.dimension_id)
+    level2, on_level2 = _ancestor_at(2, Question.dimension_id)
+    return select(
+        Answer.llm_id,
+        level1.ancestor_id.label('l1_dim_id'),
+        level2.ancestor_id.label('l2_dim_id'),
+        Question.dimension_id.label('l3_dim_id'),
+        Question.question_type,
+        func.sum(Rating.score).label('score_sum'),
+        func.count(Rating.id).label('rating_count'),
+        func.sum(case((Rating.is_responsive == True, 1), else_=0)).label('responsive_count')
+    ).select_from(Rating)\
+     .join(Answer, Rating.answer_id == Answer.id)\
+     .join(Question, Answer.question_id == Question.id)\
+     .join(level1, on_level1)\
+     .join(level2, on_level2)\
+     .filter(Answer.is_current == true(), *criteria)\
+     .group_by(Answer.llm_id, level1.ancestor_id, level2.ancestor_id, Question.dimension_id, Question.question_type)
+
+
+# --- 2. 增量更新 ---
+
+def _apply_deltas(session: Session, deltas: dict[tuple, list]):
+    """Adds (score_sum, rating_count, responsive_count) deltas to their rows, creating or dropping rows as needed."""
+    if not deltas:
+        return
+    rows = [dict(zip(KEY_COLUMNS, key), **dict(zip(VALUE_COLUMNS, values))) for key, values in deltas.items()]
+    stmt = sqlite_insert(LeaderboardAggregate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={column: getattr(LeaderboardAggregate, column) + getattr(stmt.excluded, column) for column in VALUE_COLUMNS}
+    )
+    session.execute(stmt, rows)
+    mark_changed(session)
+    if any(values[1] < 0 for values in deltas.values()):
+        session.execute(delete(LeaderboardAggregate).where(LeaderboardAggregate.rating_count <= 0))
+
+
+def _owners_query(answer_ids):
+    return select(Answer.id, Answer.llm_id, Answer.question_id).where(Answer.id.in_(answer_ids), Answer.is_current == true())
+
+
+def _paths_query(question_ids):
+    return _question_paths(Question.id).where(Question.id.in_(question_ids))
+
+
+def _rating_deltas(session: Session, ratings: list[Rating], sign: int) -> dict[tuple, list]:
+    # Pending ratings may hang off an answer that is not flushed yet, so read its columns from the object.
+    # Answers of a run in progress, or already replaced, are not on the leaderboard (None: not flushed, defaults to current)
+    answers = {}
+    answer_ids = set()
+    for rating in ratings:
+        if rating.answer_id is not None:
+            answer_ids.add(rating.answer_id)
+        elif rating.answer is not None and rating.answer.is_current is not False:
+            answers[id(rating)] = (rating.answer.llm_id, rating.answer.question_id)
+    looked_up = {
+        answer_id: (llm_id, question_id)
+        for answer_id, llm_id, question_id in session.execute(_owners_query(answer_ids))
+    } if answer_ids else {}
+
+    owners = {id(rating): answers.get(id(rating)) or looked_up.get(rating.answer_id) for rating in ratings}
+    question_ids = {owner[1] for owner in owners.values() if owner}
+    paths = {
+        row.id: (row.l1_dim_id, row.l2_dim_id, row.l3_dim_id, row.question_type)
+        for row in session.execute(_paths_query(question_ids))
+    } if question_ids else {}
+
+    deltas = {}
+    for rating in ratings:
+        owner = owners[id(rating)]
+        path = paths.get(owner[1]) if owner else None
+        if path is None:
+            # Same rule as the rebuild: ratings outside a complete dimension path are not ranked
+            continue
+        values = deltas.setdefault((owner[0], *path), [0.0, 0, 0])
+        values[0] += sign * rating.score
+        values[1] += sign
+        values[2] += sign if rating.is_responsive else 0
+    return deltas
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_rating_changes(session, flush_context, instances):
+    added = [obj for obj in session.new if isinstance(obj, Rating)]
+    removed = [obj for obj in session.deleted if isinstance(obj, Rating)]
+    if not added and not removed:
+        return
+    deltas = _rating_deltas(session, added, 1)
+    for key, values in _rating_deltas(session, removed, -1).items():
+        merged = deltas.setdefault(key, [0.0, 0, 0])
+        for i, value in enumerate(values):
+            merged[i] += value
+    _apply_deltas(session, deltas)
+
+
+def _totals(sign: int, *criteria) -> dict[tuple, list]:
+    return {
+        tuple(row[:len(KEY_COLUMNS)]): [sign * row.score_sum, sign * row.rating_count, sign * row.responsive_count]
+        for row in db.session.execute(_grouped_ratings(*criteria))
+    }
+
+
+def delete_ratings(*criteria) -> int:
+    """
+    Bulk-deletes the ratings matching `criteria`. query.delete() never reaches the
+    flush hook, so their totals are subtracted here, in the same transaction.
+    """
+    _apply_deltas(db.session, _totals(-1, *criteria))
+    return Rating.query.filter(*criteria).delete(synchronize_session=False)
+
+
+def set_answers_current(current: bool, *criteria) -> int:
+    """
+    Puts the answers matching `criteria` on or takes them off the leaderboard, moving their
+    ratings' totals in or out in the same transaction. Returns the number of answers changed.
+    """
+    if not current:
+        _apply_deltas(db.session, _totals(-1, *criteria))
+    count = db.session.execute(
+        update(Answer).where(*criteria).values(is_current=current), execution_options={'synchronize_session': False}
+    ).rowcount
+    if current:
+        _apply_deltas(db.session, _totals(1, *criteria))
+    return count
+
+
+def _refresh_paths_statement(dimension_ids: list[int]):
+    level1, on_level1 = _ancestor_at(1, LeaderboardAggregate.l3_dim_id)
+    level2, on_level2 = _ancestor_at(2, LeaderboardAggregate.l3_dim_id)
+    return update(LeaderboardAggregate)\
+        .where(LeaderboardAggregate.l3_dim_id.in_(dimension_ids))\
+        .values(
+            l1_dim_id=select(level1.ancestor_id).where(on_level1).scalar_subquery(),
+            l2_dim_id=select(level2.ancestor_id).where(on_level2).scalar_subquery()
+        )
+
+
+def refresh_dimension_paths(dimension_ids: list[int]):
+    """Re-reads the L1/L2 ancestors of rows under moved dimensions from the closure table."""
+    db.session.execute(_refresh_paths_statement(dimension_ids))
+    mark_changed(db.session)
+
+
+def drop_dimension_paths(dimension_ids: list[int]):
+    """Removes the rows of dimensions that no longer sit on a complete path."""
+    db.session.execute(delete(LeaderboardAggregate).where(or_(
+        LeaderboardAggregate.l1_dim_id.in_(dimension_ids),
+        LeaderboardAggregate.l2_dim_id.in_(dimension_ids),
+        LeaderboardAggregate.l3_dim_id.in_(dimension_ids)
+    )))
+    mark_changed(db.session)
+
+
+# --- 3. 全量重建 ---
+
+def rebuild_aggregates() -> int:
+    """Recomputes the whole table from the ratings of current answers in one INSERT ... SELECT ... GROUP BY; returns the row count."""
+    db.session.execute(delete(LeaderboardAggregate))
+    db.session.execute(
+        insert(LeaderboardAggregate).from_select(KEY_COLUMNS + VALUE_COLUMNS, _grouped_ratings())
+    )
+    mark_changed(db.session)
+    db.session.commit()
+    count = db.session.query(func.count()).select_from(LeaderboardAggregate).scalar()
+    logger.info(f"Rebuilt leaderboard aggregates: {count} rows.")
+    return count
@@ -6,8 +6,11 @@ from flask_uploads import configure_uploads
 from models import Setting, LLM
 from llm import clients
 from config import DEFAULT_CRITERIA
-from routes import dimensions_bp, index_bp, leaderboard_bp, models_bp, questions_bp, settings_bp, public_leaderboard_bp
+from routes import dimensions_bp, index_bp, leaderboard_bp, models_bp, questions_bp, settings_bp, public_leaderboard_bp, export_bp
 from utils import setup_logging
+from commands import register_commands
+from sqlite_profile import configure_sqlite
+import aggregates  # 注册 Rating 增删时同步更新榜单聚合表的 flush 钩子
 
 setup_logging()
 logger = logging.getLogger('main_app')
@@ -37,13 +40,18 @@ def create_app():
     app.register_blueprint(questions_bp)
     app.register_blueprint(settings_bp)
     app.register_blueprint(public_leaderboard_bp)
+    app.register_blueprint(export_bp)
+    
+    register_commands(app)
     
     with app.app_context():
+        configure_sqlite(db.engine)
         logger.info("Creating all database tables.")
         db.create_all()
         # import_datas(app)
         
-        all_llms = LLM.query.all()
+        # 只读取客户端需要的列，数据库还没迁移到 LLM 的新列时也能启动（flask db upgrade 需要先创建应用）
+        all_llms = db.session.query(LLM.id, LLM.name, LLM.model, LLM.base_url, LLM.api_keys, LLM.proxy).all()
         logger.info(f"Creating LLM clients for {len(all_llms)} models.")
         clients.create_clients([
             {
@@ -65,6 +73,8 @@ def create_app():
             db.session.add(default_setting_subjective)
             db.session.commit()
             logger.info("Default settings created successfully.")
+
+        # 维度闭包表和榜单聚合表的回填在迁移 b6e1d9a4c027 里完成：启动时数据库可能还没迁移到它们依赖的列
             
     logger.info("Flask app creation finished.")
     return app
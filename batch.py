@@ -0,0 +1,298 @@
+# .\batch.py
+
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from sqlalchemy import insert
+
+from config import QUESTION_TEMPLATE, GENERATION_PROFILES, BATCH_DIR, BATCH_BACKENDS, BATCH_COMPLETION_WINDOW, BATCH_INGEST_CHUNK
+from fingerprints import answer_fingerprint
+from extensions import db
+from llm import clients, LLMClient
+from models import Answer, BatchJob, Question
+import runs
+
+logger = logging.getLogger('batch')
+
+
+# --- 1. 构建请求文件 ---
+
+def custom_id(question_id: int, llm_id: int, fingerprint: str | None = None) -> str:
+    # The fingerprint rides along so ingestion records what was asked, even if the question changed since
+    return f"q{question_id}-m{llm_id}" + (f"-f{fingerprint}" if fingerprint else '')
+
+
+def parse_custom_id(value: str) -> tuple[int, int, str | None]:
+    question_part, llm_part, *fingerprint_part = value.split('-')
+    return int(question_part[1:]), int(llm_part[1:]), fingerprint_part[0][1:] if fingerprint_part else None
+
+
+def build_generation_file(llm_id: int, question_ids: list[int] | None = None) -> tuple[Path, int]:
+    """
+    Writes one chat-completions request per question for a model, in the
+    OpenAI batch JSONL format. Questions are streamed, so memory stays flat.
+    """
+    llm_client = clients.clients[llm_id]
+    path = Path(BATCH_DIR) / f"generation-m{llm_id}-{int(time.time())}-{uuid.uuid4().hex[:8]}.jsonl"
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    query = db.session.query(Question.id, Question.question_type, Question.content).order_by(Question.id)
+    if question_ids is not None:
+        query = query.filter(Question.id.in_(question_ids))
+
+    count = 0
+    with path.open('w', encoding='utf-8') as f:
+        for question_id, question_type, content in query.yield_per(1000):
+            request = {
+                'custom_id': custom_id(
+                    question_id, llm_id,
+                    answer_fingerprint(question_type, content, llm_client.model, llm_client.base_url)
+                ),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': llm_client.model,
+                    'messages': [{'role': 'user', 'content': QUESTION_TEMPLATE[question_type].format(content)}],
+                    # Batch endpoints do not stream, so only the output budget carries over
+                    **LLMClient._profile_params(GENERATION_PROFILES[question_type])
+                }
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + '\n')
+            count += 1
+    logger.info(f"Wrote {count} batch requests for LLM {llm_id} to {path}.")
+    return path, count
+
+
+# --- 2. 批量后端 ---
+
+class BatchBackend(ABC):
+    """submit → poll → download. Statuses returned by poll: 'in_progress', 'completed' or 'failed'."""
+    name = None
+
+    @abstractmethod
+    def submit(self, llm_client: LLMClient, key_index: int, input_path: Path) -> str:
+        """Hands the request file to the provider; returns the id to poll it by."""
+
+    @abstractmethod
+    def poll(self, llm_client: LLMClient, key_index: int, remote_id: str) -> str:
+        """'in_progress', 'completed' or 'failed'."""
+
+    @abstractmethod
+    def download(self, llm_client: LLMClient, key_index: int, remote_id: str, output_path: Path):
+        """Writes a completed batch's results to `output_path`, one JSON line per request."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Providers exposing the OpenAI /v1/batches endpoint (discounted, asynchronous)."""
+    name = 'openai'
+    IN_PROGRESS = {'validating', 'in_progress', 'finalizing', 'cancelling'}
+
+    def submit(self, llm_client, key_index, input_path):
+        client = llm_client.clients[key_index]
+        with input_path.open('rb') as f:
+            uploaded = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint='/v1/chat/completions',
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def poll(self, llm_client, key_index, remote_id):
+        batch = llm_client.clients[key_index].batches.retrieve(remote_id)
+        if batch.status in self.IN_PROGRESS:
+            return 'in_progress'
+        return 'completed' if batch.status == 'completed' and batch.output_file_id else 'failed'
+
+    def download(self, llm_client, key_index, remote_id, output_path):
+        client = llm_client.clients[key_index]
+        batch = client.batches.retrieve(remote_id)
+        client.files.content(batch.output_file_id).write_to_file(output_path)
+        if batch.error_file_id:
+            # Per-request failures come in a separate file with the same line format
+            with output_path.open('ab') as out:
+                out.write(client.files.content(batch.error_file_id).read())
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for providers without a batch endpoint (and for tests).
+    It answers the requests through the normal synchronous client when polled and
+    writes the output in the same format as the OpenAI backend.
+    """
+    name = 'local'
+
+    def submit(self, llm_client, key_index, input_path):
+        return str(input_path)
+
+    def poll(self, llm_client, key_index, remote_id):
+        input_path = Path(remote_id)
+        output_path = input_path.with_suffix('.local-output.jsonl')
+        if not output_path.exists():
+            partial_path = output_path.with_suffix('.partial')
+            with input_path.open(encoding='utf-8') as src, partial_path.open('w', encoding='utf-8') as out:
+                for line in src:
+                    request = json.loads(line)
+                    body = request['body']
+                    profile = {param: body[param] for param in ('max_tokens', 'stop') if param in body}
+                    content = llm_client.generate_response(body['messages'][0]['content'], profile=profile)
+                    out.write(json.dumps({
+                        'custom_id': request['custom_id'],
+                        'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': content}}]}},
+                        'error': None
+                    }, ensure_ascii=False) + '\n')
+            partial_path.rename(output_path)
+        return 'completed'
+
+    def download(self, llm_client, key_index, remote_id, output_path):
+        Path(remote_id).with_suffix('.local-output.jsonl').replace(output_path)
+
+
+BACKENDS = {backend.name: backend for backend in (OpenAIBatchBackend(), LocalBatchBackend())}
+
+
+def backend_for(base_url: str) -> BatchBackend:
+    return BACKENDS[BATCH_BACKENDS.get(base_url.rstrip('/'), BATCH_BACKENDS['default'])]
+
+
+# --- 3. 提交与轮询 ---
+
+def submit_generation_batch(llm_id: int, question_ids: list[int] | None = None) -> BatchJob | None:
+    llm_client = clients.clients[llm_id]
+    input_path, count = build_generation_file(llm_id, question_ids)
+    if count == 0:
+        input_path.unlink()
+        return None
+
+    backend = backend_for(llm_client.base_url)
+    key_index = llm_client.key_pool.acquire()
+    started = time.monotonic()
+    try:
+        remote_id = backend.submit(llm_client, key_index, input_path)
+        llm_client.key_pool.release(key_index, True, time.monotonic() - started)
+    except Exception as e:
+        llm_client.key_pool.release(key_index, False, time.monotonic() - started, type(e).__name__)
+        logger.error(f"Submitting batch for LLM {llm_id} failed: {e}", exc_info=True)
+        job = BatchJob(llm_id=llm_id, backend=backend.name, key_index=key_index, status='failed',
+                       input_path=str(input_path), request_count=count, error=str(e))
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    job = BatchJob(llm_id=llm_id, backend=backend.name, key_index=key_index, remote_id=remote_id,
+                   input_path=str(input_path), request_count=count)
+    db.session.add(job)
+    db.session.commit()
+    logger.info(f"Submitted {backend.name} batch {remote_id} ({count} requests) for LLM {llm_id} as BatchJob {job.id}.")
+    return job
+
+
+def open_jobs_query():
+    return db.select(BatchJob).filter(BatchJob.status.in_(['submitted', 'completed']))
+
+
+def poll_batch_job(job: BatchJob) -> str:
+    """Advances a submitted job to 'completed' (output downloaded) or 'failed'; returns the new status."""
+    llm_client = clients.clients.get(job.llm_id)
+    if llm_client is None:
+        job.status, job.error = 'failed', 'LLM client no longer exists'
+        db.session.commit()
+        return job.status
+
+    backend = BACKENDS[job.backend]
+    try:
+        status = backend.poll(llm_client, job.key_index, job.remote_id)
+        if status == 'completed':
+            output_path = Path(job.input_path).with_suffix('.output.jsonl')
+            backend.download(llm_client, job.key_index, job.remote_id, output_path)
+            job.output_path = str(output_path)
+        if status != 'in_progress':
+            job.status = status
+    except Exception as e:
+        logger.error(f"Polling BatchJob {job.id} failed: {e}", exc_info=True)
+        job.status, job.error = 'failed', str(e)
+    db.session.commit()
+    return job.status
+
+
+# --- 4. 结果入库 ---
+
+def _content_from_result(result: dict) -> str:
+    response = result.get('response') or {}
+    body = response.get('body') or {}
+    if result.get('error') or response.get('status_code', 200) >= 400:
+        error = result.get('error') or body.get('error') or {}
+        return f"API Error: {error.get('message', 'batch request failed')}"
+    try:
+        choice = body['choices'][0]
+        content = choice['message'].get('content')
+        return content if content is not None else choice.get('finish_reason') or 'No choices in response'
+    except (KeyError, IndexError, TypeError):
+        return 'Response parsing failed completely'
+
+
+def _insert_chunk(rows: list[dict]) -> list[int]:
+    # Questions deleted while the batch was running are dropped
+    question_ids = set(db.session.scalars(
+        db.select(Question.id).filter(Question.id.in_([row['question_id'] for row in rows]))
+    ))
+    rows = [row for row in rows if row['question_id'] in question_ids]
+    if not rows:
+        return []
+    answer_ids = list(db.session.scalars(insert(Answer).returning(Answer.id), rows))
+    db.session.commit()
+    return answer_ids
+
+
+def _stored_pairs_query(run_id: int):
+    return db.select(Answer.question_id, Answer.llm_id).filter(Answer.run_id == run_id)
+
+
+def _run_answers_query(run_id: int):
+    return db.select(Answer.id).filter(Answer.run_id == run_id).order_by(Answer.id)
+
+
+def ingest_batch_job(job: BatchJob) -> list[int]:
+    """
+    Streams a completed job's output into Answer rows in chunks and returns the ids of all of
+    the job's answers. The answers belong to a run of their own: they replace the model's old
+    answers only once all of them are rated, so the leaderboard never shows the batch half
+    ingested. The run is recorded on the job before the first chunk, so an ingestion that
+    failed partway resumes under the same run and skips the results it already stored.
+    """
+    if job.run_id is None:
+        job.run_id = runs.start_run(f'batch job {job.id}').id
+        db.session.commit()
+    else:
+        logger.info(f"Resuming ingestion of BatchJob {job.id} under EvaluationRun {job.run_id}.")
+    stored = set(db.session.execute(_stored_pairs_query(job.run_id)).tuples())
+
+    inserted = 0
+    rows = []
+    with open(job.output_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            question_id, llm_id, fingerprint = parse_custom_id(result['custom_id'])
+            if (question_id, llm_id) in stored:
+                continue
+            rows.append({'question_id': question_id, 'llm_id': llm_id, 'content': _content_from_result(result),
+                         'fingerprint': fingerprint, 'run_id': job.run_id, 'is_current': False})
+            if len(rows) >= BATCH_INGEST_CHUNK:
+                inserted += len(_insert_chunk(rows))
+                rows = []
+    if rows:
+        inserted += len(_insert_chunk(rows))
+
+    answer_ids = list(db.session.scalars(_run_answers_query(job.run_id)))
+    job.status = 'ingested'
+    db.session.commit()
+    # Each rating finished later counts one answer towards the run
+    runs.expect(job.run_id, len(answer_ids))
+    logger.info(f"Ingested {inserted} answers from BatchJob {job.id} ({len(answer_ids) - inserted} stored by an earlier attempt).")
+    return answer_ids
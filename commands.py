@@ -0,0 +1,188 @@
+# .\commands.py
+
+import logging
+
+import click
+
+logger = logging.getLogger('commands')
+
+
+def register_commands(app):
+    """Maintenance commands, run as `flask <command>`."""
+
+    @app.cli.command('rebuild-leaderboard')
+    def rebuild_leaderboard():
+        """Recomputes the leaderboard aggregate table from every rating."""
+        from aggregates import rebuild_aggregates
+        count = rebuild_aggregates()
+        click.echo(f"Rebuilt leaderboard aggregates: {count} rows.")
+
+    @app.cli.command('backfill-dimension-closure')
+    def backfill_dimension_closure():
+        """Recomputes the dimension closure table from parent links, then the aggregates that depend on it."""
+        from aggregates import rebuild_aggregates
+        from dimension_tree import rebuild_closure
+        click.echo(f"Rebuilt dimension closure: {rebuild_closure()} rows.")
+        click.echo(f"Rebuilt leaderboard aggregates: {rebuild_aggregates()} rows.")
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans():
+        """Explains the hot queries against a seeded scratch database; fails if any of them scans a table."""
+        from query_plans import check_query_plans as run_check
+        failures = run_check(echo=click.echo)
+        if failures:
+            raise click.ClickException(f"{failures} hot queries scan a table instead of using an index.")
+        click.echo("All hot queries use an index.")
+
+    @app.cli.command('sqlite-stress')
+    @click.option('--writers', default=100, show_default=True, help='Concurrent task-shaped writers.')
+    @click.option('--readers', default=10, show_default=True, help='Concurrent leaderboard readers.')
+    @click.option('--seconds', default=10.0, show_default=True)
+    @click.option('--api-latency', default=0.05, show_default=True, help='Simulated model call time between reads and writes.')
+    @click.option('--read-interval', default=0.01, show_default=True, help='Pause between two reads of one reader.')
+    @click.option('--baseline', is_flag=True, help='Use the stock SQLite engine instead of the production profile.')
+    def sqlite_stress(writers, readers, seconds, api_latency, read_interval, baseline):
+        """Runs concurrent writers against readers on a scratch database and reports commit latency."""
+        from sqlite_stress import percentile, run_stress
+        result = run_stress(writers, readers, seconds, api_latency, read_interval, profile=not baseline)
+        commits, reads = result.commit_latencies, result.read_latencies
+        click.echo(f"Commits: {len(commits)}  p50 {percentile(commits, 50) * 1000:.1f} ms  "
+                   f"p95 {percentile(commits, 95) * 1000:.1f} ms  p99 {percentile(commits, 99) * 1000:.1f} ms")
+        click.echo(f"Reads:   {len(reads)}  p50 {percentile(reads, 50) * 1000:.1f} ms  "
+                   f"p95 {percentile(reads, 95) * 1000:.1f} ms  p99 {percentile(reads, 99) * 1000:.1f} ms")
+        for message, count in result.errors.items():
+            click.echo(f"Error x{count}: {message}")
+        if result.errors:
+            raise click.ClickException(f"{sum(result.errors.values())} operations failed under load.")
+
+    @app.cli.command('result-writer')
+    @click.option('--consumer', default=None, help='Consumer name in the stream group; defaults to the host name.')
+    @click.option('--batch-size', default=None, type=int, help='Entries written per transaction.')
+    @click.option('--once', is_flag=True, help='Exit once the stream is drained instead of waiting for more.')
+    def result_writer(consumer, batch_size, once):
+        """Drains answers and ratings queued by the tasks (RESULT_WRITE_MODE = 'stream') into the database."""
+        from config import RESULT_WRITER_BATCH
+        from result_writer import run_writer
+        processed = run_writer(consumer, batch_size or RESULT_WRITER_BATCH, once=once)
+        click.echo(f"Processed {processed} stream entries.")
+
+    @app.cli.command('stamp-fingerprints')
+    def stamp_fingerprints():
+        """Marks answers and ratings saved before fingerprints existed as current, so smart updates skip them."""
+        from fingerprints import stamp_missing_fingerprints
+        answers, ratings = stamp_missing_fingerprints()
+        click.echo(f"Stamped {answers} answers and {ratings} ratings.")
+
+    @app.cli.command('plan-update')
+    @click.option('--question', 'question_ids', multiple=True, type=int, help='Limit to these question ids.')
+    @click.option('--llm', 'llm_ids', multiple=True, type=int, help='Limit to these model ids.')
+    def plan_update(question_ids, llm_ids):
+        """Dry run of a smart update: how many answers it would regenerate, re-rate and skip."""
+        from fingerprints import plan_update as make_plan
+        plan = make_plan(list(question_ids) or None, list(llm_ids) or None)
+        summary = plan.summary()
+        click.echo(f"Regenerate {summary['regenerate']}, re-rate {summary['rerate']} "
+                   f"({sum(map(len, plan.stale_ratings.values()))} stale ratings), skip {summary['skipped']}.")
+
+    @app.cli.command('collect-runs')
+    def collect_runs():
+        """Finishes evaluation runs past their deadline and deletes the results finished runs replaced."""
+        from runs import collect_superseded, finish_overdue_runs
+        overdue = finish_overdue_runs()
+        if overdue:
+            click.echo(f"Finished overdue runs: {', '.join(map(str, overdue))}.")
+        click.echo(f"Deleted {collect_superseded()} replaced answers.")
+
+    @app.cli.command('run-progress')
+    @click.argument('run_id', required=False, type=int)
+    def run_progress(run_id):
+        """Progress and ETA of a run, or of every run still in progress."""
+        from extensions import db
+        from models import EvaluationRun
+        from planner import progress
+        if run_id is not None:
+            run = db.session.get(EvaluationRun, run_id)
+            found = [run] if run else []
+        else:
+            found = EvaluationRun.query.filter_by(status='running').order_by(EvaluationRun.id).all()
+        if not found:
+            click.echo("No evaluation runs in progress." if run_id is None else f"EvaluationRun {run_id} not found.")
+            return
+        for run in found:
+            p = progress(run)
+            eta = f"{p['eta_seconds'] // 60}m{p['eta_seconds'] % 60:02d}s" if p['eta_seconds'] is not None else '-'
+            click.echo(f"Run {p['run_id']} ({p['label']}, {p['status']}): {p['finished']}/{p['pairs']} pairs ({p['percent']}%), "
+                       f"chunks {p['chunks']['done']} done / {p['chunks']['running']} running / {p['chunks']['queued']} queued, "
+                       f"{p['pairs_per_minute']} pairs/min, ETA {eta}")
+
+    @app.cli.command('pool-queues')
+    def pool_queues():
+        """
+        Scheduling pool queues of the evaluated models with their concurrency caps, one
+        "<queue> <cap>" line each: the workers `pool-workers` keeps running. Only these lines go to stdout.
+        """
+        from pools import all_pools, queue_name
+        for pool, cap in all_pools().items():
+            click.echo(f"{queue_name(pool)} {cap}")
+
+    @app.cli.command('pool-workers')
+    @click.option('--interval', default=None, type=int, help='Seconds between checks for new pools.')
+    def pool_workers(interval):
+        """Runs one Celery worker per scheduling pool, capped at its concurrency, and starts workers for new pools."""
+        from config import POOL_WORKER_CHECK_INTERVAL
+        from pools import supervise_workers
+        supervise_workers(interval or POOL_WORKER_CHECK_INTERVAL)
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'xlsx']), help='Defaults to the file extension.')
+    @click.option('--create-dimensions/--no-create-dimensions', default=True, show_default=True,
+                  help='Create missing L1/L2/L3 dimensions instead of rejecting their rows.')
+    @click.option('--allow-duplicates', is_flag=True, help='Also import questions whose dimension and content are already stored.')
+    def import_questions_command(path, fmt, create_dimensions, allow_duplicates):
+        """Bulk-imports questions from a CSV, JSONL or XLSX file, streaming it in batches."""
+        from importer import ImportFileError, detect_format, import_questions
+        try:
+            with open(path, 'rb') as stream:
+                report = import_questions(stream, fmt or detect_format(path), create_dimensions, not allow_duplicates)
+        except ImportFileError as e:
+            raise click.ClickException(str(e))
+        summary = report.summary()
+        click.echo(f"Imported {summary['imported']} questions, skipped {summary['duplicates']} duplicates, "
+                   f"rejected {summary['rejected']} rows, created {summary['dimensions_created']} dimensions.")
+        for line_number, reason in report.rejected:
+            click.echo(f"  line {line_number}: {reason}")
+        if report.rejected_count > len(report.rejected):
+            click.echo(f"  ... and {report.rejected_count - len(report.rejected)} more")
+
+    @app.cli.command('export')
+    @click.argument('kind', type=click.Choice(['answers', 'ratings', 'leaderboard']))
+    @click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv', 'parquet']), default='jsonl', show_default=True)
+    @click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True),
+                  help="Defaults to <kind>-<timestamp>.<format>; '-' for stdout.")
+    @click.option('--model', 'models', multiple=True, help='Model name; repeat for several.')
+    @click.option('--dimension', 'dimension_id', type=int, help='Dimension id; its whole subtree is exported.')
+    @click.option('--since', help='ISO date or datetime, inclusive.')
+    @click.option('--until', help='ISO date (whole day included) or datetime, exclusive.')
+    @click.option('--all-answers', is_flag=True, help='Include answers superseded by later runs.')
+    def export_command(kind, fmt, output, models, dimension_id, since, until, all_answers):
+        """Streams answers, ratings or leaderboard totals to a file, batch by batch."""
+        from werkzeug.datastructures import MultiDict
+        from exporter import ExportError, ExportFilters, export, filename
+        args = MultiDict([('model', name) for name in models])
+        for key, value in (('dim', dimension_id), ('since', since), ('until', until), ('all', '1' if all_answers else None)):
+            if value is not None:
+                args[key] = str(value)
+        try:
+            chunks = export(kind, fmt, ExportFilters(args))
+        except ExportError as e:
+            raise click.ClickException(str(e))
+        # Exports are large, so they go to a file unless stdout is asked for
+        output = output or filename(kind, fmt)
+        with click.open_file(output, 'wb') as stream:
+            written = 0
+            for chunk in chunks:
+                stream.write(chunk)
+                written += len(chunk)
+        if output != '-':
+            click.echo(f"Wrote {written} bytes of {kind} to {output}.")
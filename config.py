@@ -4,6 +4,23 @@ import os
 SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
 SQLALCHEMY_DATABASE_URI = 'sqlite:///evaluation.db'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': 20,
+    'max_overflow': 100,  # celery -P gevent -c 100 时每个协程都可能同时持有一个连接
+    'pool_timeout': 60,
+    'connect_args': {'timeout': 30, 'check_same_thread': False},
+}
+
+# SQLite 生产配置：WAL 下读写互不阻塞，写入排队等待 busy_timeout 而不是立即报 "database is locked"
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 30000,  # 毫秒
+    'synchronous': 'NORMAL',  # WAL 下不会损坏数据库，断电时最多丢失最近几次提交
+    'cache_size': -20000,  # 负数单位为 KiB，即每个连接 20MB 页缓存
+    'temp_store': 'MEMORY',
+}
+SQLITE_SERIALIZE_WRITES = True  # 同一进程内的写事务依次执行，不在 SQLite 锁上互相争抢；p99 提交延迟大降，中位延迟升高（见 sqlite_profile._write_lock）
+SQLITE_WRITE_LOCK_TIMEOUT = 60  # 等待进程内写锁的上限（秒），超时后交给 busy_timeout
 
 MAX_RETRIES = 3  # API调用最大重试次数
 
@@ -47,6 +64,14 @@ ai回答：{response}''',
 ai回答：{response}'''
 }
 
+# 按题型的生成参数：max_tokens/stop 会随请求发送；stream=True 时边读边检查，
+# 满足 early_stop 条件（'choice'：已给出完整的选项字母）即停止读取
+GENERATION_PROFILES = {
+    'objective': {'max_tokens': 32, 'stop': ['\n\n'], 'stream': True, 'early_stop': 'choice'},
+    'subjective': {'max_tokens': None, 'stop': None, 'stream': False},
+    'rating': {'max_tokens': 8, 'stop': None, 'stream': False},  # 评分模型只需输出一个数字
+}
+
 RATERS = {
     'objective': ['claude_rater'],
     'subjective': ['gemini_rater']
@@ -54,7 +79,9 @@ RATERS = {
 
 CONNECTION_ERROR_RETRIES = 5
 RATING_FAIL_RETRIES = 5
+RATING_DEADLINE = 300  # 单个答案所有评分模型（含重试）并行完成的截止时间（秒）
 
+REDIS_URL = 'redis://localhost:6379/0'
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
@@ -65,4 +92,90 @@ SUBJECTIVE_QUESTION_WEIGHT = 0.7
 OBJECTIVE_QUESTION_WEIGHT = 0.3
 
 # --- 新增配置 ---
-UPLOADED_ICONS_DEST = 'static/uploads/icons'
\ No newline at end of file
+UPLOADED_ICONS_DEST = 'static/uploads/icons'
+
+GENERATION_DEADLINE = 180  # 并发生成时单次调用的截止时间（秒）
+ASYNC_MAX_CONNECTIONS = 100  # 并发生成共享连接池的最大连接数
+
+# 按 base_url 配置的限流（每分钟请求数/令牌数），key_* 为单个API密钥的限额，None 表示不限
+# 令牌桶存放在 Redis 中，所有 worker 进程共用同一份额度；Redis 不可用时各进程暂时各自限流
+RATE_LIMITS = {
+    'default': {'rpm': None, 'tpm': None, 'key_rpm': None, 'key_tpm': None},
+    # 'https://api.deepseek.com/v1': {'rpm': 600, 'tpm': 1_000_000, 'key_rpm': 60, 'key_tpm': 200_000},
+}
+RATE_LIMIT_RETRIES = 8  # 429 错误的最大重试次数
+RATE_LIMIT_BACKOFF_BASE = 1.0  # 退避基数（秒）
+RATE_LIMIT_BACKOFF_MAX = 60.0  # 单次退避上限（秒）
+RATE_LIMIT_OUTPUT_TOKEN_ESTIMATE = 512  # 预估的输出令牌数，用于预占 tpm 额度
+
+KEY_POOL_EWMA_ALPHA = 0.2  # 密钥延迟/错误率的指数平滑系数
+KEY_BREAKER_FAILURES = 5  # 连续失败多少次后熔断该密钥
+KEY_BREAKER_COOLDOWN = 60  # 熔断后多少秒进入半开探测
+KEY_HEALTH_PUBLISH_INTERVAL = 5  # 密钥健康状态写入 Redis 的最小间隔（秒）；熔断状态变化时立即写入
+
+# LLM 响应缓存：None 为关闭，可选 'sqlite' 或 'redis'
+RESPONSE_CACHE_BACKEND = None
+RESPONSE_CACHE_PATH = 'instance/llm_response_cache.db'
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+RESPONSE_CACHE_MAX_ENTRIES = 100_000  # 超出后按最近最少使用淘汰
+
+RATING_MEMO_TTL = 7 * 24 * 3600  # 相同评分提示词的评分结果共享时长（秒）
+RATING_MEMO_LOCK_TIMEOUT = 600  # 评分进行中锁的过期时间，也是其他进程等待结果的上限（秒）
+
+# 公共榜单快照缓存：键中包含数据版本（Rating/维度/模型/设置变更后自增），版本不变则所有请求共享一次计算
+LEADERBOARD_CACHE_TTL = 24 * 3600  # 快照在 Redis 中的保存时长（秒）
+LEADERBOARD_CACHE_LOCK_TIMEOUT = 60  # 计算中锁的过期时间，也是其他请求等待结果的上限（秒）
+
+# 客观题本地评分：与默认评分标准一致时，直接比对选项字母，无法判定的再交给评分模型
+OBJECTIVE_LOCAL_SCORING = True
+OBJECTIVE_LOCAL_SCORES = {'match': 5.0, 'mismatch': 1.0, 'blank': 0.0}
+
+# 离线批量评测：按 base_url 选择批量后端，'openai' 使用 /v1/batches，'local' 为本地逐条调用的替代实现
+BATCH_BACKENDS = {
+    'default': 'local',
+    'https://api.openai.com/v1': 'openai',
+}
+BATCH_DIR = 'instance/batches'
+BATCH_COMPLETION_WINDOW = '24h'
+BATCH_POLL_INTERVAL = 300  # 轮询批量任务状态的间隔（秒）
+BATCH_INGEST_CHUNK = 500  # 结果入库时每批插入的行数
+UPDATE_ALL_MODE = 'realtime'  # 每周全量更新的方式：'realtime' 或 'batch'
+UPDATE_ALL_STRATEGY = 'force'  # 'smart' 只重新生成/评分指纹已过期的结果；'force' 清空后全部重新生成
+
+# 结果写入方式：'direct' 由任务逐条提交；'stream' 写入 Redis Stream，由 `flask result-writer` 单进程批量入库
+RESULT_WRITE_MODE = 'direct'
+RESULT_STREAM = 'results:stream'
+RESULT_STREAM_GROUP = 'result-writer'
+RESULT_WRITER_BATCH = 500  # 每批最多入库的消息数
+RESULT_WRITER_BLOCK_MS = 1000  # 没有新消息时阻塞等待的时长（毫秒）
+RESULT_WRITER_CLAIM_IDLE = 300  # 被其他 writer 读取后超过该时长（秒）仍未确认的消息会被接管
+
+# 评测运行：新结果先以非当前状态写入，整个运行完成后一次性替换旧结果，被替换的旧结果由后台分批清理
+RUN_DEADLINE = 24 * 3600  # 运行超过该时长（秒）仍未完成时，按已完成的部分结束
+RUN_GC_BATCH = 500  # 每个清理事务删除的旧答案数
+RUN_MAINTENANCE_MINUTES = 15  # 检查超时运行并清理旧结果的间隔（分钟）
+PLAN_CHUNK_SIZE = 25  # 全量/按模型/智能更新时每条任务消息处理的 (模型, 题目) 数
+# 异步扇出：整题重新生成（单题、批量选择、全量 force）交给 fanout 队列的 prefork worker（见 run.sh），
+# 一条消息里的所有 (模型, 题目) 在同一个事件循环里同时请求；这些请求只受 RATE_LIMITS 约束，不受调度池并发上限约束
+FANOUT_REGENERATION = True  # False 时整题重新生成也按调度池分块逐对执行
+FANOUT_CHUNK_SIZE = 200  # 每条扇出任务消息同时在途的 (模型, 题目) 数
+INFLIGHT_LOCK_TTL = RUN_DEADLINE  # (模型, 题目) 在途占用的最长时间（秒），到期后视为失效
+INFLIGHT_REQUEST_WINDOW = 60  # 同一更新请求在该时间（秒）内重复提交时忽略
+PROGRESS_CHANNEL = 'progress:events'  # 进度变化的 Redis 发布频道，页面通过 SSE 订阅
+PROGRESS_TTL = 7 * 24 * 3600  # Redis 中每个运行/题目的进度保留时长（秒）
+
+# 页面
+QUESTION_PAGE_SIZE = 50  # 问题列表每页的题目数
+ANSWER_PREVIEW_CHARS = 500  # 题目详情页每个回答先显示的字数，全文点击后再加载
+
+# 批量导入题目（CSV / JSONL / XLSX，XLSX 需要可选依赖 openpyxl）
+IMPORT_BATCH_SIZE = 1000  # 每个插入事务的题目数
+IMPORT_MAX_REJECTS = 200  # 导入报告中保留的被拒绝行数（总数照常统计）
+
+# 流式导出答案 / 评分 / 榜单（Parquet 需要可选依赖 pyarrow）
+EXPORT_BATCH_SIZE = 2000  # 每次从数据库读取并写出的行数（yield_per）
+
+# 调度池：每个池（LLM.pool，为空时是 base_url 的主机名）有自己的 Celery 队列 pool.<池名>，慢的提供商不会占满其他模型的槽位
+POOL_CONCURRENCY = {}  # 各池 worker 的并发数（celery -c），即该池同时执行的块数上限，如 {'api.openai.com': 50, 'slow-provider': 10}
+DEFAULT_POOL_CONCURRENCY = 20  # 未在 POOL_CONCURRENCY 中列出的池的并发上限
+POOL_WORKER_CHECK_INTERVAL = 30  # flask pool-workers 重新读取调度池、为新池启动 worker 的间隔（秒）
@@ -0,0 +1,120 @@
+# .\dimension_tree.py
+
+import logging
+
+from sqlalchemy import delete, insert, literal, select, true
+from sqlalchemy.orm import aliased
+
+from aggregates import drop_dimension_paths, refresh_dimension_paths
+from extensions import db
+from models import Dimension, DimensionClosure
+
+logger = logging.getLogger('dimension_tree')
+
+
+# --- 1. 查询 ---
+
+def subtree_query(dim_id: int):
+    return select(DimensionClosure.descendant_id).where(DimensionClosure.ancestor_id == dim_id)
+
+
+def ancestors_query(dim_id: int):
+    return select(DimensionClosure.ancestor_id).where(DimensionClosure.descendant_id == dim_id)
+
+
+def children_query(parent_id: int | None, level: int):
+    return select(Dimension).where(Dimension.parent == parent_id, Dimension.level == level)
+
+
+def subtree_ids(dim_id: int) -> list[int]:
+    """The dimension and everything below it."""
+    return list(db.session.scalars(subtree_query(dim_id)))
+
+
+def ancestor_ids(dim_id: int) -> list[int]:
+    """The dimension and everything above it."""
+    return list(db.session.scalars(ancestors_query(dim_id)))
+
+
+# --- 2. 增、移、删时同步闭包表 ---
+
+def add_dimension(dim: Dimension):
+    """Links a newly flushed dimension to itself and to every ancestor of its parent."""
+    db.session.execute(insert(DimensionClosure).values(
+        ancestor_id=dim.id, descendant_id=dim.id, depth=0, ancestor_level=dim.level
+    ))
+    if dim.parent is not None:
+        parent_rows = select(
+            DimensionClosure.ancestor_id,
+            literal(dim.id),
+            DimensionClosure.depth + 1,
+            DimensionClosure.ancestor_level
+        ).where(DimensionClosure.descendant_id == int(dim.parent))
+        db.session.execute(insert(DimensionClosure).from_select(
+            ['ancestor_id', 'descendant_id', 'depth', 'ancestor_level'], parent_rows
+        ))
+
+
+def move_dimension(dim: Dimension, new_parent_id: int):
+    """Re-parents a dimension with its whole subtree; ratings below it move to the new branch of the leaderboard."""
+    subtree = subtree_ids(dim.id)
+    old_ancestors = [a for a in ancestor_ids(dim.id) if a != dim.id]
+    db.session.execute(delete(DimensionClosure).where(
+        DimensionClosure.descendant_id.in_(subtree),
+        DimensionClosure.ancestor_id.in_(old_ancestors)
+    ))
+
+    above = aliased(DimensionClosure)
+    below = aliased(DimensionClosure)
+    # Every ancestor of the new parent × every node of the moved subtree
+    new_rows = select(
+        above.ancestor_id,
+        below.descendant_id,
+        above.depth + below.depth + 1,
+        above.ancestor_level
+    ).select_from(above).join(below, true())\
+     .where(above.descendant_id == new_parent_id, below.ancestor_id == dim.id)
+    db.session.execute(insert(DimensionClosure).from_select(
+        ['ancestor_id', 'descendant_id', 'depth', 'ancestor_level'], new_rows
+    ))
+
+    dim.parent = new_parent_id
+    refresh_dimension_paths(subtree)
+    logger.info(f"Moved dimension {dim.id} and {len(subtree) - 1} descendants under dimension {new_parent_id}.")
+
+
+def detach_dimension(dim: Dimension):
+    """
+    Called before a dimension is deleted. Its children lose their parent, so the whole
+    subtree is cut off from the dimension and its ancestors and leaves the leaderboard.
+    """
+    subtree = subtree_ids(dim.id)
+    db.session.execute(delete(DimensionClosure).where(
+        DimensionClosure.descendant_id.in_(subtree),
+        DimensionClosure.ancestor_id.in_(ancestor_ids(dim.id))
+    ))
+    drop_dimension_paths(subtree)
+
+
+# --- 3. 全量回填 ---
+
+def rebuild_closure() -> int:
+    """Recomputes the closure table from Dimension.parent; returns the row count."""
+    parents = dict(db.session.query(Dimension.id, Dimension.parent).all())
+    levels = dict(db.session.query(Dimension.id, Dimension.level).all())
+
+    rows = []
+    for dim_id in parents:
+        ancestor, depth, seen = dim_id, 0, set()
+        # Stops at a root, at a parent that no longer exists, or at a (corrupt) cycle
+        while ancestor in parents and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append({'ancestor_id': ancestor, 'descendant_id': dim_id, 'depth': depth, 'ancestor_level': levels[ancestor]})
+            ancestor, depth = parents[ancestor], depth + 1
+
+    db.session.execute(delete(DimensionClosure))
+    if rows:
+        db.session.execute(insert(DimensionClosure), rows)
+    db.session.commit()
+    logger.info(f"Rebuilt dimension closure: {len(rows)} rows for {len(parents)} dimensions.")
+    return len(rows)
@@ -0,0 +1,264 @@
+# .\exporter.py
+
+import codecs
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, true
+
+from aggregates import KEY_COLUMNS, VALUE_COLUMNS, _grouped_ratings
+from config import EXPORT_BATCH_SIZE
+from extensions import db
+from importer import PATH_SEPARATOR
+from models import Answer, Dimension, DimensionClosure, LeaderboardAggregate, LLM, Question, Rating
+from question_list import dimension_paths
+
+logger = logging.getLogger('exporter')
+
+FORMATS = {
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Columns of each export, with their types for the Parquet schema
+COLUMNS = {
+    'answers': [
+        ('answer_id', 'int'), ('question_id', 'int'), ('dimension', 'str'), ('question_type', 'str'),
+        ('question', 'str'), ('reference_answer', 'str'), ('model', 'str'), ('answer', 'str'),
+        ('run_id', 'int'), ('is_current', 'bool'), ('timestamp', 'datetime'),
+    ],
+    'ratings': [
+        ('rating_id', 'int'), ('answer_id', 'int'), ('question_id', 'int'), ('dimension', 'str'),
+        ('question_type', 'str'), ('question', 'str'), ('model', 'str'), ('rater', 'str'),
+        ('score', 'float'), ('is_responsive', 'bool'), ('comment', 'str'), ('timestamp', 'datetime'),
+    ],
+    'leaderboard': [
+        ('model', 'str'), ('level1', 'str'), ('level2', 'str'), ('level3', 'str'), ('question_type', 'str'),
+        ('rating_count', 'int'), ('responsive_count', 'int'), ('score_sum', 'float'), ('avg_score', 'float'),
+        ('response_rate', 'float'),
+    ],
+}
+KINDS = tuple(COLUMNS)
+
+
+class ExportError(ValueError):
+    """An export that cannot be produced: an unknown model, a malformed date or a missing optional package."""
+
+
+# --- 1. 过滤条件 ---
+
+def _parse_date(value: str | None, end: bool = False) -> datetime | None:
+    """An ISO date or datetime; a bare `until` date includes that whole day."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"'{value}' is not an ISO date (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS).")
+    return parsed + timedelta(days=1) if end and len(value) == 10 else parsed
+
+
+class ExportFilters:
+    """
+    The export's filters as they arrive in the query string (or from the CLI): `model` (a
+    model name, repeatable), `dim` (a dimension id, its whole subtree), `since` and `until`
+    (ISO dates, on the answer or rating time), and `all=1` to include superseded answers.
+    """
+    def __init__(self, args):
+        names = [name for name in args.getlist('model') if name]
+        self.llm_ids = None
+        if names:
+            ids = dict(db.session.query(LLM.name, LLM.id).filter(LLM.name.in_(names)))
+            unknown = [name for name in names if name not in ids]
+            if unknown:
+                raise ExportError(f"Unknown model(s): {', '.join(unknown)}.")
+            self.llm_ids = list(ids.values())
+        self.dimension_id = args.get('dim', type=int)
+        self.since = _parse_date(args.get('since'))
+        self.until = _parse_date(args.get('until'), end=True)
+        self.include_superseded = args.get('all') == '1'
+
+    def dated(self) -> bool:
+        return self.since is not None or self.until is not None
+
+    def criteria(self, llm_column, dimension_column, time_column=None) -> list:
+        criteria = []
+        if self.llm_ids is not None:
+            criteria.append(llm_column.in_(self.llm_ids))
+        if self.dimension_id is not None:
+            criteria.append(dimension_column.in_(
+                select(DimensionClosure.descendant_id).where(DimensionClosure.ancestor_id == self.dimension_id)
+            ))
+        if time_column is not None and self.since is not None:
+            criteria.append(time_column >= self.since)
+        if time_column is not None and self.until is not None:
+            criteria.append(time_column < self.until)
+        return criteria
+
+
+# --- 2. 分批读取 ---
+
+def answers_query(filters: ExportFilters):
+    query = select(
+        Answer.id, Answer.question_id, Answer.llm_id, Answer.content, Answer.run_id, Answer.is_current, Answer.timestamp,
+        Question.dimension_id, Question.question_type, Question.content.label('question'), Question.answer.label('reference_answer')
+    ).join(Question, Answer.question_id == Question.id)\
+     .where(*filters.criteria(Answer.llm_id, Question.dimension_id, Answer.timestamp))
+    if not filters.include_superseded:
+        query = query.where(Answer.is_current == true())
+    return query.order_by(Answer.id)
+
+
+def ratings_query(filters: ExportFilters):
+    query = select(
+        Rating.id, Rating.answer_id, Rating.llm_id.label('rater_id'), Rating.score, Rating.is_responsive, Rating.comment,
+        Rating.timestamp, Answer.question_id, Answer.llm_id, Question.dimension_id, Question.question_type,
+        Question.content.label('question')
+    ).join(Answer, Rating.answer_id == Answer.id)\
+     .join(Question, Answer.question_id == Question.id)\
+     .where(*filters.criteria(Answer.llm_id, Question.dimension_id, Rating.timestamp))
+    if not filters.include_superseded:
+        query = query.where(Answer.is_current == true())
+    return query.order_by(Rating.id)
+
+
+def leaderboard_query(filters: ExportFilters):
+    """The stored totals, or, with a date range, the same totals summed again from the ratings in it."""
+    if filters.dated():
+        return _grouped_ratings(*filters.criteria(Answer.llm_id, Question.dimension_id, Rating.timestamp))
+    agg = LeaderboardAggregate
+    return select(*[getattr(agg, column) for column in KEY_COLUMNS + VALUE_COLUMNS])\
+        .where(*filters.criteria(agg.llm_id, agg.l3_dim_id))\
+        .order_by(agg.llm_id, agg.l1_dim_id, agg.l2_dim_id, agg.l3_dim_id, agg.question_type)
+
+
+def batches(kind: str, filters: ExportFilters, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Yields the export's rows as lists of dicts, `batch_size` rows at a time, from one
+    query read with yield_per: memory is bounded by a batch whatever the number of rows.
+    Model names and dimension paths come from their small tables, read once up front.
+    """
+    models = dict(db.session.query(LLM.id, LLM.name))
+    paths = dimension_paths(PATH_SEPARATOR)
+    if kind == 'leaderboard':
+        names = dict(db.session.query(Dimension.id, Dimension.name))
+        query = leaderboard_query(filters)
+    else:
+        query = answers_query(filters) if kind == 'answers' else ratings_query(filters)
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        if kind == 'answers':
+            yield [{
+                'answer_id': row.id, 'question_id': row.question_id, 'dimension': paths.get(row.dimension_id),
+                'question_type': row.question_type, 'question': row.question, 'reference_answer': row.reference_answer,
+                'model': models.get(row.llm_id), 'answer': row.content, 'run_id': row.run_id,
+                'is_current': row.is_current, 'timestamp': row.timestamp,
+            } for row in partition]
+        elif kind == 'ratings':
+            yield [{
+                'rating_id': row.id, 'answer_id': row.answer_id, 'question_id': row.question_id,
+                'dimension': paths.get(row.dimension_id), 'question_type': row.question_type, 'question': row.question,
+                'model': models.get(row.llm_id), 'rater': models.get(row.rater_id), 'score': row.score,
+                'is_responsive': row.is_responsive, 'comment': row.comment, 'timestamp': row.timestamp,
+            } for row in partition]
+        else:
+            yield [{
+                'model': models.get(row.llm_id), 'level1': names.get(row.l1_dim_id), 'level2': names.get(row.l2_dim_id),
+                'level3': names.get(row.l3_dim_id), 'question_type': row.question_type,
+                'rating_count': row.rating_count, 'responsive_count': row.responsive_count, 'score_sum': row.score_sum,
+                'avg_score': row.score_sum / row.rating_count if row.rating_count else None,
+                'response_rate': row.responsive_count / row.rating_count if row.rating_count else None,
+            } for row in partition]
+
+
+# --- 3. 编码 ---
+
+def _jsonl(kind: str, row_batches):
+    for batch in row_batches:
+        yield ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in batch).encode('utf-8')
+
+
+def _csv(kind: str, row_batches):
+    # The BOM lets spreadsheet programs detect UTF-8; the importer strips it again
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=[name for name, _ in COLUMNS[kind]])
+    writer.writeheader()
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8')
+    for batch in row_batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that hands back what was written since the last drain, so Parquet can be streamed."""
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Parquet records column chunk offsets from the file position, so it must count everything ever written
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ModuleNotFoundError:
+        raise ExportError("Exporting Parquet needs the optional pyarrow package (pip install pyarrow).")
+    return pa, pq
+
+
+def _parquet(kind: str, row_batches):
+    pa, pq = _pyarrow()
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(), 'bool': pa.bool_(), 'datetime': pa.timestamp('us')}
+    schema = pa.schema([(name, types[type_]) for name, type_ in COLUMNS[kind]])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # One row group per batch, sent as soon as it is written
+        for batch in row_batches:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {'jsonl': _jsonl, 'csv': _csv, 'parquet': _parquet}
+
+
+def export(kind: str, fmt: str, filters: ExportFilters, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    The export as an iterator of encoded byte chunks, one per batch of rows. Nothing is read
+    until it is iterated, so a route can hand it straight to a streamed response; what can
+    fail up front (a missing pyarrow) fails here, before a status line has been sent.
+    """
+    if fmt == 'parquet':
+        _pyarrow()
+    logger.info(f"Exporting {kind} as {fmt}.")
+    return ENCODERS[fmt](kind, batches(kind, filters, batch_size))
+
+
+def filename(kind: str, fmt: str) -> str:
+    return f"{kind}-{datetime.now():%Y%m%d-%H%M%S}.{FORMATS[fmt][1]}"
@@ -5,9 +5,13 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_uploads import UploadSet, IMAGES
 from flask_wtf.csrf import CSRFProtect
+import redis
+from config import REDIS_URL
 
 # 1. 在这里实例化所有扩展对象
 db = SQLAlchemy()
 migrate = Migrate()
 csrf = CSRFProtect()
-icons = UploadSet('icons', IMAGES)
\ No newline at end of file
+icons = UploadSet('icons', IMAGES)
+# 共享的 Redis 连接（惰性连接，worker 与 web 进程都可使用）
+redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2)
\ No newline at end of file
@@ -0,0 +1,200 @@
+# .\fingerprints.py
+
+import hashlib
+import json
+import logging
+
+from sqlalchemy import or_, true, update
+
+from config import (
+    DEFAULT_CRITERIA,
+    DEFAULT_TOTAL_SCORE,
+    GENERATION_PROFILES,
+    OBJECTIVE_LOCAL_SCORES,
+    OBJECTIVE_LOCAL_SCORING,
+    QUESTION_TEMPLATE,
+    RATERS,
+    RATING_TEMPLATE
+)
+from extensions import db
+from models import Answer, LLM, Question, Rating, Setting
+from question_list import failed_answer
+from utils import RATING_FAILED, RATING_TIMED_OUT
+
+logger = logging.getLogger('fingerprints')
+
+
+# --- 1. 指纹 ---
+
+def _digest(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def answer_fingerprint(question_type: str, content: str, model: str, base_url: str) -> str:
+    """Everything that decides what a model is asked: prompt, generation parameters and endpoint."""
+    return _digest(QUESTION_TEMPLATE[question_type].format(content), GENERATION_PROFILES[question_type], model, base_url)
+
+
+def rating_fingerprint(question_type: str, content: str, standard_answer: str | None,
+                       criteria: str, total_score: float, raters: list[tuple]) -> str:
+    """
+    Everything besides the answer itself that decides its score. `raters` are the
+    (name, model, base_url) of the type's raters. A regenerated answer starts without
+    ratings, so the answer does not need to be part of it.
+    """
+    local_scoring = (OBJECTIVE_LOCAL_SCORING, OBJECTIVE_LOCAL_SCORES) if question_type == 'objective' else None
+    return _digest(
+        RATING_TEMPLATE[question_type], content, standard_answer if question_type == 'objective' else None,
+        criteria, float(total_score), sorted(raters), local_scoring
+    )
+
+
+def rating_context() -> dict[str, tuple]:
+    """(criteria, total_score, raters) per question type, as the rating step reads them."""
+    settings = {}
+    for setting in Setting.query.order_by(Setting.id):
+        settings.setdefault(setting.question_type, (setting.criteria, setting.total_score))
+    rater_rows = db.session.query(LLM.name, LLM.model, LLM.base_url)\
+        .filter(LLM.name.in_([name for names in RATERS.values() for name in names])).all()
+    context = {}
+    for question_type, names in RATERS.items():
+        criteria, total_score = settings.get(question_type, (DEFAULT_CRITERIA[question_type], DEFAULT_TOTAL_SCORE))
+        context[question_type] = (criteria, total_score, [tuple(row) for row in rater_rows if row.name in names])
+    return context
+
+
+def pair_fingerprints(pairs: list[tuple[int, int]]) -> dict[tuple[int, int], str]:
+    """Current answer fingerprint of each (llm_id, question_id) pair; pairs whose model or question is gone are left out."""
+    models = {row.id: row for row in db.session.query(LLM.id, LLM.model, LLM.base_url)
+              .filter(LLM.id.in_({llm_id for llm_id, _ in pairs}))}
+    question_ids = sorted({question_id for _, question_id in pairs})
+    questions = {}
+    for i in range(0, len(question_ids), 500):
+        for row in db.session.query(Question.id, Question.question_type, Question.content)\
+                .filter(Question.id.in_(question_ids[i:i + 500])):
+            questions[row.id] = row
+    fingerprints = {}
+    for llm_id, question_id in pairs:
+        model, question = models.get(llm_id), questions.get(question_id)
+        if model is not None and question is not None:
+            fingerprints[(llm_id, question_id)] = answer_fingerprint(
+                question.question_type, question.content, model.model, model.base_url
+            )
+    return fingerprints
+
+
+# --- 2. 过期检测 ---
+
+class UpdatePlan:
+    """What a smart update has to redo; everything else is up to date and skipped."""
+    def __init__(self):
+        self.regenerate = []  # (llm_id, question_id) pairs without an up-to-date answer, or with a failed one
+        self.rerate = []  # ids of up-to-date answers with a missing, stale or failed rating
+        self.stale_ratings = {}  # answer id -> ids of its stale ratings, deleted once the new rating is in
+        self.skipped = 0  # pairs whose answer and ratings are all up to date
+
+    def summary(self) -> dict:
+        return {'regenerate': len(self.regenerate), 'rerate': len(self.rerate), 'skipped': self.skipped}
+
+
+def _failed_rating():
+    """A rating some rater gave no score to; its score is short of that rater, or 0 with none left."""
+    return or_(*[Rating.comment.contains(f': {marker}', autoescape=True) for marker in (RATING_FAILED, RATING_TIMED_OUT)])
+
+
+def plan_update(question_ids: list[int] | None = None, llm_ids: list[int] | None = None) -> UpdatePlan:
+    """
+    Compares stored fingerprints with the current ones for every (model, question) pair in
+    scope. A failed answer or rating is redone too, as a forced update would, whatever its
+    fingerprint says.
+    """
+    context = rating_context()
+    rater_names = [name for names in RATERS.values() for name in names]
+    models = db.session.query(LLM.id, LLM.model, LLM.base_url).filter(LLM.name.notin_(rater_names))
+    if llm_ids is not None:
+        models = models.filter(LLM.id.in_(llm_ids))
+    models = models.all()
+
+    questions = db.session.query(Question.id, Question.question_type, Question.content, Question.answer)
+    # Only what is live counts; answers of a run in progress are not up to date until it finishes
+    answers = db.session.query(Answer.id, Answer.question_id, Answer.llm_id, Answer.fingerprint, failed_answer().label('failed'))\
+        .filter(Answer.llm_id.in_([m.id for m in models]), Answer.is_current == true())
+    ratings = db.session.query(Rating.id, Rating.answer_id, Rating.fingerprint, _failed_rating().label('failed'))\
+        .join(Answer, Rating.answer_id == Answer.id)\
+        .filter(Answer.llm_id.in_([m.id for m in models]), Answer.is_current == true())
+    if question_ids is not None:
+        questions = questions.filter(Question.id.in_(question_ids))
+        answers = answers.filter(Answer.question_id.in_(question_ids))
+        ratings = ratings.filter(Answer.question_id.in_(question_ids))
+
+    answers_by_pair = {}
+    for answer in answers:
+        answers_by_pair.setdefault((answer.llm_id, answer.question_id), []).append(answer)
+    ratings_by_answer = {}
+    for rating in ratings:
+        ratings_by_answer.setdefault(rating.answer_id, []).append(rating)
+
+    plan = UpdatePlan()
+    for question in questions.yield_per(1000):
+        criteria, total_score, raters = context[question.question_type]
+        expected_rating = rating_fingerprint(
+            question.question_type, question.content, question.answer, criteria, total_score, raters
+        )
+        for model in models:
+            expected_answer = answer_fingerprint(question.question_type, question.content, model.model, model.base_url)
+            existing = answers_by_pair.get((model.id, question.id), [])
+            if not existing or any(answer.fingerprint != expected_answer or answer.failed for answer in existing):
+                plan.regenerate.append((model.id, question.id))
+                continue
+            up_to_date = True
+            for answer in existing:
+                stale = [r.id for r in ratings_by_answer.get(answer.id, []) if r.fingerprint != expected_rating or r.failed]
+                if stale or not ratings_by_answer.get(answer.id):
+                    plan.rerate.append(answer.id)
+                    if stale:
+                        plan.stale_ratings[answer.id] = stale
+                    up_to_date = False
+            plan.skipped += up_to_date
+    logger.info(f"Update plan for {len(models)} models: {plan.summary()}.")
+    return plan
+
+
+# --- 3. 为已有结果补写指纹 ---
+
+def stamp_missing_fingerprints() -> tuple[int, int]:
+    """
+    Marks answers and ratings stored before fingerprints existed as up to date with the
+    current questions, models and criteria. Returns (answers, ratings) stamped.
+    """
+    context = rating_context()
+    models = {row.id: row for row in db.session.query(LLM.id, LLM.model, LLM.base_url)}
+    answer_rows, rating_rows = [], []
+    missing = db.session.query(
+        Answer.id, Answer.llm_id, Question.question_type, Question.content, Question.answer
+    ).join(Question, Answer.question_id == Question.id)\
+     .filter(Answer.fingerprint.is_(None))
+    for row in missing.yield_per(1000):
+        if row.llm_id in models:
+            model = models[row.llm_id]
+            answer_rows.append({
+                'id': row.id,
+                'fingerprint': answer_fingerprint(row.question_type, row.content, model.model, model.base_url)
+            })
+    missing = db.session.query(
+        Rating.id, Question.question_type, Question.content, Question.answer
+    ).join(Answer, Rating.answer_id == Answer.id)\
+     .join(Question, Answer.question_id == Question.id)\
+     .filter(Rating.fingerprint.is_(None))
+    for row in missing.yield_per(1000):
+        criteria, total_score, raters = context[row.question_type]
+        rating_rows.append({
+            'id': row.id,
+            'fingerprint': rating_fingerprint(row.question_type, row.content, row.answer, criteria, total_score, raters)
+        })
+    if answer_rows:
+        db.session.execute(update(Answer), answer_rows)
+    if rating_rows:
+        db.session.execute(update(Rating), rating_rows)
+    db.session.commit()
+    logger.info(f"Stamped fingerprints on {len(answer_rows)} answers and {len(rating_rows)} ratings.")
+    return len(answer_rows), len(rating_rows)
@@ -43,6 +43,7 @@ class LLMForm(FlaskForm):
     name = StringField('模型简称', validators=[DataRequired()])
     model = StringField('模型全称', validators=[DataRequired()])
     base_url = StringField('API基础URL', validators=[DataRequired()])
+    pool = StringField('调度池 (可选)', validators=[Optional()])
     api_keys = FieldList(
         StringField('API密钥', validators=[DataRequired()]),
         min_entries=1
@@ -0,0 +1,208 @@
+# .\importer.py
+
+import codecs
+import csv
+import hashlib
+import json
+import logging
+import os
+
+from sqlalchemy import insert
+
+from config import IMPORT_BATCH_SIZE, IMPORT_MAX_REJECTS
+from dimension_tree import add_dimension
+from extensions import db
+from models import Dimension, Question
+
+logger = logging.getLogger('importer')
+
+FORMATS = ('csv', 'jsonl', 'xlsx')
+QUESTION_TYPES = {'subjective': 'subjective', 'objective': 'objective', '主观题': 'subjective', '客观题': 'objective'}
+PATH_SEPARATOR = '/'
+
+
+class ImportFileError(ValueError):
+    """A file that cannot be imported at all, as opposed to a single rejected row."""
+
+
+# --- 1. 逐行读取 ---
+
+def detect_format(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    fmt = {'ndjson': 'jsonl', 'json': 'jsonl'}.get(extension, extension)
+    if fmt not in FORMATS:
+        raise ImportFileError(f"Unsupported file type '.{extension}'; expected one of {', '.join(FORMATS)}.")
+    return fmt
+
+
+def _csv_rows(stream):
+    # utf-8-sig drops the BOM spreadsheet programs put in front of CSV exports
+    reader = csv.DictReader(codecs.getreader('utf-8-sig')(stream))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _jsonl_rows(stream):
+    for line_number, line in enumerate(codecs.getreader('utf-8-sig')(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, {'__error__': f"invalid JSON: {e.msg}"}
+            continue
+        yield line_number, row if isinstance(row, dict) else {'__error__': 'not a JSON object'}
+
+
+def _xlsx_rows(stream):
+    try:
+        import openpyxl
+    except ModuleNotFoundError:
+        raise ImportFileError("Importing .xlsx files needs the optional openpyxl package (pip install openpyxl).")
+    # read_only streams the sheet row by row instead of building the whole workbook
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+        for line_number, values in enumerate(rows, start=2):
+            if any(value is not None for value in values):
+                yield line_number, {name: value for name, value in zip(header, values) if name}
+    finally:
+        workbook.close()
+
+
+READERS = {'csv': _csv_rows, 'jsonl': _jsonl_rows, 'xlsx': _xlsx_rows}
+
+
+# --- 2. 维度路径 ---
+
+class DimensionIndex:
+    """Every dimension by (parent id, name), read once; missing path segments are created on demand."""
+    def __init__(self, create: bool = True):
+        self.create = create
+        self.created = 0
+        self.by_parent = {(dim.parent, dim.name): dim.id
+                          for dim in db.session.query(Dimension.id, Dimension.parent, Dimension.name)}
+
+    def resolve(self, names: list[str]) -> int | None:
+        """Id of the level 3 dimension at the end of an L1/L2/L3 path; None if it is missing and may not be created."""
+        parent = None
+        for level, name in enumerate(names, start=1):
+            dim_id = self.by_parent.get((parent, name))
+            if dim_id is None:
+                if not self.create:
+                    return None
+                dim = Dimension(name=name, level=level, parent=parent)
+                db.session.add(dim)
+                db.session.flush()
+                add_dimension(dim)
+                dim_id = self.by_parent[(parent, name)] = dim.id
+                self.created += 1
+            parent = dim_id
+        return parent
+
+
+def _path(row: dict) -> list[str]:
+    if row.get('dimension'):
+        return [name.strip() for name in str(row['dimension']).split(PATH_SEPARATOR)]
+    return [str(row.get(column) or '').strip() for column in ('level1', 'level2', 'level3')]
+
+
+def _digest(dimension_id: int, content: str) -> bytes:
+    return hashlib.sha256(f"{dimension_id}\n{content}".encode('utf-8')).digest()[:12]
+
+
+# --- 3. 导入 ---
+
+class ImportReport:
+    """Outcome of an import; only the first IMPORT_MAX_REJECTS rejected rows are kept, all are counted."""
+    def __init__(self):
+        self.imported = 0
+        self.duplicates = 0
+        self.rejected_count = 0
+        self.rejected = []  # (line number, reason)
+        self.dimensions_created = 0
+
+    def reject(self, line_number: int, reason: str):
+        self.rejected_count += 1
+        if len(self.rejected) < IMPORT_MAX_REJECTS:
+            self.rejected.append((line_number, reason))
+
+    def summary(self) -> dict:
+        return {'imported': self.imported, 'duplicates': self.duplicates, 'rejected': self.rejected_count,
+                'dimensions_created': self.dimensions_created}
+
+
+def _validate(row: dict, dimensions: DimensionIndex) -> dict | str:
+    """The Question row to insert, or why the row is rejected."""
+    if '__error__' in row:
+        return row['__error__']
+    content = str(row.get('content') or '').strip()
+    if not content:
+        return 'content is empty'
+    question_type = QUESTION_TYPES.get(str(row.get('question_type') or '').strip().lower())
+    if question_type is None:
+        return f"question_type must be subjective or objective, got '{row.get('question_type')}'"
+    names = _path(row)
+    if len(names) != 3 or not all(names):
+        return f"dimension must be a path of three names 'L1{PATH_SEPARATOR}L2{PATH_SEPARATOR}L3'"
+    dimension_id = dimensions.resolve(names)
+    if dimension_id is None:
+        return f"dimension '{PATH_SEPARATOR.join(names)}' does not exist"
+    answer = str(row.get('answer') or '').strip() or None
+    return {
+        'dimension_id': dimension_id,
+        'question_type': question_type,
+        'content': content,
+        'answer': answer if question_type == 'objective' else None
+    }
+
+
+def import_questions(stream, fmt: str, create_dimensions: bool = True, skip_duplicates: bool = True,
+                     batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    Streams question rows from a CSV, JSONL or XLSX file into the database, `batch_size` rows
+    per INSERT and transaction, so memory stays bounded whatever the file size. Columns:
+    `dimension` ("L1/L2/L3", or `level1`, `level2`, `level3`), `question_type`, `content`
+    and `answer` (objective questions only). With `skip_duplicates`, questions whose
+    dimension and content are already stored, or earlier in the file, are skipped.
+    """
+    report = ImportReport()
+    dimensions = DimensionIndex(create=create_dimensions)
+    seen = set()
+    if skip_duplicates:
+        # A 12-byte digest per stored question, not the texts themselves
+        for question in db.session.query(Question.dimension_id, Question.content).yield_per(5000):
+            seen.add(_digest(question.dimension_id, question.content))
+
+    batch = []
+
+    def flush():
+        if batch:
+            db.session.execute(insert(Question), batch)
+        db.session.commit()
+        report.imported += len(batch)
+        batch.clear()
+
+    try:
+        for line_number, row in READERS[fmt](stream):
+            validated = _validate(row, dimensions)
+            if isinstance(validated, str):
+                report.reject(line_number, validated)
+                continue
+            if skip_duplicates:
+                digest = _digest(validated['dimension_id'], validated['content'])
+                if digest in seen:
+                    report.duplicates += 1
+                    continue
+                seen.add(digest)
+            batch.append(validated)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        db.session.rollback()
+        raise ImportFileError(f"Could not read the file after {report.imported} imported rows: {e}") from e
+    report.dimensions_created = dimensions.created
+    logger.info(f"Imported questions: {report.summary()}.")
+    return report
@@ -0,0 +1,80 @@
+# .\inflight.py
+
+import logging
+
+import redis
+
+from config import INFLIGHT_LOCK_TTL, INFLIGHT_REQUEST_WINDOW
+from extensions import redis_client
+from singleflight import _RELEASE_SCRIPT
+
+logger = logging.getLogger('inflight')
+
+PIPELINE_SIZE = 1000  # 每个 Redis 管道里的命令数
+
+
+def _pair_key(llm_id: int, question_id: int, fingerprint: str | None = None) -> str:
+    # The fingerprint is part of the key: once the question or model changed, the work in flight is not the work asked for
+    return f"inflight:pair:{llm_id}:{question_id}:{fingerprint or '-'}"
+
+
+# --- 1. (模型, 题目) 级别的去重 ---
+
+def claim(run_id: int, pairs: list[tuple[int, int, str | None]]) -> tuple[list[tuple[int, int, str | None]], dict[int, int]]:
+    """
+    Claims (llm_id, question_id, fingerprint) pairs for a run. Returns the pairs it now owns
+    and, for the rest, how many are already in flight under each other run: the caller
+    attaches to those runs instead of asking the models again. A claim lasts until the pair's
+    chunk releases it or INFLIGHT_LOCK_TTL passes, so a worker that died never blocks a pair
+    for good. If Redis is unreachable every pair is owned, i.e. no deduplication.
+    """
+    owned, attached = [], {}
+    try:
+        for i in range(0, len(pairs), PIPELINE_SIZE):
+            batch = pairs[i:i + PIPELINE_SIZE]
+            pipe = redis_client.pipeline(transaction=False)
+            for pair in batch:
+                pipe.set(_pair_key(*pair), run_id, nx=True, ex=INFLIGHT_LOCK_TTL)
+            taken = []
+            for pair, ok in zip(batch, pipe.execute()):
+                (owned if ok else taken).append(pair)
+            if taken:
+                pipe = redis_client.pipeline(transaction=False)
+                for pair in taken:
+                    pipe.get(_pair_key(*pair))
+                for pair, owner in zip(taken, pipe.execute()):
+                    if owner is None:
+                        owned.append(pair)  # finished and released in between, so this run redoes it
+                        continue
+                    attached[int(owner)] = attached.get(int(owner), 0) + 1
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable ({e}); run {run_id} claims its pairs without deduplication.")
+        return pairs, {}
+    return owned, attached
+
+
+def release(run_id: int, pairs: list[tuple[int, int, str | None]]):
+    """Releases the run's claims on pairs it has finished; claims retaken by another run are left alone."""
+    try:
+        for i in range(0, len(pairs), PIPELINE_SIZE):
+            pipe = redis_client.pipeline(transaction=False)
+            for pair in pairs[i:i + PIPELINE_SIZE]:
+                pipe.eval(_RELEASE_SCRIPT, 1, _pair_key(*pair), run_id)
+            pipe.execute()
+    except redis.RedisError as e:
+        # The claims expire on their own after INFLIGHT_LOCK_TTL
+        logger.warning(f"Could not release the claims of run {run_id}: {e}")
+
+
+# --- 2. 请求级别的防抖 ---
+
+def debounce(name: str, window: int = INFLIGHT_REQUEST_WINDOW) -> bool:
+    """
+    True for the first request named `name` within `window` seconds, False for repeats such
+    as a double-clicked button. Lets the request through if Redis is unreachable.
+    """
+    try:
+        return bool(redis_client.set(f"inflight:request:{name}", 1, nx=True, ex=window))
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable ({e}); not debouncing request '{name}'.")
+        return True
@@ -0,0 +1,167 @@
+# .\key_pool.py
+
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from config import (
+    KEY_POOL_EWMA_ALPHA,
+    KEY_BREAKER_FAILURES,
+    KEY_BREAKER_COOLDOWN,
+    KEY_HEALTH_PUBLISH_INTERVAL
+)
+from extensions import redis_client
+
+logger = logging.getLogger('key_pool')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def mask_key(api_key: str) -> str:
+    return f"...{api_key[-4:]}" if len(api_key) > 4 else '...'
+
+
+class KeyHealth:
+    """Rolling health of one API key plus its circuit breaker state."""
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.latency = None  # EWMA of successful call latency, in seconds
+        self.error_rate = 0.0  # EWMA of key-level failures (1.0 = every call fails)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.successes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= KEY_BREAKER_COOLDOWN:
+            self.state = HALF_OPEN
+            logger.info(f"Key {mask_key(self.api_key)} is half-open, sending a probe.")
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def cost(self) -> float:
+        # Untried keys cost nothing so every key gets measured; failures and queueing make a key dearer
+        latency = self.latency if self.latency is not None else 0.0
+        return (latency + 0.1) * (1 + self.in_flight) / max(0.05, 1.0 - self.error_rate)
+
+    def snapshot(self) -> dict:
+        return {
+            'key': mask_key(self.api_key),
+            'state': self.state,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'in_flight': self.in_flight,
+            'successes': self.successes,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+
+class KeyPool:
+    """
+    Routes each call to the healthiest key of a model instead of rotating blindly.
+    A key that fails KEY_BREAKER_FAILURES times in a row is taken out of rotation for
+    KEY_BREAKER_COOLDOWN seconds, then a single half-open probe decides whether it comes back.
+    """
+    def __init__(self, llm_id: int | None, api_keys: list[str]):
+        self.llm_id = llm_id
+        self.keys = [KeyHealth(api_key) for api_key in api_keys]
+        self.lock = threading.Lock()
+        self.last_published = 0.0
+        self.published_states = None
+
+    def acquire(self) -> int:
+        with self.lock:
+            now = time.monotonic()
+            states = [key.state for key in self.keys]
+            candidates = [i for i, key in enumerate(self.keys) if key.available(now)]
+            # available() moves breakers whose cooldown is over to half-open
+            changed = states != [key.state for key in self.keys]
+            if candidates:
+                index = min(candidates, key=lambda i: self.keys[i].cost())
+            else:
+                # Every breaker is open: rather than fail, use the key closest to its probe
+                index = min(range(len(self.keys)), key=lambda i: self.keys[i].opened_at)
+                logger.warning(f"All keys for LLM {self.llm_id} are open; falling back to {mask_key(self.keys[index].api_key)}.")
+            key = self.keys[index]
+            if key.state == HALF_OPEN:
+                key.probing = True
+            key.in_flight += 1
+        if changed:
+            self._publish()
+        return index
+
+    def release(self, index: int, ok: bool | None, latency: float, error: str | None = None):
+        """Returns a key after a call. ok=None means the call was abandoned and says nothing about the key."""
+        with self.lock:
+            key = self.keys[index]
+            key.in_flight -= 1
+            key.probing = False
+            if ok is None:
+                return
+            key.error_rate += KEY_POOL_EWMA_ALPHA * ((0.0 if ok else 1.0) - key.error_rate)
+            if ok:
+                key.successes += 1
+                key.consecutive_failures = 0
+                key.latency = latency if key.latency is None else key.latency + KEY_POOL_EWMA_ALPHA * (latency - key.latency)
+                if key.state != CLOSED:
+                    logger.info(f"Key {mask_key(key.api_key)} for LLM {self.llm_id} recovered; closing breaker.")
+                key.state = CLOSED
+            else:
+                key.failures += 1
+                key.consecutive_failures += 1
+                key.last_error = error
+                if key.state == HALF_OPEN or key.consecutive_failures >= KEY_BREAKER_FAILURES:
+                    if key.state != OPEN:
+                        logger.warning(f"Opening breaker for key {mask_key(key.api_key)} of LLM {self.llm_id} after {key.consecutive_failures} failures: {error}")
+                    key.state = OPEN
+                    key.opened_at = time.monotonic()
+        self._publish()
+
+    def snapshot(self) -> list[dict]:
+        with self.lock:
+            return [key.snapshot() for key in self.keys]
+
+    def _publish(self):
+        """
+        Mirrors the snapshot into Redis, so the web process can show what the workers see.
+        Breaker state changes are published at once; counters at most every KEY_HEALTH_PUBLISH_INTERVAL.
+        """
+        if self.llm_id is None:
+            return
+        snapshot = self.snapshot()
+        states = [key['state'] for key in snapshot]
+        now = time.monotonic()
+        if states == self.published_states and now - self.last_published < KEY_HEALTH_PUBLISH_INTERVAL:
+            return
+        self.last_published, self.published_states = now, states
+        try:
+            redis_client.set(f"key_health:{self.llm_id}", json.dumps(snapshot), ex=3600)
+        except redis.RedisError as e:
+            logger.debug(f"Could not publish key health for LLM {self.llm_id}: {e}")
+
+
+def load_key_health(local_pools: dict[int, KeyPool | None]) -> dict[int, list[dict]]:
+    """
+    Latest published health of each model's keys, from one MGET, falling back to this
+    process's own pool for models nothing was published for (or for all, if Redis is down).
+    """
+    llm_ids = list(local_pools)
+    published = [None] * len(llm_ids)
+    if llm_ids:
+        try:
+            published = redis_client.mget([f"key_health:{llm_id}" for llm_id in llm_ids])
+        except redis.RedisError as e:
+            logger.debug(f"Could not read key health: {e}")
+    return {
+        llm_id: json.loads(value) if value else (local_pools[llm_id].snapshot() if local_pools[llm_id] else [])
+        for llm_id, value in zip(llm_ids, published)
+    }
@@ -0,0 +1,110 @@
+# .\leaderboard_cache.py
+
+import hashlib
+import json
+import logging
+import threading
+
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import (
+    SUBJECTIVE_QUESTION_WEIGHT,
+    OBJECTIVE_QUESTION_WEIGHT,
+    LEADERBOARD_CACHE_TTL,
+    LEADERBOARD_CACHE_LOCK_TIMEOUT
+)
+from extensions import redis_client
+from models import Dimension, LeaderboardAggregate, LLM, Setting
+from singleflight import SingleFlight
+from utils import generate_leaderboard_data
+
+logger = logging.getLogger('leaderboard_cache')
+
+VERSION_KEY = 'leaderboard:data_version'
+CHANGED_FLAG = 'leaderboard_changed'  # session.info 标记：本事务改动了榜单依赖的数据
+# Not Rating: most ratings belong to answers of a run in progress and cannot move the board.
+# The aggregate writes (aggregates._apply_deltas) flag the session themselves when they do
+WATCHED_MODELS = (LeaderboardAggregate, Dimension, LLM, Setting)
+
+leaderboard_flight = SingleFlight(
+    'leaderboard',
+    ttl=LEADERBOARD_CACHE_TTL,
+    lock_timeout=LEADERBOARD_CACHE_LOCK_TIMEOUT,
+    wait_timeout=LEADERBOARD_CACHE_LOCK_TIMEOUT
+)
+
+# Used when Redis is unreachable; only this process then sees its own bumps
+_local_version = 0
+# The last snapshot this process served, so a warm hit costs one Redis GET for the version
+_local_snapshot: tuple[str, dict] | None = None
+_local_lock = threading.Lock()
+
+
+# --- 1. 数据版本 ---
+
+def mark_changed(session: Session):
+    """Flags the session so its next commit bumps the data version (for writes the flush hook cannot see)."""
+    session.info[CHANGED_FLAG] = True
+
+
+def bump_data_version():
+    global _local_version
+    with _local_lock:
+        _local_version += 1
+    try:
+        version = redis_client.incr(VERSION_KEY)
+        logger.debug(f"Leaderboard data version bumped to {version}.")
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump leaderboard data version in Redis: {e}")
+
+
+def data_version() -> str:
+    try:
+        return str(int(redis_client.get(VERSION_KEY) or 0))
+    except redis.RedisError as e:
+        logger.warning(f"Could not read leaderboard data version from Redis: {e}")
+        return f"local-{_local_version}"
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_changes(session, flush_context):
+    if any(isinstance(obj, WATCHED_MODELS) for obj in (*session.new, *session.dirty, *session.deleted)):
+        mark_changed(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_on_commit(session):
+    if session.info.pop(CHANGED_FLAG, False):
+        bump_data_version()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_on_rollback(session):
+    session.info.pop(CHANGED_FLAG, None)
+
+
+# --- 2. 共享快照 ---
+
+def _cache_key(rater_names: list[str]) -> str:
+    # The weights are code, not data: a deploy that changes them must not serve old snapshots
+    inputs = json.dumps([sorted(rater_names), SUBJECTIVE_QUESTION_WEIGHT, OBJECTIVE_QUESTION_WEIGHT])
+    return f"{data_version()}:{hashlib.sha256(inputs.encode('utf-8')).hexdigest()[:16]}"
+
+
+def get_leaderboard_data(rater_names: list[str]) -> dict:
+    """
+    generate_leaderboard_data, computed once per data version and shared by every
+    route and worker process. Concurrent misses wait for the one computation in flight.
+    The result is shared between requests, so callers must not mutate it.
+    """
+    global _local_snapshot
+    key = _cache_key(rater_names)
+    snapshot = _local_snapshot
+    if snapshot is not None and snapshot[0] == key:
+        return snapshot[1]
+
+    data = leaderboard_flight.do(key, lambda: generate_leaderboard_data(rater_names))
+    _local_snapshot = (key, data)
+    return data
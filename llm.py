@@ -1,35 +1,100 @@
+import asyncio
+import contextlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 import openai
 import httpx
 import ast  # Import the Abstract Syntax Tree module for safe literal evaluation
-from config import CONNECTION_ERROR_RETRIES
+from typing import AsyncIterator
+from config import CONNECTION_ERROR_RETRIES, GENERATION_DEADLINE, ASYNC_MAX_CONNECTIONS, RATE_LIMIT_RETRIES
+from rate_limit import rate_limiter, retry_after_seconds, backoff_with_jitter
+from key_pool import KeyPool
+from response_cache import response_cache
+from objective_scorer import choice_is_complete
 import logging
 
 logger = logging.getLogger('llm_clients')
 
+# Answers stored in place of a model response when a call fails. Anything starting
+# with one of these markers is a client-side failure, not something the model said.
+FAILURE_MARKERS = (
+    "Connection error",
+    "API Error:",
+    "Unexpected client error",
+    "Failed to get response",
+    "No choices in response",
+    "Response parsing failed completely",
+    "Deadline exceeded",
+    "Rate limit exceeded",
+)
+
+
+# Streaming stop conditions a generation profile can name in 'early_stop'
+EARLY_STOP_CHECKS = {
+    'choice': choice_is_complete,
+}
+
+# Errors that say something about the key (or its route) rather than the prompt
+KEY_FAILURES = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.InternalServerError,
+)
+
+
+def is_failed_response(content: str) -> bool:
+    return content is None or content.startswith(FAILURE_MARKERS)
+
+
+def asyncio_safe() -> bool:
+    """
+    Whether asyncio.run() can be used here. Not inside a running loop, and not in a gevent
+    worker: its greenlets share one OS thread, so one greenlet's loop, parked while gevent
+    runs another, looks to the next asyncio.run() like a loop already running.
+    """
+    try:
+        asyncio.get_running_loop()
+        return False
+    except RuntimeError:
+        pass
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    return gevent_monkey is None or not gevent_monkey.is_module_patched('socket')
+
+
 class LLMClient:
     clients: list[openai.OpenAI] = []
     
-    def __init__(self, name: str, model: str, base_url: str, api_keys: list[str], proxy: str):
+    def __init__(self, name: str, model: str, base_url: str, api_keys: list[str], proxy: str, llm_id: int = None):
         self.clients = [
             self.create_client(base_url, api_key, proxy)
             for api_key in api_keys
         ]
         self.name = name
         self.model = model
-        self.index = -1
+        self.base_url = base_url
+        self.api_keys = list(api_keys)
+        self.proxy = proxy if proxy else None
+        self.key_pool = KeyPool(llm_id, self.api_keys)
         
     def create_client(self, base_url: str, api_key: str, proxy: str) -> openai.OpenAI:
+        # Retries are owned by generate_response so they go through the rate limiter
         return openai.OpenAI(
             api_key=api_key,
             base_url=base_url,
+            max_retries=0,
             http_client=httpx.Client(proxy = proxy if proxy else None)
         )
-    
-    @property
-    def client(self) -> openai.OpenAI:
-        self.index = (self.index + 1) % len(self.clients)
-        logger.debug(f"Using API key index {self.index} for model {self.name}.")
-        return self.clients[self.index]
+
+    def create_async_client(self, api_key: str, http_client: httpx.AsyncClient) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=self.base_url,
+            max_retries=0,
+            http_client=http_client
+        )
 
     def _parse_detailed_error(self, e: openai.APIError) -> str:
         """
@@ -60,40 +125,60 @@ class LLMClient:
         
         return message_str # Ultimate fallback
 
-    def generate_response(self, prompt: str) -> str:
-        response = None
-        # Requirement 1: Retry APIConnectionError up to CONNECTION_ERROR_RETRIES times
-        for i in range(CONNECTION_ERROR_RETRIES):
-            try:
-                logger.debug(f"Attempting to generate response for model {self.name}. Try {i+1}/{CONNECTION_ERROR_RETRIES}.")
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{'role': 'user', 'content': prompt}]
-                )
-                break  # Success, exit the retry loop
-
-            except openai.APIConnectionError as e:
-                logger.warning(f"APIConnectionError for model {self.name} on try {i+1}. Error: {e}")
-                if i == CONNECTION_ERROR_RETRIES - 1:
-                    logger.error(f"Connection finally failed for model {self.name} after {CONNECTION_ERROR_RETRIES} retries.")
-                    return "Connection error"
-                # Continue to the next iteration to retry
-            
-            # Requirement 2 & 4: Handle fatal (non-retryable) API errors
-            except (openai.InternalServerError, openai.BadRequestError) as e:
-                detailed_message = self._parse_detailed_error(e)
-                logger.error(f"Fatal API Error for model {self.name} (BadRequest/InternalServer): {detailed_message}")
-                return f"API Error: {detailed_message}" # Exit immediately, do not retry
-            
-            except openai.APIError as e: # Catch any other OpenAI API errors
+    def _handle_error(self, e: Exception, retries: dict, api_key: str) -> str | float:
+        """
+        Maps an exception raised by a completion call to the error answer that gets stored,
+        or to the number of seconds to wait before retrying. `retries` counts attempts per error kind.
+        """
+        # Rate limits are queued, not stored: pause the key and retry after Retry-After plus jitter
+        if isinstance(e, openai.RateLimitError):
+            attempt = retries['rate_limit']
+            retries['rate_limit'] += 1
+            if attempt >= RATE_LIMIT_RETRIES - 1:
                 detailed_message = self._parse_detailed_error(e)
-                logger.error(f"Unhandled API Error for model {self.name}: {detailed_message}")
-                return f"API Error: {detailed_message}" # Exit immediately, do not retry
+                logger.error(f"Rate limit persisted for model {self.name} after {RATE_LIMIT_RETRIES} retries: {detailed_message}")
+                return f"Rate limit exceeded: {detailed_message}"
+            delay = backoff_with_jitter(attempt, retry_after_seconds(e.response.headers if e.response else None))
+            rate_limiter.penalize(self.base_url, api_key, delay)
+            logger.warning(f"RateLimitError for model {self.name} on try {attempt+1}. Retrying in {delay:.1f}s.")
+            return delay
 
-            except Exception as e:
-                logger.critical(f"An unexpected non-API error occurred for model {self.name}: {e}", exc_info=True)
-                return "Unexpected client error" # Exit immediately
+        # A revoked or unauthorised key is not the prompt's fault: try the model's other keys first
+        if isinstance(e, (openai.AuthenticationError, openai.PermissionDeniedError)) and retries['key'] < len(self.api_keys) - 1:
+            retries['key'] += 1
+            logger.warning(f"Key {e.status_code} error for model {self.name}; retrying with another key.")
+            return 0.0
+
+        # Requirement 1: Retry APIConnectionError up to CONNECTION_ERROR_RETRIES times
+        if isinstance(e, openai.APIConnectionError):
+            attempt = retries['connection']
+            retries['connection'] += 1
+            logger.warning(f"APIConnectionError for model {self.name} on try {attempt+1}. Error: {e}")
+            if attempt == CONNECTION_ERROR_RETRIES - 1:
+                logger.error(f"Connection finally failed for model {self.name} after {CONNECTION_ERROR_RETRIES} retries.")
+                return "Connection error"
+            return 0.0  # Continue to the next iteration to retry
+
+        # Requirement 2 & 4: Handle fatal (non-retryable) API errors
+        if isinstance(e, (openai.InternalServerError, openai.BadRequestError)):
+            detailed_message = self._parse_detailed_error(e)
+            logger.error(f"Fatal API Error for model {self.name} (BadRequest/InternalServer): {detailed_message}")
+            return f"API Error: {detailed_message}" # Exit immediately, do not retry
+
+        if isinstance(e, openai.APIError): # Catch any other OpenAI API errors
+            detailed_message = self._parse_detailed_error(e)
+            logger.error(f"Unhandled API Error for model {self.name}: {detailed_message}")
+            return f"API Error: {detailed_message}" # Exit immediately, do not retry
 
+        logger.critical(f"An unexpected non-API error occurred for model {self.name}: {e}", exc_info=e)
+        return "Unexpected client error" # Exit immediately
+
+    @staticmethod
+    def _used_tokens(response) -> int | None:
+        usage = getattr(response, 'usage', None)
+        return getattr(usage, 'total_tokens', None)
+
+    def _extract_content(self, response) -> str:
         if response is None:
             return "Failed to get response"
 
@@ -121,7 +206,161 @@ class LLMClient:
             
         return content
 
-# The 'Clients' class below remains unchanged.
+    def _cached(self, prompt: str, params: dict, use_cache: bool) -> tuple[str | None, str | None]:
+        """Returns (cache_key, cached content). With use_cache=False the read is skipped but the result is still stored."""
+        if not response_cache.enabled:
+            return None, None
+        cache_key = response_cache.make_key(self.model, self.base_url, prompt, params)
+        if not use_cache:
+            return cache_key, None
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Serving cached response for model {self.name}.")
+        return cache_key, cached
+
+    def _store(self, cache_key: str | None, content: str):
+        if cache_key is not None and not is_failed_response(content):
+            response_cache.set(cache_key, content)
+
+    @staticmethod
+    def _profile_params(profile: dict | None) -> dict:
+        """Sampling parameters sent with the request (and hashed into the cache key)."""
+        profile = profile or {}
+        return {k: profile[k] for k in ('max_tokens', 'stop') if profile.get(k) is not None}
+
+    def _stream_content(self, pieces: list[str], finish_reason: str | None) -> str:
+        content = ''.join(pieces)
+        if content:
+            logger.info(f"Successfully received streamed content from model {self.name}.")
+            return content
+        logger.warning(f"Stream from model {self.name} carried no content. Fallback to finish_reason: '{finish_reason}'")
+        return finish_reason or "No choices in response"
+
+    def _consume_stream(self, stream, early_stop) -> str:
+        pieces, finish_reason = [], None
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta
+                if delta and delta.content:
+                    pieces.append(delta.content)
+                    if early_stop and early_stop(''.join(pieces)):
+                        logger.debug(f"Early stop for model {self.name} after {len(pieces)} chunks.")
+                        break
+        finally:
+            stream.close()
+        return self._stream_content(pieces, finish_reason)
+
+    async def _aconsume_stream(self, stream, early_stop) -> str:
+        pieces, finish_reason = [], None
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta
+                if delta and delta.content:
+                    pieces.append(delta.content)
+                    if early_stop and early_stop(''.join(pieces)):
+                        logger.debug(f"Early stop for model {self.name} after {len(pieces)} chunks.")
+                        break
+        finally:
+            await stream.close()
+        return self._stream_content(pieces, finish_reason)
+
+    def generate_response(self, prompt: str, use_cache: bool = True, profile: dict | None = None) -> str:
+        """
+        `profile` is a GENERATION_PROFILES entry: max_tokens and stop are sent to the
+        provider; with stream=True the reply is read incrementally and abandoned as
+        soon as its 'early_stop' check is satisfied.
+        """
+        params = self._profile_params(profile)
+        stream = bool(profile and profile.get('stream'))
+        early_stop = EARLY_STOP_CHECKS.get(profile.get('early_stop')) if stream else None
+        cache_key, cached = self._cached(prompt, params, use_cache)
+        if cached is not None:
+            return cached
+
+        content = None
+        response = None
+        retries = {'connection': 0, 'rate_limit': 0, 'key': 0}
+        estimated_tokens = rate_limiter.estimate_tokens(prompt, params.get('max_tokens'))
+        while content is None:
+            index = self.key_pool.acquire()
+            api_key = self.api_keys[index]
+            queued_for = rate_limiter.reserve(self.base_url, api_key, estimated_tokens)
+            if queued_for > 0:
+                logger.debug(f"Rate limiter queued model {self.name} for {queued_for:.2f}s.")
+                time.sleep(queued_for)
+            started = time.monotonic()
+            try:
+                logger.debug(f"Attempting to generate response for model {self.name} with key index {index}. Retries so far: {retries}.")
+                response = self.clients[index].chat.completions.create(
+                    model=self.model,
+                    messages=[{'role': 'user', 'content': prompt}],
+                    stream=stream,
+                    **params
+                )
+                content = self._consume_stream(response, early_stop) if stream else self._extract_content(response)
+                self.key_pool.release(index, True, time.monotonic() - started)
+            except Exception as e:
+                self.key_pool.release(index, not isinstance(e, KEY_FAILURES), time.monotonic() - started, type(e).__name__)
+                outcome = self._handle_error(e, retries, api_key)
+                if isinstance(outcome, str):
+                    return outcome
+                time.sleep(outcome)
+
+        rate_limiter.settle(self.base_url, api_key, estimated_tokens, None if stream else self._used_tokens(response))
+        self._store(cache_key, content)
+        return content
+
+    async def agenerate_response(self, prompt: str, http_client: httpx.AsyncClient, use_cache: bool = True, profile: dict | None = None) -> str:
+        """Async twin of generate_response, sharing the caller's connection pool."""
+        params = self._profile_params(profile)
+        stream = bool(profile and profile.get('stream'))
+        early_stop = EARLY_STOP_CHECKS.get(profile.get('early_stop')) if stream else None
+        cache_key, cached = self._cached(prompt, params, use_cache)
+        if cached is not None:
+            return cached
+
+        content = None
+        response = None
+        retries = {'connection': 0, 'rate_limit': 0, 'key': 0}
+        estimated_tokens = rate_limiter.estimate_tokens(prompt, params.get('max_tokens'))
+        while content is None:
+            index = self.key_pool.acquire()
+            api_key = self.api_keys[index]
+            queued_for = rate_limiter.reserve(self.base_url, api_key, estimated_tokens)
+            if queued_for > 0:
+                await asyncio.sleep(queued_for)
+            client = self.create_async_client(api_key, http_client)
+            started = time.monotonic()
+            try:
+                logger.debug(f"Attempting to generate async response for model {self.name} with key index {index}. Retries so far: {retries}.")
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[{'role': 'user', 'content': prompt}],
+                    stream=stream,
+                    **params
+                )
+                content = await self._aconsume_stream(response, early_stop) if stream else self._extract_content(response)
+                self.key_pool.release(index, True, time.monotonic() - started)
+            except asyncio.CancelledError:
+                self.key_pool.release(index, None, time.monotonic() - started)
+                raise
+            except Exception as e:
+                self.key_pool.release(index, not isinstance(e, KEY_FAILURES), time.monotonic() - started, type(e).__name__)
+                outcome = self._handle_error(e, retries, api_key)
+                if isinstance(outcome, str):
+                    return outcome
+                await asyncio.sleep(outcome)
+
+        rate_limiter.settle(self.base_url, api_key, estimated_tokens, None if stream else self._used_tokens(response))
+        self._store(cache_key, content)
+        return content
+
 
 class Clients:
     clients: dict[int: LLMClient] = {}
@@ -137,19 +376,93 @@ class Clients:
     
     def create_client(self, id: int, name: str, model: str, base_url: str, api_keys: list[str], proxy: str):
         logger.info(f"Initializing client for model '{name}' (ID: {id}) with {len(api_keys)} API key(s).")
-        self.clients[id] = LLMClient(name, model, base_url, api_keys, proxy)
+        self.clients[id] = LLMClient(name, model, base_url, api_keys, proxy, llm_id=id)
+
+    def add_missing(self, llms):
+        """Creates clients for LLM rows this process has none for yet, e.g. models added after the worker started."""
+        for llm in llms:
+            if llm.id not in self.clients:
+                self.create_client(llm.id, llm.name, llm.model, llm.base_url, llm.api_keys, llm.proxy)
     
-    def generate_response(self, prompt: str, id: int) -> str:
-        return self.clients[id].generate_response(prompt)
+    def generate_response(self, prompt: str, id: int, use_cache: bool = True, profile: dict | None = None) -> str:
+        return self.clients[id].generate_response(prompt, use_cache=use_cache, profile=profile)
+
+    async def agenerate_responses(self, prompt: str, exclusions: list[int] = (), timeout: float = GENERATION_DEADLINE, use_cache: bool = True, profile: dict | None = None) -> AsyncIterator[tuple[int, str]]:
+        """
+        Sends one prompt to every client not in `exclusions` at once and yields
+        (id, content) pairs in completion order. A call still running after
+        `timeout` seconds yields "Deadline exceeded" instead of a response.
+        """
+        target_ids = [i for i in self.clients if i not in exclusions]
+        logger.info(f"Fanning out prompt to {len(target_ids)} models concurrently, excluding IDs: {exclusions}.")
+        async for client_id, content in self.agenerate([(i, i, prompt, profile) for i in target_ids], timeout, use_cache):
+            yield client_id, content
+
+    async def agenerate(self, calls: list[tuple], timeout: float = GENERATION_DEADLINE, use_cache: bool = True) -> AsyncIterator[tuple]:
+        """
+        The engine under agenerate_responses: runs every (key, client id, prompt, profile) call
+        at once over shared connection pools and yields (key, content) in completion order.
+        Prompts may differ per call, so one loop can keep several questions in flight.
+        """
+        if not calls:
+            return
+
+        async def call(http_client: httpx.AsyncClient, key, client_id: int, prompt: str, profile: dict | None) -> tuple:
+            llm_client = self.clients[client_id]
+            try:
+                content = await asyncio.wait_for(llm_client.agenerate_response(prompt, http_client, use_cache, profile), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Model {llm_client.name} did not answer within {timeout}s.")
+                content = f"Deadline exceeded ({timeout}s)"
+            return key, content
+
+        async with contextlib.AsyncExitStack() as stack:
+            # One shared pool per proxy: httpx binds the proxy to the transport, not the request
+            http_clients = {}
+            for proxy in {self.clients[client_id].proxy for _, client_id, _, _ in calls}:
+                http_clients[proxy] = await stack.enter_async_context(httpx.AsyncClient(
+                    proxy=proxy,
+                    limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS),
+                    timeout=httpx.Timeout(timeout)
+                ))
+            pending = [
+                asyncio.ensure_future(call(http_clients[self.clients[client_id].proxy], key, client_id, prompt, profile))
+                for key, client_id, prompt, profile in calls
+            ]
+            try:
+                for next_done in asyncio.as_completed(pending):
+                    yield await next_done
+            finally:
+                for task in pending:
+                    task.cancel()
     
-    def generate_responses(self, prompt: str, exclusions: list[int]) -> dict[int: str]:
+    def generate_responses(self, prompt: str, exclusions: list[int], timeout: float = GENERATION_DEADLINE, use_cache: bool = True, profile: dict | None = None) -> dict[int: str]:
+        if not asyncio_safe():
+            return self._generate_responses_sync(prompt, exclusions, timeout, use_cache, profile)
+
+        async def collect():
+            return {i: content async for i, content in self.agenerate_responses(prompt, exclusions, timeout, use_cache, profile)}
+
+        return asyncio.run(collect())
+
+    def _generate_responses_sync(self, prompt: str, exclusions: list[int], timeout: float, use_cache: bool, profile: dict | None) -> dict[int: str]:
+        """The same fan-out over the sync clients, one thread (a greenlet under gevent) per model, under the same deadline."""
+        target_ids = [i for i in self.clients if i not in exclusions]
+        logger.info(f"Fanning out prompt to {len(target_ids)} models on threads, excluding IDs: {exclusions}.")
+        if not target_ids:
+            return {}
+        executor = ThreadPoolExecutor(max_workers=len(target_ids))
+        futures = {executor.submit(self.generate_response, prompt, i, use_cache, profile): i for i in target_ids}
+        done, _ = wait(futures, timeout=timeout)
+        # Calls past the deadline are left to finish on their own; their results are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
         responses = {}
-        target_clients = [c for i, c in self.clients.items() if i not in exclusions]
-        logger.info(f"Generating responses from {len(target_clients)} models, excluding IDs: {exclusions}.")
-        for i in self.clients:
-            if i not in exclusions:
-                responses[i] = self.generate_response(prompt, i)
-        
+        for future, i in futures.items():
+            if future in done:
+                responses[i] = future.result()
+            else:
+                logger.error(f"Model {self.clients[i].name} did not answer within {timeout}s.")
+                responses[i] = f"Deadline exceeded ({timeout}s)"
         return responses
         
-clients = Clients()
\ No newline at end of file
+clients = Clients()
@@ -0,0 +1,41 @@
+"""add secondary indexes for hot queries
+
+Revision ID: 3c9e1f4a7b21
+Revises:
+Create Date: 2026-10-18 10:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f4a7b21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# (index name, table, columns, partial-index condition) — kept in step with the __table_args__ in models.py.
+# Databases created by db.create_all() already have them, hence if_not_exists.
+INDEXES = [
+    ('ix_dimension_parent_level', 'dimension', ['parent', 'level'], None),
+    ('ix_question_dimension_type', 'question', ['dimension_id', 'question_type'], None),
+    ('ix_answer_question_llm', 'answer', ['question_id', 'llm_id'], None),
+    ('ix_answer_llm_question', 'answer', ['llm_id', 'question_id'], None),
+    ('ix_rating_answer_score', 'rating', ['answer_id', 'score', 'is_responsive'], None),
+    ('ix_batch_job_open', 'batch_job', ['status'], "status IN ('submitted', 'completed')"),
+    ('ix_leaderboard_aggregate_l3', 'leaderboard_aggregate', ['l3_dim_id'], None),
+]
+
+
+def upgrade():
+    for name, table, columns, where in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True,
+                        sqlite_where=sa.text(where) if where else None)
+    # Refresh planner statistics so the new indexes are picked up straight away
+    op.execute(sa.text('ANALYZE'))
+
+
+def downgrade():
+    for name, table, columns, where in reversed(INDEXES):
+        op.drop_index(name, table_name=table, if_exists=True)
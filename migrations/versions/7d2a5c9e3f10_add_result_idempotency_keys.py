@@ -0,0 +1,34 @@
+"""add idempotency keys for the result writer
+
+Revision ID: 7d2a5c9e3f10
+Revises: 3c9e1f4a7b21
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2a5c9e3f10'
+down_revision = '3c9e1f4a7b21'
+branch_labels = None
+depends_on = None
+
+TABLES = ('answer', 'rating')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        # Databases created by db.create_all() already have the column
+        if 'idempotency_key' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('idempotency_key', sa.String(length=100), nullable=True))
+        op.create_index(f'ix_{table}_idempotency_key', table, ['idempotency_key'], unique=True, if_not_exists=True)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_idempotency_key', table_name=table, if_exists=True)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('idempotency_key')
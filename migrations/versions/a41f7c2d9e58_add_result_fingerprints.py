@@ -0,0 +1,32 @@
+"""add fingerprints to answers and ratings
+
+Revision ID: a41f7c2d9e58
+Revises: 7d2a5c9e3f10
+Create Date: 2026-10-18 14:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f7c2d9e58'
+down_revision = '7d2a5c9e3f10'
+branch_labels = None
+depends_on = None
+
+TABLES = ('answer', 'rating')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        # Databases created by db.create_all() already have the column
+        if 'fingerprint' not in {column['name'] for column in inspector.get_columns(table)}:
+            op.add_column(table, sa.Column('fingerprint', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('fingerprint')
@@ -0,0 +1,65 @@
+"""backfill dimension closure and leaderboard aggregates
+
+Revision ID: b6e1d9a4c027
+Revises: f7b3c1d8a25e
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1d9a4c027'
+down_revision = 'f7b3c1d8a25e'
+branch_labels = None
+depends_on = None
+
+
+# Plain SQL rather than dimension_tree / aggregates: those follow models.py, this has to match the schema as of this revision.
+# Walks every dimension up its parents; a parent that no longer exists ends the walk, and the depth bound stops a corrupt cycle.
+BACKFILL_CLOSURE = """
+INSERT INTO dimension_closure (ancestor_id, descendant_id, depth, ancestor_level)
+WITH RECURSIVE up(descendant_id, ancestor_id, depth) AS (
+    SELECT id, id, 0 FROM dimension
+    UNION ALL
+    SELECT up.descendant_id, parent.parent, up.depth + 1
+    FROM up JOIN dimension AS parent ON parent.id = up.ancestor_id
+    WHERE parent.parent IS NOT NULL AND up.depth < 10
+)
+SELECT up.ancestor_id, up.descendant_id, up.depth, ancestor.level
+FROM up JOIN dimension AS ancestor ON ancestor.id = up.ancestor_id
+"""
+
+# Same grouping as aggregates._grouped_ratings: ratings of current answers per (model, L1, L2, L3, question type)
+BACKFILL_AGGREGATES = """
+INSERT INTO leaderboard_aggregate (llm_id, l1_dim_id, l2_dim_id, l3_dim_id, question_type, score_sum, rating_count, responsive_count)
+SELECT answer.llm_id, l1.ancestor_id, l2.ancestor_id, question.dimension_id, question.question_type,
+       SUM(rating.score), COUNT(rating.id), SUM(CASE WHEN rating.is_responsive = 1 THEN 1 ELSE 0 END)
+FROM rating
+JOIN answer ON rating.answer_id = answer.id
+JOIN question ON answer.question_id = question.id
+JOIN dimension_closure AS l1 ON l1.descendant_id = question.dimension_id AND l1.ancestor_level = 1
+JOIN dimension_closure AS l2 ON l2.descendant_id = question.dimension_id AND l2.ancestor_level = 2
+WHERE answer.is_current = 1
+GROUP BY answer.llm_id, l1.ancestor_id, l2.ancestor_id, question.dimension_id, question.question_type
+"""
+
+
+def _empty(conn, table: str) -> bool:
+    return conn.execute(sa.text(f'SELECT 1 FROM {table} LIMIT 1')).first() is None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    # Both tables are derived; they are only filled here when a database from before them has data but they are empty
+    if inspector.has_table('dimension_closure') and _empty(conn, 'dimension_closure') and not _empty(conn, 'dimension'):
+        conn.execute(sa.text(BACKFILL_CLOSURE))
+    if inspector.has_table('leaderboard_aggregate') and _empty(conn, 'leaderboard_aggregate') and not _empty(conn, 'rating'):
+        conn.execute(sa.text(BACKFILL_AGGREGATES))
+
+
+def downgrade():
+    # Data only; flask rebuild-leaderboard and flask backfill-dimension-closure recompute both tables at any time
+    pass
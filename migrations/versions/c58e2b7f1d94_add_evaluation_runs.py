@@ -0,0 +1,57 @@
+"""add evaluation runs
+
+Revision ID: c58e2b7f1d94
+Revises: a41f7c2d9e58
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58e2b7f1d94'
+down_revision = 'a41f7c2d9e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # Databases created by db.create_all() already have the table and columns
+    if not inspector.has_table('evaluation_run'):
+        op.create_table(
+            'evaluation_run',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('label', sa.String(length=200), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('expected', sa.Integer(), nullable=False),
+            sa.Column('finished', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_evaluation_run_running', 'evaluation_run', ['created_at'], if_not_exists=True,
+                    sqlite_where=sa.text("status = 'running'"))
+
+    columns = {column['name'] for column in inspector.get_columns('answer')}
+    with op.batch_alter_table('answer') as batch_op:
+        if 'run_id' not in columns:
+            batch_op.add_column(sa.Column('run_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_answer_run_id', 'evaluation_run', ['run_id'], ['id'])
+        if 'is_current' not in columns:
+            # Every existing answer is live
+            batch_op.add_column(sa.Column('is_current', sa.Boolean(), nullable=False, server_default=sa.true()))
+    op.create_index('ix_answer_run', 'answer', ['run_id'], if_not_exists=True)
+    op.create_index('ix_answer_superseded', 'answer', ['is_current'], if_not_exists=True,
+                    sqlite_where=sa.text('is_current = 0'))
+
+
+def downgrade():
+    op.drop_index('ix_answer_superseded', table_name='answer', if_exists=True)
+    op.drop_index('ix_answer_run', table_name='answer', if_exists=True)
+    with op.batch_alter_table('answer') as batch_op:
+        batch_op.drop_column('is_current')
+        batch_op.drop_column('run_id')
+    op.drop_index('ix_evaluation_run_running', table_name='evaluation_run', if_exists=True)
+    op.drop_table('evaluation_run')
@@ -0,0 +1,30 @@
+"""add batch job run
+
+Revision ID: d2c7f4a9e613
+Revises: b6e1d9a4c027
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2c7f4a9e613'
+down_revision = 'b6e1d9a4c027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # Databases created by db.create_all() already have the column
+    if 'run_id' not in {column['name'] for column in inspector.get_columns('batch_job')}:
+        with op.batch_alter_table('batch_job') as batch_op:
+            batch_op.add_column(sa.Column('run_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_batch_job_run_id', 'evaluation_run', ['run_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('batch_job') as batch_op:
+        batch_op.drop_column('run_id')
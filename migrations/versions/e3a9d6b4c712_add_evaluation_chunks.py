@@ -0,0 +1,40 @@
+"""add evaluation chunks
+
+Revision ID: e3a9d6b4c712
+Revises: c58e2b7f1d94
+Create Date: 2026-10-18 18:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9d6b4c712'
+down_revision = 'c58e2b7f1d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() already have the table
+    if not sa.inspect(op.get_bind()).has_table('evaluation_chunk'):
+        op.create_table(
+            'evaluation_chunk',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('run_id', sa.Integer(), nullable=False),
+            sa.Column('priority', sa.Integer(), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=False),
+            sa.Column('pairs', sa.JSON(), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['run_id'], ['evaluation_run.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_evaluation_chunk_run_status', 'evaluation_chunk', ['run_id', 'status'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_evaluation_chunk_run_status', table_name='evaluation_chunk', if_exists=True)
+    op.drop_table('evaluation_chunk')
@@ -0,0 +1,36 @@
+"""add scheduling pools
+
+Revision ID: f7b3c1d8a25e
+Revises: e3a9d6b4c712
+Create Date: 2026-10-18 20:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b3c1d8a25e'
+down_revision = 'e3a9d6b4c712'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('llm', sa.Column('pool', sa.String(length=50), nullable=True)),
+    ('evaluation_chunk', sa.Column('queue', sa.String(length=80), nullable=True)),
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for table, column in COLUMNS:
+        # Databases created by db.create_all() already have the column
+        if column.name not in {existing['name'] for existing in inspector.get_columns(table)}:
+            op.add_column(table, column)
+
+
+def downgrade():
+    for table, column in reversed(COLUMNS):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column(column.name)
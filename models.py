@@ -19,9 +19,27 @@ class Dimension(db.Model):
     # 添加与Question的关系
     questions = db.relationship('Question', back_populates='dimension')
     
+    __table_args__ = (
+        db.Index('ix_dimension_parent_level', 'parent', 'level'),
+    )
+    
     def __repr__(self):
         return f'<Dimension {self.name} (Level {self.level})>'
 
+class DimensionClosure(db.Model):
+    """维度树的闭包表：每个维度与其所有祖先（含自身，depth=0）各占一行"""
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('dimension.id'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('dimension.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+    ancestor_level = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_dimension_closure_descendant_level', 'descendant_id', 'ancestor_level'),
+    )
+
+    def __repr__(self):
+        return f'<DimensionClosure {self.ancestor_id} -> {self.descendant_id} (depth {self.depth})>'
+
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     dimension_id = db.Column(db.Integer, db.ForeignKey('dimension.id'), nullable=False)
@@ -36,6 +54,17 @@ class Question(db.Model):
         foreign_keys=[dimension_id]
     )
     answers = db.relationship('Answer', back_populates='question', cascade="all, delete-orphan")
+    # 只含当前结果：评测运行进行中的新答案和已被替换、待清理的旧答案都不在其中
+    current_answers = db.relationship(
+        'Answer',
+        primaryjoin=lambda: db.and_(Question.id == Answer.question_id, Answer.is_current == db.true()),
+        viewonly=True
+    )
+    
+    __table_args__ = (
+        # 覆盖索引：按维度取题目及题型时无需回表
+        db.Index('ix_question_dimension_type', 'dimension_id', 'question_type'),
+    )
     
     def __repr__(self):
         return f'<Question {self.id}: {self.content[:50]}>'
@@ -46,11 +75,27 @@ class Answer(db.Model):
     llm_id = db.Column(db.Integer, db.ForeignKey('llm.id'), nullable=False)  # 确保有这个字段
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
+    idempotency_key = db.Column(db.String(100))  # 经结果队列写入时的去重键，直接写入时为空
+    fingerprint = db.Column(db.String(16))  # 生成时的题目/模板/模型指纹，与当前不一致即为过期
+    run_id = db.Column(db.Integer, db.ForeignKey('evaluation_run.id'))  # 所属评测运行，运行外直接写入的为空
+    is_current = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())  # 榜单与页面只读当前结果
     
     question = db.relationship('Question', back_populates='answers')
     ratings = db.relationship('Rating', back_populates='answer', cascade="all, delete-orphan")
     llm = db.relationship('LLM', backref='answers')  # 确保有这个关系
     
+    __table_args__ = (
+        # 按题目删除/轮询、按 (题目, 模型) 替换答案
+        db.Index('ix_answer_question_llm', 'question_id', 'llm_id'),
+        # 按模型批量更新、榜单按模型聚合
+        db.Index('ix_answer_llm_question', 'llm_id', 'question_id'),
+        db.Index('ix_answer_idempotency_key', 'idempotency_key', unique=True),
+        # 运行结束时按运行取新答案
+        db.Index('ix_answer_run', 'run_id'),
+        # 部分索引：后台清理只扫描已被替换的旧答案
+        db.Index('ix_answer_superseded', 'is_current', sqlite_where=db.text('is_current = 0')),
+    )
+    
     def __repr__(self):
         return f'<Answer by {self.llm.name} for Q{self.question_id}>'
 
@@ -62,10 +107,18 @@ class Rating(db.Model):
     comment = db.Column(db.Text)
     is_responsive = db.Column(db.Boolean, nullable=False)
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
+    idempotency_key = db.Column(db.String(100))  # 经结果队列写入时的去重键，直接写入时为空
+    fingerprint = db.Column(db.String(16))  # 评分时的题目/评分标准/评分模型指纹
     
     answer = db.relationship('Answer', back_populates='ratings')
     llm = db.relationship('LLM', backref='ratings')  # 新增关系
     
+    __table_args__ = (
+        # 覆盖索引：按答案删除评分、聚合分数时无需回表
+        db.Index('ix_rating_answer_score', 'answer_id', 'score', 'is_responsive'),
+        db.Index('ix_rating_idempotency_key', 'idempotency_key', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Rating {self.score} by {self.llm.name} for Answer {self.answer_id}>'
 
@@ -86,6 +139,7 @@ class LLM(db.Model):
     base_url = db.Column(db.String(200), nullable=False)
     api_keys = db.Column(MutableList.as_mutable(PickleType), nullable=False)  # 多个API密钥列表
     proxy = db.Column(db.String(200), default = '')  # 代理地址
+    pool = db.Column(db.String(50), nullable=True)  # 调度池（独立的 Celery 队列和并发上限）；为空时按 base_url 的主机名分池
     # --- 新增字段 ---
     desc = db.Column(db.Text, nullable=True)  # 模型描述
     icon = db.Column(db.String(100), nullable=True)  # 存储图标的文件名
@@ -94,4 +148,87 @@ class LLM(db.Model):
     
     
     def __repr__(self):
-        return f'<LLM {self.name} ({self.model})>'
\ No newline at end of file
+        return f'<LLM {self.name} ({self.model})>'
+
+class BatchJob(db.Model):
+    """一次离线批量生成任务（每个模型一个 JSONL 文件）"""
+    id = db.Column(db.Integer, primary_key=True)
+    llm_id = db.Column(db.Integer, db.ForeignKey('llm.id'), nullable=False)
+    backend = db.Column(db.String(20), nullable=False)  # 'openai' or 'local'
+    key_index = db.Column(db.Integer, nullable=False, default=0)  # 提交时使用的API密钥，轮询和下载必须用同一个
+    remote_id = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default='submitted')  # submitted / completed / ingested / failed
+    input_path = db.Column(db.String(300), nullable=False)
+    output_path = db.Column(db.String(300))
+    request_count = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    run_id = db.Column(db.Integer, db.ForeignKey('evaluation_run.id'))  # 入库所属的评测运行，首个分块写入前记录；中断后重试沿用它并跳过已写入的结果
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    llm = db.relationship('LLM', backref='batch_jobs')
+
+    __table_args__ = (
+        # Partial index: the poll only ever asks for open jobs, which are a handful among many finished ones
+        db.Index('ix_batch_job_open', 'status', sqlite_where=db.text("status IN ('submitted', 'completed')")),
+    )
+
+    def __repr__(self):
+        return f'<BatchJob {self.id} ({self.backend}:{self.status}) for LLM {self.llm_id}>'
+
+class EvaluationRun(db.Model):
+    """一次评测运行：新答案和评分先以非当前状态写入，全部完成后在一个事务内替换旧结果"""
+    id = db.Column(db.Integer, primary_key=True)
+    label = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running / completed / superseded
+    expected = db.Column(db.Integer, nullable=False, default=0)  # 需要完成的 (模型, 题目) 数
+    finished = db.Column(db.Integer, nullable=False, default=0)  # 已完成（已评分或已放弃）的数目
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Partial index: the maintenance task only looks at runs still in progress
+        db.Index('ix_evaluation_run_running', 'created_at', sqlite_where=db.text("status = 'running'")),
+    )
+
+    def __repr__(self):
+        return f'<EvaluationRun {self.id} ({self.status}): {self.finished}/{self.expected} {self.label}>'
+
+class EvaluationChunk(db.Model):
+    """评测运行计划中的一块：一条 Celery 消息处理的一组 (模型, 题目)"""
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('evaluation_run.id'), nullable=False)
+    priority = db.Column(db.Integer, nullable=False)  # 0 最先：新模型/新题目，其次缺失的结果，最后是重跑
+    size = db.Column(db.Integer, nullable=False)
+    pairs = db.Column(db.JSON, nullable=False)  # [[llm_id, question_id, fingerprint], ...]
+    queue = db.Column(db.String(80), nullable=True)  # 投递的调度池队列，一块只含同一个池的模型
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued / running / done
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # 进度统计按运行汇总
+        db.Index('ix_evaluation_chunk_run_status', 'run_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<EvaluationChunk {self.id} of run {self.run_id} ({self.status}, priority {self.priority}): {self.size} pairs>'
+
+class LeaderboardAggregate(db.Model):
+    """按 (模型, 一/二/三级维度, 题型) 预聚合的评分，随 Rating 的增删在同一事务内更新"""
+    llm_id = db.Column(db.Integer, db.ForeignKey('llm.id'), primary_key=True)
+    l1_dim_id = db.Column(db.Integer, primary_key=True)
+    l2_dim_id = db.Column(db.Integer, primary_key=True)
+    l3_dim_id = db.Column(db.Integer, primary_key=True)
+    question_type = db.Column(db.String(20), primary_key=True)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    responsive_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # 维度移动/删除、按三级维度筛选榜单
+        db.Index('ix_leaderboard_aggregate_l3', 'l3_dim_id'),
+    )
+
+    def __repr__(self):
+        return f'<LeaderboardAggregate LLM {self.llm_id} L3 {self.l3_dim_id} ({self.question_type}): {self.rating_count}>'
@@ -0,0 +1,119 @@
+# .\objective_scorer.py
+
+import logging
+import re
+import threading
+import unicodedata
+
+from config import DEFAULT_CRITERIA, OBJECTIVE_LOCAL_SCORING, OBJECTIVE_LOCAL_SCORES
+
+logger = logging.getLogger('objective_scorer')
+
+REPORT_EVERY = 100  # 每做出多少次判定输出一次本地/回退比例
+
+# "B", "(B)", "【B】", "B.", "**B**" — the whole reply is one option
+_BARE_CHOICE = re.compile(r'^[\s\(\[{<（【「『"\'*`]*([A-Da-d])[\s\)\]}>）】」』"\'*`.。．,，、:：;；!！]*$')
+# "答案：B", "正确答案是 B", "Answer: (B)", "选B"
+_LABELLED_CHOICE = re.compile(
+    r'(?:正确答案|参考答案|最终答案|答案|正确选项|选项|选择|应选|选|(?i:answer\s*is|answer))\s*(?:是|为|应为|应该是|:|：)?\s*'
+    r'[\(\[（【「"\'*]*([A-D])(?![A-Za-z])'
+)
+# "B. 因为……", "B：……", "B) ..." — the reply opens with an option and explains it
+_LEADING_CHOICE = re.compile(r'^[\s\(\[（【*]*([A-D])(?:[\)\]）】*]*\s*[.．。、:：)）]|\s*$)')
+
+
+def normalize(text: str) -> str:
+    """NFKC folds full-width letters and punctuation (Ｂ，：) into their ASCII forms."""
+    return unicodedata.normalize('NFKC', text or '').strip()
+
+
+def extract_choice(text: str) -> str | None:
+    """The single option letter a reply commits to, or None if it is not unambiguous."""
+    text = normalize(text)
+    if not text:
+        return None
+
+    bare = _BARE_CHOICE.match(text)
+    if bare:
+        return bare.group(1).upper()
+
+    labelled = set(_LABELLED_CHOICE.findall(text))
+    if len(labelled) == 1:
+        return labelled.pop()
+    if len(labelled) > 1:
+        return None
+
+    leading = _LEADING_CHOICE.match(text)
+    if leading:
+        return leading.group(1)
+    return None
+
+
+def choice_is_complete(partial_text: str) -> bool:
+    """
+    True once a streamed reply has committed to an option and cannot turn into
+    something else — the letter must be followed by a non-letter ("B." not "Be").
+    """
+    text = normalize(partial_text)
+    if not extract_choice(text):
+        return False
+    return bool(re.search(r'[A-Da-d](?![A-Za-z])[^A-Za-z]', text))
+
+
+class ObjectiveScorer:
+    """
+    Scores objective answers without an LLM when the outcome is mechanical under the
+    default objective criteria: same letter as the reference, a different letter, or
+    an empty reply. Refusals and anything ambiguous return None for the LLM rater.
+    """
+    def __init__(self, scores: dict = OBJECTIVE_LOCAL_SCORES):
+        self.scores = scores
+        self.local = 0
+        self.fallback = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def applies_to(criteria: str) -> bool:
+        # Custom criteria may score these cases differently, so only the default is trusted
+        return OBJECTIVE_LOCAL_SCORING and normalize(criteria) == normalize(DEFAULT_CRITERIA['objective'])
+
+    def score(self, response: str, reference: str, criteria: str, total_score: float) -> float | None:
+        if not self.applies_to(criteria):
+            return None
+
+        score = None
+        reference_choice = extract_choice(reference)
+        if reference_choice is not None:
+            if not normalize(response):
+                score = self.scores['blank']
+            else:
+                response_choice = extract_choice(response)
+                if response_choice is not None:
+                    score = self.scores['match'] if response_choice == reference_choice else self.scores['mismatch']
+        if score is not None and not 0 <= score <= total_score:
+            score = None
+
+        self._record(score is not None)
+        return score
+
+    def _record(self, decided_locally: bool):
+        with self.lock:
+            if decided_locally:
+                self.local += 1
+            else:
+                self.fallback += 1
+            total = self.local + self.fallback
+            if total % REPORT_EVERY == 0:
+                logger.info(f"Objective scorer decided {self.local}/{total} ({self.local / total:.1%}) locally, {self.fallback} fell back to LLM raters.")
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.local + self.fallback
+            return {
+                'local': self.local,
+                'fallback': self.fallback,
+                'local_rate': self.local / total if total else 0.0,
+            }
+
+
+objective_scorer = ObjectiveScorer()
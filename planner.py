@@ -0,0 +1,151 @@
+# .\planner.py
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert, select, true
+
+from config import PLAN_CHUNK_SIZE
+from extensions import db
+from fingerprints import pair_fingerprints
+from models import Answer, EvaluationChunk, EvaluationRun
+import inflight
+import pools
+import progress_feed
+
+logger = logging.getLogger('planner')
+
+# Celery message priorities; on the Redis broker 0 is consumed first, and 0/3/6 are its default steps
+PRIORITY_NEW = 0  # the model or the question has no results at all yet
+PRIORITY_MISSING = 3  # only this pair has no result
+PRIORITY_REFRESH = 6  # the pair has a result that is being redone
+
+
+# --- 1. 计划 ---
+
+def prioritise(pairs: list[tuple[int, int]]) -> dict[int, list[tuple[int, int]]]:
+    """Splits (llm_id, question_id) pairs by priority, from one pass over the current answers in scope."""
+    llm_ids = {llm_id for llm_id, _ in pairs}
+    question_ids = {question_id for _, question_id in pairs}
+    answered = set()
+    query = select(Answer.llm_id, Answer.question_id)\
+        .where(Answer.is_current == true(), Answer.llm_id.in_(llm_ids))
+    for llm_id, question_id in db.session.execute(query).yield_per(5000):
+        if question_id in question_ids:
+            answered.add((llm_id, question_id))
+    models_with_results = {llm_id for llm_id, _ in answered}
+    questions_with_results = {question_id for _, question_id in answered}
+
+    by_priority = {PRIORITY_NEW: [], PRIORITY_MISSING: [], PRIORITY_REFRESH: []}
+    for llm_id, question_id in pairs:
+        if (llm_id, question_id) in answered:
+            priority = PRIORITY_REFRESH
+        elif llm_id not in models_with_results or question_id not in questions_with_results:
+            priority = PRIORITY_NEW
+        else:
+            priority = PRIORITY_MISSING
+        by_priority[priority].append((llm_id, question_id))
+    return by_priority
+
+
+def plan_run(label: str, pairs: list[tuple[int, int]], chunk_size: int = PLAN_CHUNK_SIZE,
+             queue: str | None = None) -> tuple[EvaluationRun | None, list[tuple[int, int, str]], dict[int, int]]:
+    """
+    Starts a run over the whole (model, question) work matrix and records it as chunks of
+    `chunk_size` pairs of one scheduling pool, highest priority first; with `queue`, every
+    chunk goes to that queue instead, mixing pools. Pairs another run already has in flight
+    with the same fingerprint are left to that run. Returns the run (None if every pair was
+    in flight), its (chunk id, priority, queue) list in dispatch order and the pairs
+    attached per other run.
+    """
+    fingerprints = pair_fingerprints(pairs)
+    run = EvaluationRun(label=label, expected=0)
+    db.session.add(run)
+    db.session.flush()
+    owned, attached = inflight.claim(run.id, [(*pair, fingerprints.get(pair)) for pair in pairs])
+    if attached:
+        logger.info(f"{sum(attached.values())} of {len(pairs)} pairs for '{label}' are already in flight; attached to runs {sorted(attached)}.")
+    if not owned:
+        db.session.rollback()
+        return None, [], attached
+
+    try:
+        run.expected = len(owned)
+        llm_ids = {llm_id for llm_id, _, _ in owned}
+        queues = pools.model_queues(llm_ids) if queue is None else dict.fromkeys(llm_ids, queue)
+        rows = []
+        for priority, priority_pairs in sorted(prioritise([(llm_id, question_id) for llm_id, question_id, _ in owned]).items()):
+            by_queue = {}
+            for pair in priority_pairs:
+                by_queue.setdefault(queues[pair[0]], []).append(pair)
+            for chunk_queue, group_pairs in sorted(by_queue.items()):
+                # Within a queue, pairs of one question stay together so a chunk reads few questions
+                group_pairs.sort(key=lambda pair: (pair[1], pair[0]))
+                for i in range(0, len(group_pairs), chunk_size):
+                    chunk = group_pairs[i:i + chunk_size]
+                    rows.append({'run_id': run.id, 'priority': priority, 'size': len(chunk), 'queue': chunk_queue,
+                                 'pairs': [[*pair, fingerprints.get(pair)] for pair in chunk]})
+        chunk_ids = list(db.session.scalars(insert(EvaluationChunk).returning(EvaluationChunk.id), rows))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        inflight.release(run.id, owned)
+        raise
+    progress_feed.queued(run.id, label, [(llm_id, question_id) for llm_id, question_id, _ in owned])
+    # RETURNING follows insertion order, which is dispatch order
+    chunks = [(chunk_id, row['priority'], row['queue']) for chunk_id, row in zip(chunk_ids, rows)]
+    logger.info(f"Planned EvaluationRun {run.id} ({label}): {len(owned)} pairs in {len(chunks)} chunks "
+                f"over {len({row['queue'] for row in rows})} pools.")
+    return run, chunks, attached
+
+
+# --- 2. 进度 ---
+
+def start_chunk(chunk_id: int) -> EvaluationChunk | None:
+    """
+    Marks a chunk as started and returns it; None if it is gone, already done (a redelivered
+    message) or its run was finished without it, e.g. at the deadline.
+    """
+    chunk = db.session.get(EvaluationChunk, chunk_id)
+    if chunk is None or chunk.status == 'done':
+        return None
+    if db.session.get(EvaluationRun, chunk.run_id).status != 'running':
+        finish_chunk(chunk)
+        return None
+    chunk.status, chunk.started_at = 'running', datetime.now()
+    db.session.commit()
+    return chunk
+
+
+def finish_chunk(chunk: EvaluationChunk):
+    chunk.status, chunk.finished_at = 'done', datetime.now()
+    db.session.commit()
+    inflight.release(chunk.run_id, chunk.pairs)
+
+
+def _chunk_counts_query(run_id: int):
+    return select(EvaluationChunk.status, db.func.count()).where(EvaluationChunk.run_id == run_id).group_by(EvaluationChunk.status)
+
+
+def _first_start_query(run_id: int):
+    return select(db.func.min(EvaluationChunk.started_at)).where(EvaluationChunk.run_id == run_id)
+
+
+def progress(run: EvaluationRun) -> dict:
+    """Pairs and chunks done so far, with an ETA extrapolated from the run's throughput."""
+    chunk_counts = dict(db.session.execute(_chunk_counts_query(run.id)).all())
+    started = db.session.scalar(_first_start_query(run.id))
+    elapsed = (datetime.now() - started).total_seconds() if started else 0.0
+    rate = run.finished / elapsed if elapsed > 0 and run.finished else 0.0
+    remaining = max(run.expected - run.finished, 0)
+    return {
+        'run_id': run.id,
+        'label': run.label,
+        'status': run.status,
+        'pairs': run.expected,
+        'finished': run.finished,
+        'percent': round(run.finished / run.expected * 100, 1) if run.expected else 100.0,
+        'chunks': {status: chunk_counts.get(status, 0) for status in ('queued', 'running', 'done')},
+        'pairs_per_minute': round(rate * 60, 1),
+        'eta_seconds': round(remaining / rate) if rate and run.status == 'running' else None
+    }
@@ -0,0 +1,87 @@
+# .\pools.py
+
+import logging
+import re
+import subprocess
+import time
+from urllib.parse import urlparse
+
+from config import DEFAULT_POOL_CONCURRENCY, POOL_CONCURRENCY, POOL_WORKER_CHECK_INTERVAL, RATERS
+from extensions import db
+from models import LLM
+
+logger = logging.getLogger('pools')
+
+QUEUE_PREFIX = 'pool.'
+DEFAULT_QUEUE = 'celery'  # Celery's default queue: rating, batch and maintenance tasks
+FANOUT_QUEUE = 'fanout'  # prefork workers running the asyncio fan-out engine, one event loop per process
+
+
+# --- 1. 模型 -> 调度池 -> 队列 ---
+
+def pool_name(pool: str | None, base_url: str) -> str:
+    """A model's scheduling pool: its explicit pool, else the host of its endpoint."""
+    name = (pool or '').strip() or urlparse(base_url).hostname or 'default'
+    return re.sub(r'[^a-z0-9._-]+', '-', name.lower())
+
+
+def queue_name(pool: str) -> str:
+    return f'{QUEUE_PREFIX}{pool}'
+
+
+def concurrency(pool: str) -> int:
+    return POOL_CONCURRENCY.get(pool, DEFAULT_POOL_CONCURRENCY)
+
+
+def model_queues(llm_ids=None) -> dict[int, str]:
+    """Queue of each model, all of them or those in `llm_ids`."""
+    query = db.session.query(LLM.id, LLM.pool, LLM.base_url)
+    if llm_ids is not None:
+        query = query.filter(LLM.id.in_(llm_ids))
+    return {row.id: queue_name(pool_name(row.pool, row.base_url)) for row in query}
+
+
+def all_pools() -> dict[str, int]:
+    """Every pool the evaluated models use, plus the configured ones, with their concurrency caps."""
+    rater_names = [name for names in RATERS.values() for name in names]
+    pools = {pool_name(row.pool, row.base_url)
+             for row in db.session.query(LLM.pool, LLM.base_url).filter(LLM.name.notin_(rater_names))}
+    return {pool: concurrency(pool) for pool in sorted(pools | set(POOL_CONCURRENCY))}
+
+
+# --- 2. 每个池一个 worker ---
+
+def worker_command(queue: str, cap: int) -> list[str]:
+    """A Celery worker that consumes only `queue`; its concurrency is the pool's cap."""
+    return ['celery', '-A', 'tasks.celery', 'worker', '--loglevel=info', '-P', 'gevent',
+            '-c', str(cap), '-Q', queue, '-n', f'{queue}@%h']
+
+
+def supervise_workers(interval: int = POOL_WORKER_CHECK_INTERVAL):
+    """
+    Keeps one worker running per scheduling pool. The pools are re-read every `interval`
+    seconds, so a model on a new provider gets a worker capped at its own pool's concurrency
+    without a restart, and a worker that exited is started again. Stopping the supervisor
+    stops its workers.
+    """
+    workers: dict[str, subprocess.Popen] = {}
+    try:
+        while True:
+            for pool, cap in all_pools().items():
+                queue = queue_name(pool)
+                worker = workers.get(queue)
+                if worker is not None and worker.poll() is None:
+                    continue
+                if worker is None:
+                    logger.info(f"Starting a worker for '{queue}' with concurrency {cap}.")
+                else:
+                    logger.warning(f"The worker for '{queue}' exited with code {worker.returncode}; starting it again.")
+                workers[queue] = subprocess.Popen(worker_command(queue, cap))
+            db.session.remove()  # the next pass sees models added in the meantime
+            time.sleep(interval)
+    finally:
+        for worker in workers.values():
+            worker.terminate()
+        for worker in workers.values():
+            worker.wait()
+
@@ -0,0 +1,163 @@
+# .\progress_feed.py
+
+import json
+import logging
+import time
+
+import redis
+
+from config import PROGRESS_CHANNEL, PROGRESS_TTL
+from extensions import redis_client
+
+logger = logging.getLogger('progress_feed')
+
+STATES = ('queued', 'generated', 'rated', 'failed')
+IN_FLIGHT = ('queued', 'generated')
+ACTIVE_KEY = 'progress:active'  # 还有 (模型, 题目) 在途的题目
+
+
+def _question_key(question_id: int) -> str:
+    return f'progress:question:{question_id}'
+
+
+def _run_key(run_id: int) -> str:
+    return f'progress:run:{run_id}'
+
+
+# --- 1. 记录：任务推进时写入 Redis ---
+
+def queued(run_id: int, label: str, pairs: list[tuple[int, int]]):
+    """
+    Marks a run's (llm_id, question_id) pairs as queued. Each question's hash holds one
+    state per model, so a new run over a pair replaces whatever an earlier run left there.
+    """
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(_run_key(run_id), mapping={'label': label, 'expected': len(pairs), 'queued': len(pairs)})
+        pipe.expire(_run_key(run_id), PROGRESS_TTL)
+        by_question = {}
+        for llm_id, question_id in pairs:
+            by_question.setdefault(question_id, {})[llm_id] = 'queued'
+        for question_id, models in by_question.items():
+            pipe.hset(_question_key(question_id), mapping={**models, 'run': run_id})
+            pipe.expire(_question_key(question_id), PROGRESS_TTL)
+        if by_question:
+            pipe.sadd(ACTIVE_KEY, *by_question)
+        pipe.publish(PROGRESS_CHANNEL, json.dumps({'run_id': run_id, 'question_ids': list(by_question)}))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record progress of run {run_id}: {e}")
+
+
+def record(run_id: int | None, question_id: int, llm_id: int, state: str):
+    """Moves one pair to `state` ('generated', 'rated' or 'failed'); pairs outside a run are not tracked."""
+    if run_id is None:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(_question_key(question_id), llm_id, state)
+        pipe.hincrby(_run_key(run_id), state, 1)
+        pipe.expire(_question_key(question_id), PROGRESS_TTL)
+        pipe.expire(_run_key(run_id), PROGRESS_TTL)
+        pipe.publish(PROGRESS_CHANNEL, json.dumps({'run_id': run_id, 'question_ids': [question_id]}))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record progress of Question {question_id}, Model {llm_id}: {e}")
+
+
+# --- 2. 读取 ---
+
+def _question_snapshot(fields: dict) -> dict | None:
+    if not fields:
+        return None
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    run_id = fields.pop('run', None)
+    counts = {state: 0 for state in STATES}
+    for state in fields.values():
+        counts[state] = counts.get(state, 0) + 1
+    if any(counts[state] for state in IN_FLIGHT):
+        status = '处理中'
+    else:
+        status = '失败' if counts['failed'] and not counts['rated'] else '已评估'
+    return {
+        'status': status,
+        'run_id': int(run_id) if run_id else None,
+        'models': {int(llm_id): state for llm_id, state in fields.items()},
+        'counts': counts
+    }
+
+
+def _run_snapshot(fields: dict) -> dict | None:
+    if not fields:
+        return None
+    fields = {key.decode(): value.decode() for key, value in fields.items()}
+    snapshot = {'label': fields.get('label'), 'expected': int(fields.get('expected', 0))}
+    snapshot.update({state: int(fields.get(state, 0)) for state in STATES})
+    return snapshot
+
+
+def snapshot(question_ids, run_ids=()) -> dict:
+    """
+    Progress of the given questions and runs, plus of every run those questions are in, from
+    one Redis round trip per kind. Questions and runs with nothing recorded are left out.
+    """
+    question_ids, run_ids = list(question_ids), set(run_ids)
+    pipe = redis_client.pipeline(transaction=False)
+    for question_id in question_ids:
+        pipe.hgetall(_question_key(question_id))
+    questions = {}
+    for question_id, fields in zip(question_ids, pipe.execute()):
+        question = _question_snapshot(fields)
+        if question is not None:
+            questions[question_id] = question
+            run_ids.add(question['run_id'])
+    run_ids = [run_id for run_id in run_ids if run_id is not None]
+    pipe = redis_client.pipeline(transaction=False)
+    for run_id in run_ids:
+        pipe.hgetall(_run_key(run_id))
+    runs = {run_id: run for run_id, run in zip(run_ids, map(_run_snapshot, pipe.execute())) if run is not None}
+    return {'questions': questions, 'runs': runs}
+
+
+def active_snapshot() -> dict:
+    """Progress of every question with pairs in flight; questions found finished leave the active set."""
+    question_ids = [int(question_id) for question_id in redis_client.smembers(ACTIVE_KEY)]
+    current = snapshot(question_ids)
+    finished = [question_id for question_id in question_ids
+                if current['questions'].get(question_id, {}).get('status') != '处理中']
+    if finished:
+        redis_client.srem(ACTIVE_KEY, *finished)
+    return current
+
+
+# --- 3. 推送 ---
+
+def events(window: float = 1.0, heartbeat: float = 15.0):
+    """
+    Yields Server-Sent Events: the progress of everything in flight at once, then the
+    changes every `window` seconds, coalesced so a busy run costs one message per window.
+    A comment goes out every `heartbeat` seconds of silence to keep proxies from closing it.
+    """
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(PROGRESS_CHANNEL)
+    try:
+        # retry: how long the browser waits before reconnecting, e.g. while Redis is down
+        yield f"retry: 10000\nevent: progress\ndata: {json.dumps(active_snapshot(), ensure_ascii=False)}\n\n"
+        last_sent = time.monotonic()
+        while True:
+            question_ids, run_ids = set(), set()
+            deadline = time.monotonic() + window
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = pubsub.get_message(timeout=remaining)
+                if message is not None:
+                    change = json.loads(message['data'])
+                    run_ids.add(change['run_id'])
+                    question_ids.update(change['question_ids'])
+            if question_ids or run_ids:
+                yield f"event: progress\ndata: {json.dumps(snapshot(question_ids, run_ids), ensure_ascii=False)}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+    finally:
+        pubsub.close()
@@ -0,0 +1,182 @@
+# .\query_plans.py
+
+import logging
+import os
+import random
+import tempfile
+
+from sqlalchemy import create_engine, delete, insert, text, update
+from werkzeug.datastructures import MultiDict
+
+from aggregates import (
+    KEY_COLUMNS, VALUE_COLUMNS, _grouped_ratings, _owners_query, _paths_query, _refresh_paths_statement
+)
+from batch import _run_answers_query, _stored_pairs_query, open_jobs_query
+from dimension_tree import ancestors_query, children_query, subtree_query
+from extensions import db
+from models import (
+    Answer, BatchJob, Dimension, DimensionClosure, EvaluationChunk, EvaluationRun, LeaderboardAggregate, LLM, Question,
+    Rating, Setting
+)
+from planner import _chunk_counts_query, _first_start_query
+from question_list import (
+    QuestionFilters, answer_previews_query, answer_ratings_query, answered_query, page_query, row_counts_query
+)
+from routes.leaderboard import totals_by_model_query
+from runs import _promoted_by, _retired_by, _superseded_answers
+from utils import leaderboard_totals_query
+
+logger = logging.getLogger('query_plans')
+
+# Small lookup tables that are read whole on purpose
+ALWAYS_ALLOWED_SCANS = {'setting'}
+# Tables that may be scanned only as the outer loop of a join: the leaderboards read every
+# model and seek their aggregate rows by llm_id. An llm scan anywhere else in a plan means
+# it is the inner table of a join, read once per outer row, and is flagged like any other.
+OUTER_LOOP_SCANS = {'llm'}
+
+
+# --- 1. 热点查询 ---
+
+def hot_queries() -> list[tuple[str, object]]:
+    """(name, statement) for every query that runs per request, per task or per rating, built by the code that issues it."""
+    ids = [1, 2, 3]
+    return [
+        ('question detail: answer previews', answer_previews_query(1)),
+        ('question detail: ratings of the answers', answer_ratings_query(ids)),
+        ('question status: answered questions', answered_query(ids)),
+        ('question list: filtered keyset page', page_query(
+            QuestionFilters(MultiDict({'dim': '1', 'type': 'subjective', 'state': 'evaluated'})), after=400)),
+        ('question list: per-row counts', row_counts_query(ids)),
+        ('aggregates: answer owners', _owners_query(ids)),
+        ('aggregates: question dimension paths', _paths_query(ids)),
+        ('aggregates: totals of replaced ratings', _grouped_ratings(Rating.id.in_(ids))),
+        ('aggregates: totals of deleted answers\' ratings', _grouped_ratings(Rating.answer_id.in_(ids))),
+        ('re-rate: delete replaced ratings', delete(Rating).where(Rating.id.in_(ids))),
+        ('dimensions: children of a dimension', children_query(1, 2)),
+        ('dimensions: subtree', subtree_query(1)),
+        ('dimensions: ancestors', ancestors_query(1)),
+        ('dimensions: refresh moved paths', _refresh_paths_statement(ids)),
+        ('public leaderboard: totals per model and L1', leaderboard_totals_query(ids)),
+        ('dev leaderboard: whole board', totals_by_model_query()),
+        ('dev leaderboard: filtered by dimension', totals_by_model_query(1)),
+        ('batch poll: open jobs', open_jobs_query()),
+        ('batch ingest: pairs stored by the run', _stored_pairs_query(1)),
+        ('batch ingest: answers of the run', _run_answers_query(1)),
+        ('run finish: totals of retired answers', _grouped_ratings(*_retired_by(1))),
+        ('run finish: retire replaced answers', update(Answer).where(*_retired_by(1)).values(is_current=False)),
+        ('run finish: totals of promoted answers', _grouped_ratings(*_promoted_by(1))),
+        ('run finish: promote the run\'s answers', update(Answer).where(*_promoted_by(1)).values(is_current=True)),
+        ('run cleanup: replaced answers', _superseded_answers(500)),
+        ('run progress: chunks by status', _chunk_counts_query(1)),
+        ('run progress: first chunk started', _first_start_query(1)),
+    ]
+
+
+# --- 2. 造数 ---
+
+def seed(engine, questions: int = 500, models: int = 8):
+    """Fills an empty schema with a realistic shape: 3×3×3 dimensions, every model answering and rated on every question."""
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        dims, closure, dim_id = [], [], 0
+        for i in range(3):
+            dim_id += 1
+            l1 = dim_id
+            dims.append({'id': l1, 'name': f'L1-{i}', 'level': 1, 'parent': None})
+            closure.append({'ancestor_id': l1, 'descendant_id': l1, 'depth': 0, 'ancestor_level': 1})
+            for j in range(3):
+                dim_id += 1
+                l2 = dim_id
+                dims.append({'id': l2, 'name': f'L2-{i}-{j}', 'level': 2, 'parent': l1})
+                closure += [{'ancestor_id': a, 'descendant_id': l2, 'depth': d, 'ancestor_level': lvl}
+                            for a, d, lvl in ((l2, 0, 2), (l1, 1, 1))]
+                for k in range(3):
+                    dim_id += 1
+                    dims.append({'id': dim_id, 'name': f'L3-{i}-{j}-{k}', 'level': 3, 'parent': l2})
+                    closure += [{'ancestor_id': a, 'descendant_id': dim_id, 'depth': d, 'ancestor_level': lvl}
+                                for a, d, lvl in ((dim_id, 0, 3), (l2, 1, 2), (l1, 2, 1))]
+        level3 = [d['id'] for d in dims if d['level'] == 3]
+        conn.execute(Dimension.__table__.insert(), dims)
+        conn.execute(DimensionClosure.__table__.insert(), closure)
+        conn.execute(LLM.__table__.insert(), [
+            {'id': m, 'name': f'model-{m}', 'model': f'model-{m}', 'base_url': 'http://localhost', 'api_keys': []}
+            for m in range(1, models + 1)
+        ])
+        conn.execute(Setting.__table__.insert(), [
+            {'question_type': t, 'criteria': '-', 'total_score': 5.0} for t in ('objective', 'subjective')
+        ])
+        conn.execute(Question.__table__.insert(), [
+            {'id': q, 'dimension_id': rng.choice(level3), 'question_type': rng.choice(['objective', 'subjective']), 'content': f'q{q}'}
+            for q in range(1, questions + 1)
+        ])
+        # One finished run per question, as process_question leaves them
+        conn.execute(EvaluationRun.__table__.insert(), [
+            {'id': q, 'label': f'question {q}', 'status': 'completed', 'expected': models, 'finished': models}
+            for q in range(1, questions + 1)
+        ])
+        conn.execute(EvaluationChunk.__table__.insert(), [
+            {'run_id': q, 'priority': 6, 'size': models, 'pairs': [[m, q] for m in range(1, models + 1)], 'status': 'done'}
+            for q in range(1, questions + 1)
+        ])
+        answers = [{'id': q * models + m, 'question_id': q, 'llm_id': m, 'content': 'a', 'run_id': q}
+                   for q in range(1, questions + 1) for m in range(1, models + 1)]
+        conn.execute(Answer.__table__.insert(), answers)
+        conn.execute(Rating.__table__.insert(), [
+            {'answer_id': a['id'], 'llm_id': a['llm_id'], 'score': rng.randint(0, 5), 'is_responsive': rng.random() > 0.2}
+            for a in answers
+        ])
+        conn.execute(insert(LeaderboardAggregate).from_select(KEY_COLUMNS + VALUE_COLUMNS, _grouped_ratings()))
+        conn.execute(BatchJob.__table__.insert(), [
+            # Finished jobs pile up; only a handful are ever open
+            {'llm_id': 1, 'backend': 'local', 'status': 'submitted' if i % 50 == 0 else 'ingested', 'input_path': '-'}
+            for i in range(500)
+        ])
+        conn.execute(text('ANALYZE'))
+    logger.info(f"Seeded query-plan database with {questions} questions and {models} models.")
+
+
+# --- 3. 检查 ---
+
+def explain(conn, statement) -> list[str]:
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}')]
+
+
+def table_scans(plan: list[str]) -> list[str]:
+    """Plan lines that read a whole table. A covering-index scan is still a scan; 'SEARCH' lines are seeks."""
+    scans = []
+    first_access = True
+    for detail in plan:
+        if not detail.startswith(('SCAN ', 'SEARCH ')) or detail.startswith('SCAN CONSTANT ROW'):
+            continue
+        table = detail.split()[1]
+        outer_loop, first_access = first_access, False
+        if not detail.startswith('SCAN ') or table in ALWAYS_ALLOWED_SCANS:
+            continue
+        if not (outer_loop and table in OUTER_LOOP_SCANS):
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(echo=print) -> int:
+    """Seeds a throwaway SQLite database and explains every hot query; returns the number of offending queries."""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='query-plans-')
+    os.close(fd)
+    engine = create_engine(f'sqlite:///{path}')
+    try:
+        db.metadata.create_all(engine)
+        seed(engine)
+        failures = 0
+        with engine.connect() as conn:
+            for name, statement in hot_queries():
+                plan = explain(conn, statement)
+                scans = table_scans(plan)
+                echo(f"[{'SCAN' if scans else 'ok'}] {name}")
+                for detail in plan:
+                    echo(f"    {detail}")
+                failures += bool(scans)
+        return failures
+    finally:
+        engine.dispose()
+        os.unlink(path)
@@ -0,0 +1,139 @@
+# .\question_list.py
+
+import logging
+
+from sqlalchemy import case, distinct, exists, func, or_, select, true
+
+from config import ANSWER_PREVIEW_CHARS, QUESTION_PAGE_SIZE
+from extensions import db
+from llm import FAILURE_MARKERS
+from models import Answer, Dimension, DimensionClosure, LLM, Question, Rating
+
+logger = logging.getLogger('question_list')
+
+STATES = ('evaluated', 'unevaluated')
+
+
+def failed_answer():
+    """An answer stored in place of a response the client never got (see llm.FAILURE_MARKERS)."""
+    return or_(*[Answer.content.startswith(marker, autoescape=True) for marker in FAILURE_MARKERS])
+
+
+# --- 1. 过滤与分页 ---
+
+class QuestionFilters:
+    """The question list's filters as they arrive in the query string; unknown values are ignored."""
+    def __init__(self, args):
+        self.dimension_id = args.get('dim', type=int)
+        self.question_type = args.get('type') if args.get('type') in ('subjective', 'objective') else None
+        self.state = args.get('state') if args.get('state') in STATES else None
+        self.failed = args.get('failed') == '1'
+
+    def as_args(self) -> dict:
+        """The filters to carry over into pager links."""
+        args = {'dim': self.dimension_id, 'type': self.question_type, 'state': self.state, 'failed': '1' if self.failed else None}
+        return {key: value for key, value in args.items() if value is not None}
+
+    def apply(self, query):
+        if self.dimension_id is not None:
+            query = query.where(Question.dimension_id.in_(
+                select(DimensionClosure.descendant_id).where(DimensionClosure.ancestor_id == self.dimension_id)
+            ))
+        if self.question_type is not None:
+            query = query.where(Question.question_type == self.question_type)
+        if self.state is not None:
+            evaluated = exists().where(Answer.question_id == Question.id, Answer.is_current == true())
+            query = query.where(evaluated if self.state == 'evaluated' else ~evaluated)
+        if self.failed:
+            query = query.where(exists().where(Answer.question_id == Question.id, Answer.is_current == true(), failed_answer()))
+        return query
+
+
+def page_query(filters: QuestionFilters, after: int | None = None, before: int | None = None, size: int = QUESTION_PAGE_SIZE):
+    """
+    One page of the filtered list, newest first, by keyset: the questions below id `after`
+    (next page) or above id `before` (previous page, in ascending order). One extra row is
+    fetched to tell whether there is another page in that direction.
+    """
+    query = filters.apply(select(Question))
+    if before is not None:
+        return query.where(Question.id > before).order_by(Question.id.asc()).limit(size + 1)
+    if after is not None:
+        query = query.where(Question.id < after)
+    return query.order_by(Question.id.desc()).limit(size + 1)
+
+
+def fetch_page(filters: QuestionFilters, after: int | None = None, before: int | None = None,
+               size: int = QUESTION_PAGE_SIZE) -> tuple[list[Question], int | None, int | None]:
+    """The page's questions, and the cursors of the next and previous pages (None at either end)."""
+    questions = list(db.session.scalars(page_query(filters, after, before, size)))
+    more = len(questions) > size
+    questions = questions[:size]
+    if before is not None:
+        questions.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, after is not None
+    next_cursor = questions[-1].id if questions and has_next else None
+    prev_cursor = questions[0].id if questions and has_prev else None
+    return questions, next_cursor, prev_cursor
+
+
+def count(filters: QuestionFilters) -> int:
+    return db.session.scalar(filters.apply(select(func.count(Question.id))))
+
+
+# --- 2. 每行的汇总 ---
+
+def row_counts_query(question_ids: list[int]):
+    return select(
+        Answer.question_id,
+        func.count(distinct(Answer.id)).label('answers'),
+        func.count(Rating.id).label('ratings'),
+        func.count(distinct(case((failed_answer(), Answer.id)))).label('failed'),
+        func.avg(Rating.score).label('avg_score')
+    ).outerjoin(Rating, Rating.answer_id == Answer.id)\
+     .where(Answer.question_id.in_(question_ids), Answer.is_current == true())\
+     .group_by(Answer.question_id)
+
+
+def row_counts(question_ids: list[int]) -> dict[int, dict]:
+    """Current answers, ratings, failed answers and average score of each question, from one grouped query."""
+    if not question_ids:
+        return {}
+    return {row.question_id: row._asdict() for row in db.session.execute(row_counts_query(question_ids))}
+
+
+def dimension_paths(separator: str = ' > ') -> dict[int, str]:
+    """'L1 > L2 > L3' of every dimension, from the small dimension table in one read."""
+    dims = {dim.id: dim for dim in db.session.query(Dimension.id, Dimension.name, Dimension.parent)}
+    paths = {}
+    for dim in dims.values():
+        names, node = [], dim
+        while node is not None:
+            names.append(node.name)
+            node = dims.get(node.parent) if node.parent is not None else None
+        paths[dim.id] = separator.join(reversed(names))
+    return paths
+
+
+# --- 3. 题目详情与状态 ---
+
+def answer_previews_query(question_id: int):
+    """The current answers of a question, cut to their first ANSWER_PREVIEW_CHARS characters; the detail page loads the rest on demand."""
+    return select(
+        Answer.id, LLM.name.label('llm_name'),
+        func.substr(Answer.content, 1, ANSWER_PREVIEW_CHARS).label('preview'),
+        func.length(Answer.content).label('length')
+    ).join(LLM, Answer.llm_id == LLM.id)\
+     .where(Answer.question_id == question_id, Answer.is_current == true())\
+     .order_by(LLM.name)
+
+
+def answer_ratings_query(answer_ids: list[int]):
+    return select(Rating).where(Rating.answer_id.in_(answer_ids)).order_by(Rating.id)
+
+
+def answered_query(question_ids: list[int]):
+    """Which of the questions have a current answer; the status fallback for questions the progress feed does not know."""
+    return select(Answer.question_id).where(Answer.question_id.in_(question_ids), Answer.is_current == true()).distinct()
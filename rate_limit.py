@@ -0,0 +1,226 @@
+# .\rate_limit.py
+
+import hashlib
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import redis
+
+from config import (
+    RATE_LIMITS,
+    RATE_LIMIT_BACKOFF_BASE,
+    RATE_LIMIT_BACKOFF_MAX,
+    RATE_LIMIT_OUTPUT_TOKEN_ESTIMATE
+)
+from extensions import redis_client
+
+logger = logging.getLogger('rate_limit')
+
+# A per-minute bucket left alone this long is full again, the same as one that does not exist
+BUCKET_TTL = 60
+# After Redis fails, calls use the local buckets for this many seconds before trying it again
+SHARED_RETRY_INTERVAL = 5
+
+# The Redis twin of TokenBucket, applied to every bucket of a call in one atomic step.
+# KEYS are the buckets; ARGV is (pause seconds, ttl) followed by (per_minute, take) per bucket.
+# Takes are reserved tokens, negative ones are refunds. Redis's clock is the only clock,
+# so workers on different hosts agree on the refill. Returns the longest wait, as a string
+# because Lua numbers come back from Redis truncated to integers.
+BUCKETS_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local pause, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local per_minute, take = tonumber(ARGV[i * 2 + 1]), tonumber(ARGV[i * 2 + 2])
+    local state = redis.call('HMGET', key, 'level', 'updated', 'not_before')
+    local level = tonumber(state[1]) or per_minute
+    local not_before = math.max(tonumber(state[3]) or 0, now + pause)
+    if per_minute > 0 then
+        local rate = per_minute / 60
+        level = math.min(per_minute, level + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+        -- A single request larger than the bucket only has to wait for a full bucket
+        level = math.min(per_minute, level - math.min(take, per_minute))
+        if level < 0 then
+            wait = math.max(wait, -level / rate)
+        end
+    end
+    wait = math.max(wait, not_before - now)
+    redis.call('HSET', key, 'level', level, 'updated', now, 'not_before', not_before)
+    redis.call('EXPIRE', key, ttl + math.ceil(math.max(0, not_before - now)))
+end
+return tostring(wait)
+"""
+
+
+class TokenBucket:
+    """
+    A per-minute token bucket that hands out reservations instead of refusals.
+    reserve() always succeeds and returns how long the caller must wait before
+    using what it reserved, so concurrent callers queue up in arrival order.
+    A rate of None means unlimited, but the bucket can still be paused after a 429.
+    """
+    def __init__(self, per_minute: float | None):
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = per_minute or 0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.not_before = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self.not_before - now)
+            if self.rate:
+                # A single request larger than the bucket only has to wait for a full bucket
+                amount = min(amount, self.capacity)
+                self.level -= amount
+                if self.level < 0:
+                    wait = max(wait, -self.level / self.rate)
+            return wait
+
+    def refund(self, amount: float):
+        """Gives back (or, if negative, charges) tokens once the real usage is known."""
+        if not self.rate:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.not_before = max(self.not_before, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """
+    Holds request-per-minute and token-per-minute buckets for every provider
+    (keyed by base_url) and every API key under it, configured by RATE_LIMITS.
+    A call has to clear both the provider's buckets and its key's buckets.
+
+    The buckets live in Redis, so every worker process draws from the same ones and
+    the limits hold for the whole deployment. While Redis is unreachable each process
+    falls back to buckets of its own, which only limit that process.
+    """
+    def __init__(self, limits: dict = RATE_LIMITS, client: redis.Redis = redis_client):
+        self.limits = limits
+        self.script = client.register_script(BUCKETS_SCRIPT)
+        self.shared = True
+        self.retry_shared_at = 0.0
+        self.buckets: dict[tuple, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def _limits_for(self, base_url: str) -> dict:
+        return {**self.limits.get('default', {}), **self.limits.get(base_url.rstrip('/'), {})}
+
+    def _bucket(self, scope: tuple, per_minute: float | None) -> TokenBucket:
+        with self.lock:
+            if scope not in self.buckets:
+                self.buckets[scope] = TokenBucket(per_minute)
+            return self.buckets[scope]
+
+    def _scopes(self, base_url: str, api_key: str) -> tuple[list[tuple], list[tuple]]:
+        """(scope, per_minute) of the request buckets and of the token buckets of a call."""
+        limits = self._limits_for(base_url)
+        provider = ('provider', base_url.rstrip('/'))
+        # Key names end up in Redis, so the API key is only identified by a digest
+        key = ('key', base_url.rstrip('/'), hashlib.sha256(api_key.encode()).hexdigest()[:16])
+        request_scopes = [(provider + ('rpm',), limits.get('rpm')), (key + ('rpm',), limits.get('key_rpm'))]
+        token_scopes = [(provider + ('tpm',), limits.get('tpm')), (key + ('tpm',), limits.get('key_tpm'))]
+        return request_scopes, token_scopes
+
+    def _shared(self, takes: list[tuple[tuple, float | None, float]], pause: float = 0.0) -> float | None:
+        """
+        Applies (scope, per_minute, take) to the shared buckets and returns the wait, or
+        None if Redis could not be reached and the caller has to use the local buckets.
+        """
+        if not self.shared and time.monotonic() < self.retry_shared_at:
+            return None
+        keys, args = [], [pause, BUCKET_TTL]
+        for scope, per_minute, take in takes:
+            keys.append('rate_limit:' + ':'.join(scope))
+            args += [per_minute or 0, take]
+        try:
+            wait = float(self.script(keys=keys, args=args))
+        except redis.RedisError as e:
+            if self.shared:
+                logger.warning(f"Rate limit buckets unreachable in Redis, limiting this process only: {e}")
+            self.shared, self.retry_shared_at = False, time.monotonic() + SHARED_RETRY_INTERVAL
+            return None
+        if not self.shared:
+            logger.info("Rate limit buckets reachable in Redis again; limits are shared across workers.")
+            self.shared = True
+        return wait
+
+    @staticmethod
+    def estimate_tokens(prompt: str, max_tokens: int | None = None) -> int:
+        # One token per character is pessimistic for English and about right for Chinese
+        return len(prompt) + (max_tokens or RATE_LIMIT_OUTPUT_TOKEN_ESTIMATE)
+
+    def reserve(self, base_url: str, api_key: str, tokens: int) -> float:
+        request_scopes, token_scopes = self._scopes(base_url, api_key)
+        wait = self._shared([scope + (1,) for scope in request_scopes] + [scope + (tokens,) for scope in token_scopes])
+        if wait is not None:
+            return wait
+        waits = [self._bucket(*scope).reserve(1) for scope in request_scopes]
+        waits += [self._bucket(*scope).reserve(tokens) for scope in token_scopes]
+        return max(waits)
+
+    def settle(self, base_url: str, api_key: str, estimated_tokens: int, used_tokens: int | None):
+        if used_tokens is None:
+            return
+        token_scopes = self._scopes(base_url, api_key)[1]
+        if self._shared([scope + (used_tokens - estimated_tokens,) for scope in token_scopes]) is not None:
+            return
+        for scope in token_scopes:
+            self._bucket(*scope).refund(estimated_tokens - used_tokens)
+
+    def penalize(self, base_url: str, api_key: str, seconds: float):
+        logger.warning(f"Pausing key ...{api_key[-4:]} on {base_url} for {seconds:.1f}s after a rate limit response.")
+        # 429s are almost always scoped to the key, so only the key's request bucket is paused
+        key_request_scope = self._scopes(base_url, api_key)[0][1]
+        if self._shared([key_request_scope + (0,)], pause=seconds) is None:
+            self._bucket(*key_request_scope).pause(seconds)
+
+
+def retry_after_seconds(headers) -> float | None:
+    """Reads Retry-After (seconds or HTTP date) or the retry-after-ms extension from a 429 response."""
+    if headers is None:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_with_jitter(attempt: int, retry_after: float | None = None) -> float:
+    """Full-jitter exponential backoff, never shorter than what the server asked for."""
+    delay = random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, RATE_LIMIT_BACKOFF_BASE))
+    return delay
+
+
+rate_limiter = RateLimiter()
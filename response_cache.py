@@ -0,0 +1,165 @@
+# .\response_cache.py
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import redis
+
+from config import (
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_ENTRIES
+)
+from extensions import redis_client
+
+logger = logging.getLogger('response_cache')
+
+EVICTION_CHECK_EVERY = 100  # 每写入多少条检查一次容量上限
+
+
+class SQLiteCacheBackend:
+    """Single-file cache; `accessed` doubles as the LRU clock."""
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_accessed ON response_cache (accessed)')
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT value, created FROM response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                return None
+            self.conn.execute('UPDATE response_cache SET accessed = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, now, now)
+            )
+            self.writes += 1
+            if self.writes % EVICTION_CHECK_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self.conn.execute('DELETE FROM response_cache WHERE created < ?', (now - self.ttl,))
+        overflow = self.conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self.conn.execute(
+                'DELETE FROM response_cache WHERE key IN '
+                '(SELECT key FROM response_cache ORDER BY accessed LIMIT ?)', (overflow,)
+            )
+            logger.info(f"Evicted {overflow} least recently used cached responses.")
+
+
+class RedisCacheBackend:
+    """Values expire through Redis TTLs; a sorted set of access times enforces the size limit."""
+    PREFIX = 'llm_cache:'
+    LRU_KEY = 'llm_cache_lru'
+
+    def __init__(self, client: redis.Redis, ttl: int, max_entries: int):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def get(self, key: str) -> str | None:
+        value = self.client.get(self.PREFIX + key)
+        if value is None:
+            return None
+        self.client.zadd(self.LRU_KEY, {key: time.time()})
+        return value.decode('utf-8')
+
+    def set(self, key: str, value: str):
+        pipe = self.client.pipeline()
+        pipe.set(self.PREFIX + key, value, ex=self.ttl)
+        pipe.zadd(self.LRU_KEY, {key: time.time()})
+        pipe.zcard(self.LRU_KEY)
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            evicted = [k.decode('utf-8') for k, _ in self.client.zpopmin(self.LRU_KEY, size - self.max_entries)]
+            if evicted:
+                self.client.delete(*[self.PREFIX + k for k in evicted])
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of successful completions. The key hashes everything that
+    determines the answer: model, base_url, prompt and sampling parameters.
+    Cache failures never fail a call; they are logged and counted as misses.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def make_key(model: str, base_url: str, prompt: str, params: dict) -> str:
+        payload = json.dumps([model, base_url.rstrip('/'), prompt, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        try:
+            value = self.backend.get(key)
+        except (sqlite3.Error, redis.RedisError) as e:
+            logger.warning(f"Response cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        try:
+            self.backend.set(key, value)
+        except (sqlite3.Error, redis.RedisError) as e:
+            logger.warning(f"Response cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'backend': RESPONSE_CACHE_BACKEND,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_response_cache() -> ResponseCache:
+    if RESPONSE_CACHE_BACKEND == 'sqlite':
+        backend = SQLiteCacheBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES)
+    elif RESPONSE_CACHE_BACKEND == 'redis':
+        backend = RedisCacheBackend(redis_client, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES)
+    else:
+        backend = None
+    if backend is not None:
+        logger.info(f"LLM response cache enabled with '{RESPONSE_CACHE_BACKEND}' backend.")
+    return ResponseCache(backend)
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,233 @@
+# .\result_writer.py
+
+import json
+import logging
+import socket
+import time
+from datetime import datetime
+
+import redis
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from config import (
+    RESULT_STREAM,
+    RESULT_STREAM_GROUP,
+    RESULT_WRITER_BATCH,
+    RESULT_WRITER_BLOCK_MS,
+    RESULT_WRITER_CLAIM_IDLE
+)
+from extensions import db, redis_client
+from aggregates import delete_ratings
+from models import Answer, Question, Rating
+import runs
+
+logger = logging.getLogger('result_writer')
+
+
+# --- 1. 生产端：任务把结果写入 Stream ---
+
+def _answer_payload(answer: Answer) -> dict:
+    return {
+        'kind': 'answer',
+        'key': answer.idempotency_key,
+        'question_id': answer.question_id,
+        'llm_id': answer.llm_id,
+        'content': answer.content,
+        'fingerprint': answer.fingerprint,
+        'run_id': answer.run_id,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def _rating_payload(rating: Rating, answer_key: str | None, run_id: int | None, replaces: list[int]) -> dict:
+    return {
+        'kind': 'rating',
+        'key': rating.idempotency_key,
+        'answer_id': rating.answer_id,
+        'answer_key': answer_key,
+        'run_id': run_id,
+        'replaces': replaces,
+        'llm_id': rating.llm_id,
+        'score': rating.score,
+        'is_responsive': rating.is_responsive,
+        'comment': rating.comment,
+        'fingerprint': rating.fingerprint,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def publish_results(answer: Answer | None = None, rating: Rating | None = None, run_id: int | None = None,
+                    replaces=()):
+    """
+    Queues an unsaved answer and/or rating for the writer, in one MULTI so neither is seen
+    without the other. A rating of a queued answer refers to it by the answer's idempotency key.
+    `run_id` is the run a rating of an already-saved answer settles; with an answer, the
+    answer settles its pair. `replaces` are ids of stale ratings the writer deletes in the
+    transaction that writes the new one.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    if answer is not None:
+        pipe.xadd(RESULT_STREAM, {'data': json.dumps(_answer_payload(answer), ensure_ascii=False)})
+    if rating is not None:
+        answer_key = answer.idempotency_key if answer is not None else None
+        rating_run_id = run_id if answer is None else None
+        pipe.xadd(RESULT_STREAM, {'data': json.dumps(_rating_payload(rating, answer_key, rating_run_id, list(replaces)), ensure_ascii=False)})
+    pipe.execute()
+
+
+# --- 2. 消费端：单个 writer 批量入库 ---
+
+def ensure_group():
+    try:
+        redis_client.xgroup_create(RESULT_STREAM, RESULT_STREAM_GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def _read(consumer: str, pending: bool, count: int, block_ms: int) -> list[tuple[bytes, dict]]:
+    """This consumer's unacknowledged entries when `pending`, otherwise new ones."""
+    streams = redis_client.xreadgroup(
+        RESULT_STREAM_GROUP, consumer, {RESULT_STREAM: '0' if pending else '>'},
+        count=count, block=None if pending else block_ms
+    )
+    return streams[0][1] if streams else []
+
+
+def _claim_abandoned(consumer: str, count: int) -> list[tuple[bytes, dict]]:
+    """Entries another writer read but never acknowledged, i.e. it died mid-batch."""
+    result = redis_client.xautoclaim(
+        RESULT_STREAM, RESULT_STREAM_GROUP, consumer, RESULT_WRITER_CLAIM_IDLE * 1000, '0-0', count=count
+    )
+    return result[1]
+
+
+def _write_batch(entries: list[tuple[bytes, dict]]) -> tuple[int, int, dict[int, int]]:
+    """
+    Inserts the batch in one transaction and returns (answers, ratings) written, plus how many
+    pairs of each evaluation run it settled: new answers, and new ratings of saved answers. Entries may be redelivered, so anything whose
+    idempotency key is already stored is skipped.
+    """
+    answers, ratings = {}, {}
+    for _, fields in entries:
+        if not fields:
+            continue  # trimmed from the stream while still pending
+        payload = json.loads(fields[b'data'])
+        (answers if payload['kind'] == 'answer' else ratings)[payload['key']] = payload
+
+    answer_keys = set(answers) | {r['answer_key'] for r in ratings.values() if r['answer_key']}
+    answer_ids = dict(db.session.execute(
+        select(Answer.idempotency_key, Answer.id).where(Answer.idempotency_key.in_(answer_keys))
+    ).all()) if answer_keys else {}
+    live_questions = set(db.session.scalars(
+        select(Question.id).where(Question.id.in_({a['question_id'] for a in answers.values()}))
+    )) if answers else set()
+
+    new_answers, run_counts = [], {}
+    for key, payload in answers.items():
+        if key in answer_ids:
+            continue
+        if payload.get('run_id') is not None:
+            # A dropped answer also counts, or its run would wait for it until the deadline
+            run_counts[payload['run_id']] = run_counts.get(payload['run_id'], 0) + 1
+        if payload['question_id'] not in live_questions:
+            logger.warning(f"Dropping answer {key}: Question {payload['question_id']} no longer exists.")
+            continue
+        new_answers.append(Answer(
+            question_id=payload['question_id'], llm_id=payload['llm_id'], content=payload['content'],
+            fingerprint=payload.get('fingerprint'), timestamp=datetime.fromisoformat(payload['timestamp']),
+            idempotency_key=key, run_id=payload.get('run_id'), is_current=payload.get('run_id') is None
+        ))
+    db.session.add_all(new_answers)
+    db.session.flush()
+    answer_ids.update({answer.idempotency_key: answer.id for answer in new_answers})
+
+    stored_ratings = set(db.session.scalars(
+        select(Rating.idempotency_key).where(Rating.idempotency_key.in_(list(ratings)))
+    )) if ratings else set()
+    direct_ids = {r['answer_id'] for r in ratings.values() if r['answer_id'] is not None}
+    live_answers = set(db.session.scalars(select(Answer.id).where(Answer.id.in_(direct_ids)))) if direct_ids else set()
+
+    new_ratings, replaced = [], []
+    for key, payload in ratings.items():
+        if key in stored_ratings:
+            continue
+        if payload.get('run_id') is not None:
+            run_counts[payload['run_id']] = run_counts.get(payload['run_id'], 0) + 1
+        answer_id = payload['answer_id'] if payload['answer_id'] in live_answers else answer_ids.get(payload['answer_key'])
+        if answer_id is None:
+            logger.warning(f"Dropping rating {key}: its answer no longer exists.")
+            continue
+        new_ratings.append(Rating(
+            answer_id=answer_id, llm_id=payload['llm_id'], score=payload['score'],
+            is_responsive=payload['is_responsive'], comment=payload['comment'],
+            fingerprint=payload.get('fingerprint'), timestamp=datetime.fromisoformat(payload['timestamp']),
+            idempotency_key=key
+        ))
+        replaced += payload.get('replaces') or []
+    db.session.add_all(new_ratings)
+    if replaced:
+        # The stale ratings leave with their replacements arriving, so no answer is ever unrated
+        db.session.flush()
+        delete_ratings(Rating.id.in_(replaced))
+    db.session.commit()
+    return len(new_answers), len(new_ratings), run_counts
+
+
+def _acknowledge(entries: list[tuple[bytes, dict]]):
+    ids = [entry_id for entry_id, _ in entries]
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.xack(RESULT_STREAM, RESULT_STREAM_GROUP, *ids)
+    pipe.xdel(RESULT_STREAM, *ids)
+    pipe.execute()
+
+
+def run_writer(consumer: str | None = None, batch_size: int = RESULT_WRITER_BATCH,
+               block_ms: int = RESULT_WRITER_BLOCK_MS, once: bool = False) -> int:
+    """
+    Drains the result stream into the database until stopped (or, with `once`, until it is
+    empty). Entries are acknowledged only after their batch commits, so a crash replays
+    them: at-least-once delivery, made exactly-once in the tables by the idempotency keys.
+    Returns the number of entries processed.
+    """
+    consumer = consumer or socket.gethostname()
+    ensure_group()
+    logger.info(f"Result writer '{consumer}' started on stream '{RESULT_STREAM}'.")
+    processed, pending = 0, True  # first replay whatever this consumer left unacknowledged
+    while True:
+        try:
+            entries = _read(consumer, pending, batch_size, block_ms)
+            if pending and not entries:
+                pending = False
+                entries = _claim_abandoned(consumer, batch_size)
+                if not entries:
+                    continue
+        except redis.RedisError as e:
+            logger.warning(f"Reading the result stream failed, retrying: {e}")
+            time.sleep(1)
+            continue
+        if not entries:
+            if once:
+                return processed
+            continue
+
+        try:
+            answer_count, rating_count, run_counts = _write_batch(entries)
+            # After the commit, so a run finishing here promotes answers whose ratings are already in
+            for run_id, count in run_counts.items():
+                runs.pair_done(run_id, count)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Writing a batch of {len(entries)} results failed, retrying: {e}", exc_info=True)
+            pending = True
+            time.sleep(1)
+            continue
+        try:
+            _acknowledge(entries)
+        except redis.RedisError as e:
+            # Already committed: the replay finds every key stored and only acknowledges them
+            logger.warning(f"Acknowledging {len(entries)} stream entries failed; they will be replayed: {e}")
+            pending = True
+        processed += len(entries)
+        logger.info(f"Wrote {answer_count} answers and {rating_count} ratings from {len(entries)} stream entries.")
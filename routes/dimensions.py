@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from models import Dimension, Question
 from extensions import db
+from dimension_tree import add_dimension, children_query, move_dimension, detach_dimension
 import logging
 
 dimensions_bp = Blueprint('dimensions', __name__, url_prefix='/dev/dimension')
@@ -27,6 +28,8 @@ def manage_dimensions():
                 if name:
                     new_dim = Dimension(name=name, level=1)
                     db.session.add(new_dim)
+                    db.session.flush()
+                    add_dimension(new_dim)
                     flash(f'一级维度 "{name}" 添加成功', 'success')
                     logger.info(f"Added new level 1 dimension: '{name}'.")
             
@@ -36,6 +39,8 @@ def manage_dimensions():
                 if parent_id and name:
                     new_dim = Dimension(name=name, level=2, parent=parent_id)
                     db.session.add(new_dim)
+                    db.session.flush()
+                    add_dimension(new_dim)
                     flash(f'二级维度 "{name}" 添加成功', 'success')
                     logger.info(f"Added new level 2 dimension: '{name}' under parent ID {parent_id}.")
             
@@ -45,6 +50,8 @@ def manage_dimensions():
                 if parent_id and name:
                     new_dim = Dimension(name=name, level=3, parent=parent_id)
                     db.session.add(new_dim)
+                    db.session.flush()
+                    add_dimension(new_dim)
                     flash(f'三级维度 "{name}" 添加成功', 'success')
                     logger.info(f"Added new level 3 dimension: '{name}' under parent ID {parent_id}.")
         
@@ -57,10 +64,23 @@ def manage_dimensions():
                 
                 # 删除维度
                 logger.warning(f"Attempting to delete dimension '{dim.name}' (ID: {dim.id}).")
+                detach_dimension(dim)
                 db.session.delete(dim)
                 flash(f'维度 "{dim.name}" 已删除', 'success')
                 logger.info(f"Successfully deleted dimension '{dim.name}' (ID: {dim.id}).")
         
+        # 移动维度（连同其子维度）到新的上级维度下
+        elif action == 'move_dimension':
+            dim = db.session.get(Dimension, request.form.get('dim_id', type=int))
+            new_parent = db.session.get(Dimension, request.form.get('new_parent_id', type=int))
+            if not dim or not new_parent or new_parent.level != dim.level - 1:
+                flash('移动失败：目标上级维度必须比当前维度高一级。', 'danger')
+                logger.warning(f"Rejected move of dimension {request.form.get('dim_id')} under {request.form.get('new_parent_id')}.")
+            elif dim.parent != new_parent.id:
+                move_dimension(dim, new_parent.id)
+                flash(f'维度 "{dim.name}" 已移动到 "{new_parent.name}" 下', 'success')
+                logger.info(f"Moved dimension '{dim.name}' (ID: {dim.id}) under '{new_parent.name}' (ID: {new_parent.id}).")
+        
         db.session.commit()
         return redirect(url_for('dimensions.manage_dimensions'))
     
@@ -92,10 +112,8 @@ def get_dimensions():
     logger.debug(f"Fetching dimensions for level {level} with parent ID {parent_id}.")
     
     # ... (rest of the function is unchanged)
-    if level == 2:
-        dimensions = Dimension.query.filter_by(parent=parent_id, level=2).all()
-    elif level == 3:
-        dimensions = Dimension.query.filter_by(parent=parent_id, level=3).all()
+    if level in (2, 3):
+        dimensions = db.session.scalars(children_query(parent_id, level)).all()
     else:
         dimensions = []
     
@@ -0,0 +1,26 @@
+from flask import Blueprint, Response, abort, request, stream_with_context
+import exporter
+import logging
+
+export_bp = Blueprint('export', __name__, url_prefix='/dev/export')
+logger = logging.getLogger('export_routes')
+
+
+@export_bp.route('/<kind>.<fmt>')
+def export(kind, fmt):
+    """
+    流式导出答案 / 评分 / 榜单：/dev/export/answers.csv?model=gpt-4o&dim=3&since=2025-01-01
+    数据按 EXPORT_BATCH_SIZE 分批读取并逐块写出，导出再多的行也不会全部载入内存
+    """
+    if kind not in exporter.KINDS or fmt not in exporter.FORMATS:
+        abort(404)
+    try:
+        chunks = exporter.export(kind, fmt, exporter.ExportFilters(request.args))
+    except exporter.ExportError as e:
+        abort(400, description=str(e))
+    logger.info(f"Streaming {kind} export as {fmt} with filters {request.args.to_dict(flat=False)}.")
+    return Response(
+        stream_with_context(chunks),
+        mimetype=exporter.FORMATS[fmt][0],
+        headers={'Content-Disposition': f'attachment; filename="{exporter.filename(kind, fmt)}"'}
+    )
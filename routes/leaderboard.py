@@ -1,6 +1,5 @@
 from flask import Blueprint, request, render_template
-from sqlalchemy.orm import aliased
-from models import Dimension, Rating, Setting, Answer, Question, LLM
+from models import Dimension, DimensionClosure, Setting, LLM, LeaderboardAggregate
 from extensions import db
 from utils import calculate_weighted_average # <-- 1. Import the new function
 import logging
@@ -8,6 +7,32 @@ import logging
 leaderboard_bp = Blueprint('leaderboard', __name__, url_prefix='/dev/leaderboard')
 logger = logging.getLogger('leaderboard_routes')
 
+def totals_by_model_query(selected_dim_id=None):
+    """Weighted-score components per model, over the whole board or the subtree of `selected_dim_id`."""
+    # Use CASE to conditionally sum scores and counts based on question type.
+    # Rows are pre-aggregated per (model, dimension path, question type), so counts are summed, not counted.
+    agg = LeaderboardAggregate
+    query = db.select(
+        LLM.name.label('model_name'),
+        db.func.sum(db.case((agg.question_type == 'subjective', agg.score_sum), else_=0)).label('subj_score_total'),
+        db.func.sum(db.case((agg.question_type == 'subjective', agg.rating_count), else_=0)).label('subj_count'),
+        db.func.sum(db.case((agg.question_type == 'objective', agg.score_sum), else_=0)).label('obj_score_total'),
+        db.func.sum(db.case((agg.question_type == 'objective', agg.rating_count), else_=0)).label('obj_count'),
+        (db.func.sum(agg.rating_count * Setting.total_score) * 1.0 / db.func.sum(agg.rating_count)).label('avg_total'),
+        (db.func.sum(agg.responsive_count) * 100.0 / db.func.sum(agg.rating_count)).label('response_rate')
+    ).select_from(agg)
+
+    query = query.join(LLM, agg.llm_id == LLM.id)
+    query = query.join(Setting, agg.question_type == Setting.question_type)
+
+    # The most specific level wins, and any level is one closure-table join
+    if selected_dim_id:
+        query = query.join(DimensionClosure, db.and_(
+            DimensionClosure.descendant_id == agg.l3_dim_id,
+            DimensionClosure.ancestor_id == selected_dim_id
+        ))
+    return query.group_by(LLM.name)
+
 @leaderboard_bp.route('/')
 def leaderboard():
     # Get filter parameters
@@ -15,43 +40,10 @@ def leaderboard():
     level2_id = request.args.get('level2', type=int)
     level3_id = request.args.get('level3', type=int)
     
-    dim_level1 = aliased(Dimension)
-    dim_level2 = aliased(Dimension)
-    dim_level3 = aliased(Dimension)
-    
     logger.info(f"Leaderboard accessed with filters: Level1_ID={level1_id}, Level2_ID={level2_id}, Level3_ID={level3_id}")
     
     # --- 2. Refactor the query to get weighted components ---
-    # Use CASE to conditionally sum scores and counts based on question type
-    query = db.session.query(
-        LLM.name.label('model_name'),
-        db.func.sum(db.case((Question.question_type == 'subjective', Rating.score), else_=0)).label('subj_score_total'),
-        db.func.sum(db.case((Question.question_type == 'subjective', 1), else_=0)).label('subj_count'),
-        db.func.sum(db.case((Question.question_type == 'objective', Rating.score), else_=0)).label('obj_score_total'),
-        db.func.sum(db.case((Question.question_type == 'objective', 1), else_=0)).label('obj_count'),
-        db.func.avg(Setting.total_score).label('avg_total'),
-        (db.func.sum(db.case((Rating.is_responsive == True, 1), else_=0)) * 100.0 / db.func.count(Rating.id)).label('response_rate')
-    ).select_from(Rating)
-    
-    query = query.join(Answer, Rating.answer_id == Answer.id)
-    query = query.join(LLM, Answer.llm_id == LLM.id)
-    query = query.join(Question, Answer.question_id == Question.id) # This join is crucial
-    query = query.join(Setting, Question.question_type == Setting.question_type)
-    query = query.join(dim_level3, Question.dimension_id == dim_level3.id)
-    
-    # Apply filters
-    if level3_id:
-        query = query.filter(dim_level3.id == level3_id)
-    elif level2_id:
-        query = query.join(dim_level2, dim_level3.parent == dim_level2.id)
-        query = query.filter(dim_level2.id == level2_id)
-    elif level1_id:
-        query = query.join(dim_level2, dim_level3.parent == dim_level2.id)
-        query = query.join(dim_level1, dim_level2.parent == dim_level1.id)
-        query = query.filter(dim_level1.id == level1_id)
-    
-    # Group and fetch raw results
-    raw_results = query.group_by(LLM.name).all()
+    raw_results = db.session.execute(totals_by_model_query(level3_id or level2_id or level1_id)).all()
 
     # --- 3. Process results in Python using the utility function ---
     leaderboard_data = []
@@ -6,6 +6,7 @@ from models import LLM
 from extensions import db
 from forms import LLMForm
 from llm import clients
+from key_pool import load_key_health
 import logging
 # 2. 从 app 模块导入我们创建的 icons UploadSet
 from extensions import icons
@@ -17,7 +18,12 @@ logger = logging.getLogger('model_routes')
 def model_management():
     logger.info("Accessed model management page.")
     llms = LLM.query.all()
-    return render_template('model_management.html', llms=llms)
+    # 一次 MGET 取回所有模型的密钥健康状态，Redis 不可用时只降级一次
+    key_health = load_key_health({
+        llm.id: clients.clients[llm.id].key_pool if llm.id in clients.clients else None
+        for llm in llms
+    })
+    return render_template('model_management.html', llms=llms, key_health=key_health)
 
 @models_bp.route('/add', methods=['GET', 'POST'])
 def add_model():
@@ -47,6 +53,7 @@ def add_model():
         new_llm = LLM(
             name=form.name.data, model=form.model.data,
             base_url=form.base_url.data, api_keys=api_keys,
+            pool=form.pool.data.strip() or None,
             desc=form.desc.data, 
             icon=icon_filename,  # 保存由 Flask-Uploads 返回的新文件名
             comment=form.comment.data
@@ -114,6 +121,7 @@ def edit_model(model_id):
         llm.name = form.name.data
         llm.model = form.model.data
         llm.base_url = form.base_url.data
+        llm.pool = form.pool.data.strip() or None
         llm.api_keys = api_keys
         llm.desc = form.desc.data
         llm.comment = form.comment.data
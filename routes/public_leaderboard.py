@@ -1,7 +1,7 @@
 # .\routes\public_leaderboard.py
 
 import logging
-from flask import Blueprint, render_template, flash, redirect, url_for
+from flask import Blueprint, render_template, flash, redirect, url_for, request
 from models import Question, LLM
 from extensions import db
 from config import (
@@ -10,8 +10,9 @@ from config import (
     QUADRANT_RESPONSE_RATE_THRESHOLD
 )
 # <-- 1. 导入新的工具函数 -->
-from utils import generate_leaderboard_data
+from leaderboard_cache import get_leaderboard_data
 from extensions import icons
+import inflight
 
 public_leaderboard_bp = Blueprint('public_leaderboard', __name__)
 logger = logging.getLogger('public_leaderboard_routes')
@@ -23,7 +24,7 @@ def display_public_leaderboard():
     try:
         # <-- 2. 路由现在只负责调用工具函数和渲染 -->
         rater_names = [rater for raters in RATERS.values() for rater in raters]
-        data = generate_leaderboard_data(rater_names)
+        data = get_leaderboard_data(rater_names)
         
         return render_template('public_leaderboard.html', 
                                leaderboard=data['leaderboard'], 
@@ -42,17 +43,26 @@ def display_public_leaderboard():
 
 @public_leaderboard_bp.route('/update-all', methods=['POST'])
 def update_all_models():
-    from tasks import process_question
-    logger.info("Received request to update all models for all questions.")
+    from tasks import smart_update_task, update_all_models_task
+    mode = request.form.get('mode', 'force')
+    logger.info(f"Received request to update all models for all questions (mode: {mode}).")
+    # 重复点击时不再重复入队；即使入队，已在途的 (模型, 题目) 也不会被再次请求
+    if not inflight.debounce(f'update-all:{mode}'):
+        flash('相同的全量更新刚刚已提交，正在后台进行中，本次点击已忽略。', 'info')
+        return redirect(url_for('public_leaderboard.display_public_leaderboard'))
     try:
-        all_question_ids = [q.id for q in Question.query.with_entities(Question.id).all()]
-        if not all_question_ids:
+        if mode == 'smart':
+            smart_update_task.delay()
+            flash('智能更新已加入后台队列，只会重跑题目、模型或评分标准变化过的部分。请稍后刷新查看结果。', 'success')
+            return redirect(url_for('public_leaderboard.display_public_leaderboard'))
+        question_count = Question.query.count()
+        if not question_count:
             flash('系统中没有任何问题，无需更新。', 'warning')
             return redirect(url_for('public_leaderboard.display_public_leaderboard'))
-        for qid in all_question_ids:
-            process_question.delay(qid)
-        flash(f'成功将 {len(all_question_ids)} 个问题的更新任务加入后台队列。请稍后刷新查看结果。', 'success')
-        logger.info(f"Queued update tasks for {len(all_question_ids)} questions.")
+        # 与每周全量更新相同：一次规划的评测运行，全部完成后榜单一次性切换
+        update_all_models_task.delay(strategy='force')
+        flash(f'已将 {question_count} 个问题的全量更新加入后台队列。请稍后刷新查看结果。', 'success')
+        logger.info(f"Queued a full update of {question_count} questions.")
     except Exception as e:
         logger.error(f"Failed to queue update tasks: {e}", exc_info=True)
         flash('将更新任务加入队列时发生错误，请检查Celery服务是否正常。', 'danger')
@@ -65,9 +75,9 @@ def model_detail(model_name):
     
     llm = LLM.query.filter_by(name=model_name).first_or_404()
     
-    # 1. Get full leaderboard data to find the rank and model details
+    # 1. Get the shared leaderboard snapshot to find the rank and model details
     rater_names = [rater for raters in RATERS.values() for rater in raters]
-    full_leaderboard_data = generate_leaderboard_data(rater_names)
+    full_leaderboard_data = get_leaderboard_data(rater_names)
     
     model_data = None
     model_rank = -1
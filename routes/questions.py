@@ -1,8 +1,13 @@
-from flask import render_template, Blueprint, flash, redirect, url_for, request, jsonify
+from flask import render_template, Blueprint, flash, redirect, url_for, request, jsonify, Response, stream_with_context
 from forms import QuestionForm
 from models import Dimension, Question, Answer, Rating
 from extensions import db
+from aggregates import delete_ratings
 import logging
+import redis
+import importer
+import progress_feed
+import question_list
 
 questions_bp = Blueprint('questions', __name__, url_prefix='/dev/question')
 logger = logging.getLogger('question_routes')
@@ -53,17 +58,52 @@ def add_question():
     
     return render_template('add_question.html', form=form)
 
+@questions_bp.route('/import', methods=['POST'])
+def import_questions():
+    """从 CSV / JSONL / XLSX 文件批量导入题目，维度按 "一级/二级/三级" 路径匹配，缺失时自动创建"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        flash('请选择要导入的文件。', 'warning')
+        return redirect(url_for('questions.add_question'))
+    logger.info(f"Importing questions from uploaded file '{upload.filename}'.")
+    try:
+        report = importer.import_questions(
+            upload.stream, importer.detect_format(upload.filename),
+            create_dimensions=request.form.get('create_dimensions') == '1',
+            skip_duplicates=request.form.get('allow_duplicates') != '1'
+        )
+    except importer.ImportFileError as e:
+        flash(f'导入失败：{e}', 'danger')
+        return redirect(url_for('questions.add_question'))
+    summary = report.summary()
+    flash(f"导入 {summary['imported']} 个题目，跳过重复 {summary['duplicates']} 个，拒绝 {summary['rejected']} 行，"
+          f"新建维度 {summary['dimensions_created']} 个。", 'success' if not summary['rejected'] else 'warning')
+    for line_number, reason in report.rejected[:20]:
+        flash(f'第 {line_number} 行：{reason}', 'secondary')
+    if report.rejected_count > 20:
+        flash(f'…… 其余 {report.rejected_count - 20} 行被拒绝的原因请用 flask import-questions 查看。', 'secondary')
+    return redirect(url_for('questions.update_questions'))
+
 # --- 这是被遗漏的函数 ---
 @questions_bp.route('/<int:question_id>')
 def question_detail(question_id):
     logger.info(f"Accessed detail page for Question ID: {question_id}.") # <-- 添加日志
     question = Question.query.get_or_404(question_id)
-    answers = Answer.query.filter_by(question_id=question_id).options(
-        db.joinedload(Answer.llm),
-        db.joinedload(Answer.ratings) # 简化了这里的 joinedload，因为 rater 信息在 comment 中
-    ).all()
+    # 只取每个回答的开头和长度，全文由 answer_content 按需加载
+    answers = db.session.execute(question_list.answer_previews_query(question_id)).all()
+    ratings = {}
+    for rating in db.session.scalars(question_list.answer_ratings_query([answer.id for answer in answers])):
+        ratings.setdefault(rating.answer_id, rating)  # 与原来一样展示每个回答的第一条评分
     
-    return render_template('question_detail.html', question=question, answers=answers)
+    return render_template('question_detail.html', question=question, answers=answers, ratings=ratings)
+
+@questions_bp.route('/answer/<int:answer_id>/content')
+def answer_content(answer_id):
+    """题目详情页展开回答时加载全文"""
+    content = db.session.query(Answer.content).filter(Answer.id == answer_id).scalar()
+    if content is None:
+        return jsonify({'error': 'answer not found'}), 404
+    return jsonify({'id': answer_id, 'content': content})
 
 
 @questions_bp.route('/delete/<int:question_id>', methods=['POST'])
@@ -96,18 +136,62 @@ def update_questions():
             })
     
     logger.info("Accessed question list and update page.")
-    questions = Question.query.order_by(Question.id.desc()).all()
-    return render_template('update_questions.html', questions=questions)
+    filters = question_list.QuestionFilters(request.args)
+    questions, next_cursor, prev_cursor = question_list.fetch_page(
+        filters, after=request.args.get('after', type=int), before=request.args.get('before', type=int)
+    )
+    paths = question_list.dimension_paths()
+    return render_template(
+        'update_questions.html',
+        questions=questions,
+        total=question_list.count(filters),
+        counts=question_list.row_counts([question.id for question in questions]),
+        paths=paths,
+        dimensions=sorted(paths.items(), key=lambda item: item[1]),
+        filters=filters,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
+    )
+
+def _question_statuses(question_ids):
+    """
+    进度优先从 Redis 读取（一次往返）；Redis 中没有记录的题目（从未在评测运行中更新过，或记录已过期）
+    用一条分组查询判断是否已有当前答案
+    """
+    try:
+        current = progress_feed.snapshot(question_ids)
+    except redis.RedisError as e:
+        logger.warning(f"Progress store unavailable, reading statuses from the database: {e}")
+        current = {'questions': {}, 'runs': {}}
+    missing = [qid for qid in question_ids if qid not in current['questions']]
+    if missing:
+        answered = set(db.session.scalars(question_list.answered_query(missing)))
+        for qid in missing:
+            current['questions'][qid] = {'status': '已评估' if qid in answered else '待评估'}
+    return current
 
 # 【解决方案 2.2】添加一个新的路由，用于前端轮询问题状态
 @questions_bp.route('/status/<int:question_id>', methods=['GET'])
 def get_question_status(question_id):
-    question = Question.query.get_or_404(question_id)
-    # 检查这个问题是否已经有答案了
-    if question.answers:
-        return jsonify({'status': '已评估'})
-    else:
-        return jsonify({'status': '处理中'})
+    return jsonify(_question_statuses([question_id])['questions'][question_id])
+
+@questions_bp.route('/status', methods=['GET'])
+def get_question_statuses():
+    """批量查询：?ids=1,2,3，返回各题目及其所在评测运行的进度"""
+    try:
+        question_ids = [int(qid) for qid in request.args.get('ids', '').split(',') if qid.strip()]
+    except ValueError:
+        return jsonify({'error': 'ids must be comma-separated integers'}), 400
+    return jsonify(_question_statuses(question_ids))
+
+@questions_bp.route('/status/stream', methods=['GET'])
+def stream_question_statuses():
+    """Server-Sent Events：连接时推送所有在途题目的进度，之后每秒合并推送一次变化"""
+    return Response(
+        stream_with_context(progress_feed.events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @questions_bp.route('/bulk_action', methods=['POST'])
 def bulk_action():
@@ -122,14 +206,24 @@ def bulk_action():
     logger.info(f"Performing bulk action '{action}' on {len(question_ids)} questions. IDs: {question_ids}")
     
     if action == 'update':
-        from tasks import process_question
-        
-        for qid in question_ids:
-            process_question.delay(int(qid))
+        from tasks import update_questions_task
+
+        # 选中的题目作为一次评测运行：统一规划、按优先级调度，完成后一次性切换
+        update_questions_task.delay([int(qid) for qid in question_ids])
         flash(f'已将 {len(question_ids)} 个问题的更新任务加入后台队列。', 'info')
         
+    elif action == 'smart_update':
+        from tasks import smart_update_task
+
+        smart_update_task.delay([int(qid) for qid in question_ids])
+        flash(f'已将 {len(question_ids)} 个问题的智能更新加入后台队列，只会重跑题目、模型或评分标准变化过的部分。', 'info')
+
     elif action == 'delete':
         logger.warning(f"Bulk deleting questions with IDs: {question_ids}.")
+        # 批量删除不会触发 ORM 级联，这里先删掉答案和评分（同时扣减榜单聚合）
+        answer_ids = db.session.query(Answer.id).filter(Answer.question_id.in_(question_ids)).scalar_subquery()
+        delete_ratings(Rating.answer_id.in_(answer_ids))
+        Answer.query.filter(Answer.question_id.in_(question_ids)).delete(synchronize_session=False)
         Question.query.filter(Question.id.in_(question_ids)).delete(synchronize_session=False)
         db.session.commit()
         flash(f'已成功删除 {len(question_ids)} 个选定的问题。', 'success')
@@ -24,15 +24,37 @@ tmux new-window -t $SESSION_NAME:1 -n 'Flask'
 tmux send-keys -t $SESSION_NAME:1 "$ACTIVATE_VENV" C-m
 tmux send-keys -t $SESSION_NAME:1 "flask run --host=0.0.0.0" C-m
 
-# 2. 创建第二个窗口，用于运行 Celery Worker
+# 2. 创建第二个窗口，用于运行默认队列的 Celery Worker（评分、批量与维护任务）
 tmux new-window -t $SESSION_NAME:2 -n 'Celery'
 tmux send-keys -t $SESSION_NAME:2 "$ACTIVATE_VENV" C-m
-tmux send-keys -t $SESSION_NAME:2 "celery -A tasks.celery worker --loglevel=info -P gevent -c 100" C-m
+tmux send-keys -t $SESSION_NAME:2 "celery -A tasks.celery worker --loglevel=info -P gevent -c 100 -Q celery -n default@%h" C-m
 
-# 3. 创建第三个窗口，留作一个 shell 方便操作
-tmux new-window -t $SESSION_NAME:3 -n 'Shell'
+# 3. 创建第三个窗口，运行结果写入进程（RESULT_WRITE_MODE = 'stream' 时由它批量入库）
+tmux new-window -t $SESSION_NAME:3 -n 'Writer'
 tmux send-keys -t $SESSION_NAME:3 "$ACTIVATE_VENV" C-m
-tmux send-keys -t $SESSION_NAME:3 "sudo service redis-server start" C-m
+tmux send-keys -t $SESSION_NAME:3 "flask result-writer" C-m
+
+# 4. 创建第四个窗口，留作一个 shell 方便操作
+tmux new-window -t $SESSION_NAME:4 -n 'Shell'
+tmux send-keys -t $SESSION_NAME:4 "$ACTIVATE_VENV" C-m
+tmux send-keys -t $SESSION_NAME:4 "sudo service redis-server start" C-m
+
+# 5. 定时任务（每周全量更新、评测运行的超时检查与清理）
+tmux new-window -t $SESSION_NAME:5 -n 'Beat'
+tmux send-keys -t $SESSION_NAME:5 "$ACTIVATE_VENV" C-m
+tmux send-keys -t $SESSION_NAME:5 "celery -A tasks.celery beat --loglevel=info" C-m
+
+# 6. 调度池 worker：每个池一个，并发数即该池的上限（见 config.py 的 POOL_CONCURRENCY），
+#    之后新增模型带来的新池也会在 POOL_WORKER_CHECK_INTERVAL 秒内启动自己的 worker
+tmux new-window -t $SESSION_NAME:6 -n 'Pools'
+tmux send-keys -t $SESSION_NAME:6 "$ACTIVATE_VENV" C-m
+tmux send-keys -t $SESSION_NAME:6 "flask pool-workers" C-m
+
+# 7. 异步扇出 worker（整题重新生成，见 config.py 的 FANOUT_REGENERATION）：prefork 进程里 asyncio.run() 是安全的，
+#    每个进程一个事件循环，一条消息里的所有请求同时在途
+tmux new-window -t $SESSION_NAME:7 -n 'Fanout'
+tmux send-keys -t $SESSION_NAME:7 "$ACTIVATE_VENV" C-m
+tmux send-keys -t $SESSION_NAME:7 "celery -A tasks.celery worker --loglevel=info -P prefork -c 4 -Q fanout -n fanout@%h" C-m
 
 echo "Development environment started in tmux session '$SESSION_NAME'."
 echo "Attach to it with: tmux attach-session -t $SESSION_NAME"
\ No newline at end of file
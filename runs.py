@@ -0,0 +1,147 @@
+# .\runs.py
+
+import logging
+
+from sqlalchemy import exists, false, func, or_, select, true, tuple_, update
+from sqlalchemy.orm import aliased
+
+from aggregates import delete_ratings, set_answers_current
+from config import RUN_DEADLINE, RUN_GC_BATCH
+from extensions import db
+from models import Answer, EvaluationRun, Rating
+
+logger = logging.getLogger('runs')
+
+# The run's own answers inside statements on Answer; an unaliased subquery would be correlated away
+_run_answer = aliased(Answer, name='run_answer')
+
+
+# --- 1. 开始与计数 ---
+
+def start_run(label: str, expected: int = 0) -> EvaluationRun:
+    """Creates a run; committed at once so the tasks writing under it can see it."""
+    run = EvaluationRun(label=label, expected=expected)
+    db.session.add(run)
+    db.session.commit()
+    logger.info(f"Started EvaluationRun {run.id} ({label}) expecting {expected} results.")
+    return run
+
+
+def pair_done(run_id: int, count: int = 1) -> bool:
+    """
+    Records that `count` (model, question) pairs of a run are finished, i.e. rated or given up
+    on, and finishes the run with the last one. Returns True if this call finished it.
+    """
+    row = db.session.execute(
+        update(EvaluationRun)
+        .where(EvaluationRun.id == run_id, EvaluationRun.status == 'running')
+        .values(finished=EvaluationRun.finished + count)
+        .returning(EvaluationRun.finished, EvaluationRun.expected)
+    ).first()
+    db.session.commit()
+    if row is None or row.finished < row.expected:
+        return False
+    return finish_run(run_id) is not None
+
+
+def expect(run_id: int, expected: int) -> bool:
+    """Sets how many pairs a run waits for, once that is known; finishes it if they are all in."""
+    db.session.execute(
+        update(EvaluationRun).where(EvaluationRun.id == run_id, EvaluationRun.status == 'running').values(expected=expected)
+    )
+    db.session.commit()
+    return pair_done(run_id, 0)
+
+
+# --- 2. 切换 ---
+
+def _retired_by(run_id: int):
+    """Current answers of the (model, question) pairs the run has answered."""
+    return (
+        Answer.is_current == true(),
+        tuple_(Answer.question_id, Answer.llm_id).in_(
+            select(_run_answer.question_id, _run_answer.llm_id).where(_run_answer.run_id == run_id)
+        )
+    )
+
+
+def _promoted_by(run_id: int):
+    """The run's answers, the latest one per pair if a redelivered task answered twice."""
+    return (Answer.id.in_(
+        select(func.max(_run_answer.id)).where(_run_answer.run_id == run_id)
+        .group_by(_run_answer.question_id, _run_answer.llm_id)
+    ),)
+
+
+def finish_run(run_id: int) -> int | None:
+    """
+    Replaces the current answers of every pair the run answered with the run's own, in one
+    transaction: readers see either the old results or the new ones, never a mix or a gap.
+    Pairs the run has no answer for keep their old results. Returns the number of answers
+    promoted, or None if the run was already finished.
+    """
+    claimed = db.session.execute(
+        update(EvaluationRun)
+        .where(EvaluationRun.id == run_id, EvaluationRun.status == 'running')
+        .values(status='completed', finished_at=func.current_timestamp())
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return None
+    retired = set_answers_current(False, *_retired_by(run_id))
+    promoted = set_answers_current(True, *_promoted_by(run_id))
+    db.session.commit()
+    logger.info(f"Finished EvaluationRun {run_id}: {promoted} answers promoted, {retired} retired.")
+    return promoted
+
+
+def finish_overdue_runs() -> list[int]:
+    """Finishes runs still open after RUN_DEADLINE with what they have, e.g. after a worker died mid-run."""
+    # created_at is SQLite's CURRENT_TIMESTAMP (UTC), so the cutoff is computed there too
+    cutoff = func.datetime('now', f'-{RUN_DEADLINE} seconds')
+    overdue = db.session.scalars(
+        select(EvaluationRun.id).where(EvaluationRun.status == 'running', EvaluationRun.created_at < cutoff)
+    ).all()
+    finished = []
+    for run_id in overdue:
+        logger.warning(f"EvaluationRun {run_id} passed its {RUN_DEADLINE}s deadline; finishing it with the results it has.")
+        if finish_run(run_id) is not None:
+            finished.append(run_id)
+    return finished
+
+
+# --- 3. 清理 ---
+
+def _superseded_answers(limit: int):
+    """Answers off the leaderboard that no run in progress will promote any more."""
+    return select(Answer.id)\
+        .outerjoin(EvaluationRun, Answer.run_id == EvaluationRun.id)\
+        .where(Answer.is_current == false(), or_(EvaluationRun.id.is_(None), EvaluationRun.status != 'running'))\
+        .limit(limit)
+
+
+def collect_superseded(batch_size: int = RUN_GC_BATCH) -> int:
+    """
+    Deletes replaced answers and their ratings, `batch_size` answers per transaction, so the
+    cleanup never holds the write lock for long. Returns the number of answers deleted.
+    """
+    deleted = 0
+    while True:
+        answer_ids = db.session.scalars(_superseded_answers(batch_size)).all()
+        if not answer_ids:
+            break
+        delete_ratings(Rating.answer_id.in_(answer_ids))
+        Answer.query.filter(Answer.id.in_(answer_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(answer_ids)
+
+    # Finished runs none of whose answers are left
+    superseded = db.session.execute(
+        update(EvaluationRun)
+        .where(EvaluationRun.status == 'completed', ~exists().where(Answer.run_id == EvaluationRun.id))
+        .values(status='superseded')
+    ).rowcount
+    db.session.commit()
+    if deleted or superseded:
+        logger.info(f"Collected {deleted} replaced answers; {superseded} runs fully superseded.")
+    return deleted
@@ -0,0 +1,104 @@
+# .\singleflight.py
+
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable
+
+import redis
+
+from extensions import redis_client
+
+logger = logging.getLogger('singleflight')
+
+POLL_INTERVAL = 0.2  # 等待其他进程计算结果时的轮询间隔（秒）
+LOCAL_MAX_ENTRIES = 10_000  # Redis 不可用时本地备用缓存的容量
+
+# Only delete the lock if we still own it, so an expired-and-retaken lock is left alone
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class SingleFlight:
+    """
+    Memoises `fn()` per key across every worker process: the first caller takes a Redis
+    lock and computes, concurrent callers wait for its result instead of computing again.
+    Results live in Redis for `ttl` seconds. If Redis is unreachable it degrades to an
+    in-process memo so callers still work, just without cross-process sharing.
+    """
+    def __init__(self, namespace: str, ttl: int, lock_timeout: int, wait_timeout: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.local = OrderedDict()
+        self.local_locks: dict[str, threading.Lock] = {}
+        self.local_guard = threading.Lock()
+
+    def _keys(self, key: str) -> tuple[str, str]:
+        return f"{self.namespace}:result:{key}", f"{self.namespace}:lock:{key}"
+
+    def do(self, key: str, fn: Callable[[], Any], cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+        try:
+            return self._do_redis(key, fn, cacheable)
+        except redis.RedisError as e:
+            logger.warning(f"[{self.namespace}] Redis unavailable ({e}); falling back to in-process memo.")
+            return self._do_local(key, fn, cacheable)
+
+    def _do_redis(self, key, fn, cacheable):
+        result_key, lock_key = self._keys(key)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            stored = redis_client.get(result_key)
+            if stored is not None:
+                logger.debug(f"[{self.namespace}] Shared result hit for {key}.")
+                return pickle.loads(stored)
+
+            token = uuid.uuid4().hex
+            if redis_client.set(lock_key, token, nx=True, ex=self.lock_timeout):
+                try:
+                    value = fn()
+                    # Publish before unlocking, or a waiter could see neither and compute again
+                    if cacheable(value):
+                        try:
+                            redis_client.set(result_key, pickle.dumps(value), ex=self.ttl)
+                        except redis.RedisError as e:
+                            logger.warning(f"[{self.namespace}] Could not share result for {key}: {e}")
+                    return value
+                finally:
+                    self._release(lock_key, token)
+
+            if time.monotonic() >= deadline:
+                logger.warning(f"[{self.namespace}] Gave up waiting for in-flight computation of {key}; computing locally.")
+                return fn()
+            time.sleep(POLL_INTERVAL)
+
+    def _release(self, lock_key: str, token: str):
+        try:
+            redis_client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+        except redis.RedisError as e:
+            # The lock expires on its own after lock_timeout
+            logger.warning(f"[{self.namespace}] Could not release {lock_key}: {e}")
+
+    def _do_local(self, key, fn, cacheable):
+        with self.local_guard:
+            if key in self.local:
+                value, stored_at = self.local[key]
+                if time.monotonic() - stored_at <= self.ttl:
+                    self.local.move_to_end(key)
+                    return value
+            key_lock = self.local_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.local_guard:
+                if key in self.local and time.monotonic() - self.local[key][1] <= self.ttl:
+                    return self.local[key][0]
+            value = fn()
+            with self.local_guard:
+                if cacheable(value):
+                    self.local[key] = (value, time.monotonic())
+                    while len(self.local) > LOCAL_MAX_ENTRIES:
+                        self.local.popitem(last=False)
+                self.local_locks.pop(key, None)
+            return value
@@ -0,0 +1,147 @@
+# .\sqlite_profile.py
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import SQLITE_PRAGMAS, SQLITE_SERIALIZE_WRITES, SQLITE_WRITE_LOCK_TIMEOUT
+
+logger = logging.getLogger('sqlite_profile')
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'CREATE', 'DROP', 'ALTER')
+
+# Under `celery -P gevent` threading is monkey-patched, so this is a greenlet-aware lock. A greenlet
+# waiting on it yields to the others; one waiting in SQLite's busy handler would block the whole worker.
+# The price is that every write of the process queues on it. With `flask sqlite-stress --writers 30
+# --readers 5 --seconds 5` the median commit rises from about 30-50 ms to 120-140 ms, while p99 falls
+# from about 2 s to 300 ms, with no "database is locked" errors either way: steadier, not faster.
+# SQLITE_SERIALIZE_WRITES = False drops it for write-light deployments.
+# It belongs to the pooled connection that took it and is released with that connection's
+# transaction, or by the pool when the connection is checked in or invalidated without one
+_write_lock = threading.Lock()
+
+
+def _set_pragmas(dbapi_connection, connection_record):
+    # The driver's own implicit BEGIN is switched off; _begin_on_first_statement issues it instead
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def _begin(conn):
+    # The BEGIN itself waits for the first statement, which decides between deferred and IMMEDIATE
+    conn.info['sqlite_begin_pending'] = True
+    conn.info['sqlite_writing'] = False
+    conn.info['sqlite_immediate'] = False
+
+
+def _mark_immediate(session, transaction, connection):
+    # Runs after _begin and before the transaction's first statement
+    if session.info.get('sqlite_immediate') and connection.dialect.name == 'sqlite':
+        connection.info['sqlite_immediate'] = True
+
+
+def _take_write_lock(conn):
+    if not SQLITE_SERIALIZE_WRITES or conn.info.get('sqlite_write_lock'):
+        return
+    acquired = _write_lock.acquire(timeout=SQLITE_WRITE_LOCK_TIMEOUT)
+    conn.info['sqlite_write_lock'] = acquired
+    if not acquired:
+        logger.warning(f"Waited {SQLITE_WRITE_LOCK_TIMEOUT}s for the write lock; falling back to busy_timeout.")
+
+
+def _release_write_lock(info: dict):
+    if info.pop('sqlite_write_lock', False):
+        _write_lock.release()
+
+
+def _begin_on_first_statement(conn, cursor, statement, parameters, context, executemany):
+    """
+    Issues the transaction's BEGIN before its first statement: BEGIN IMMEDIATE if that
+    statement writes or the session is in a write_transaction, plain (deferred) BEGIN
+    otherwise. A deferred transaction that writes later is upgraded by SQLite in place,
+    never restarted: if another connection committed since it read, SQLite refuses the
+    write ("database is locked") rather than let it overwrite what it never saw.
+    """
+    writes = statement.lstrip().upper().startswith(WRITE_PREFIXES)
+    if conn.info.pop('sqlite_begin_pending', False):
+        if writes or conn.info.get('sqlite_immediate'):
+            conn.info['sqlite_writing'] = True
+            _take_write_lock(conn)
+            cursor.execute('BEGIN IMMEDIATE')
+        else:
+            cursor.execute('BEGIN')
+    elif writes and not conn.info.get('sqlite_writing', True):
+        # In-process writers still queue on the lock, not in SQLite's busy handler
+        conn.info['sqlite_writing'] = True
+        _take_write_lock(conn)
+
+
+def _end(conn, finish):
+    # Commit/roll back here rather than after the event, so the next writer never sees
+    # the database still locked; the driver's own commit()/rollback() then finds nothing to do
+    if conn.invalidated:
+        return  # the pool's invalidate event has already released what the connection held
+    try:
+        finish(conn.connection.dbapi_connection)
+    finally:
+        conn.info.pop('sqlite_begin_pending', None)
+        conn.info['sqlite_writing'] = True
+        _release_write_lock(conn.info)
+
+
+def _release_on_return(dbapi_connection, connection_record, *args):
+    # A writer that never reached commit or rollback (a killed greenlet, a dropped session, an
+    # invalidated connection) must not leave every later writer waiting out the lock timeout
+    if connection_record is not None:
+        _release_write_lock(connection_record.info)
+
+
+def _commit(conn):
+    _end(conn, lambda dbapi_connection: dbapi_connection.commit())
+
+
+def _rollback(conn):
+    _end(conn, lambda dbapi_connection: dbapi_connection.rollback())
+
+
+@contextmanager
+def write_transaction(session):
+    """
+    Runs the block as one transaction begun with BEGIN IMMEDIATE and commits it. For code
+    that reads, waits on a model and then saves: the session's open transaction, with the
+    snapshot those reads came from, is committed first (expiring what it loaded), so the
+    block reads and writes under the write lock it already holds. Keep the block to the
+    write itself; the lock is held until it ends.
+    """
+    session.commit()
+    session.info['sqlite_immediate'] = True
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop('sqlite_immediate', None)
+
+
+def configure_sqlite(engine):
+    """Applies the SQLite production profile (WAL, busy timeout, serialised writers) to `engine`."""
+    if engine.dialect.name != 'sqlite':
+        return
+    event.listen(engine, 'connect', _set_pragmas)
+    event.listen(engine, 'begin', _begin)
+    event.listen(engine, 'before_cursor_execute', _begin_on_first_statement)
+    event.listen(engine, 'commit', _commit)
+    event.listen(engine, 'rollback', _rollback)
+    event.listen(engine.pool, 'checkin', _release_on_return)
+    event.listen(engine.pool, 'invalidate', _release_on_return)
+    if not event.contains(Session, 'after_begin', _mark_immediate):
+        event.listen(Session, 'after_begin', _mark_immediate)
+    logger.info(f"SQLite profile applied to {engine.url}: {SQLITE_PRAGMAS}, serialise writes: {SQLITE_SERIALIZE_WRITES}.")
@@ -0,0 +1,125 @@
+# .\sqlite_stress.py
+
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from config import SQLALCHEMY_ENGINE_OPTIONS
+from extensions import db
+from models import Answer, LeaderboardAggregate, Question, Rating
+from query_plans import seed
+from sqlite_profile import configure_sqlite, write_transaction
+
+logger = logging.getLogger('sqlite_stress')
+
+QUESTIONS = 200
+MODELS = 8
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[p - 1]
+
+
+class StressResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commit_latencies = []
+        self.read_latencies = []
+        self.errors = {}
+
+    def record(self, bucket: list, seconds: float):
+        with self.lock:
+            bucket.append(seconds)
+
+    def fail(self, error: Exception):
+        message = str(getattr(error, 'orig', error))
+        with self.lock:
+            self.errors[message] = self.errors.get(message, 0) + 1
+
+
+def _writer(engine, result: StressResult, stop: threading.Event, api_latency: float, seed_value: int):
+    """Same shape as process_single_model: read, wait on the model, save the answer, wait on the rater, save the rating."""
+    rng = random.Random(seed_value)
+    with Session(engine) as session:
+        while not stop.is_set():
+            try:
+                question = session.get(Question, rng.randint(1, QUESTIONS))
+                question_id = question.id
+                time.sleep(api_latency)
+                answer = Answer(question_id=question_id, llm_id=rng.randint(1, MODELS), content='stress')
+                started = time.perf_counter()
+                with write_transaction(session):
+                    session.add(answer)
+                result.record(result.commit_latencies, time.perf_counter() - started)
+
+                time.sleep(api_latency)
+                started = time.perf_counter()
+                with write_transaction(session):
+                    session.add(Rating(answer_id=answer.id, llm_id=1, score=rng.randint(0, 5), is_responsive=True))
+                result.record(result.commit_latencies, time.perf_counter() - started)
+            except OperationalError as e:
+                result.fail(e)
+                session.rollback()
+
+
+def _reader(engine, result: StressResult, stop: threading.Event, think_time: float):
+    """The public leaderboard's grouped read over the aggregate table, one page view every `think_time`."""
+    agg = LeaderboardAggregate
+    query = select(agg.llm_id, agg.l1_dim_id, func.sum(agg.score_sum), func.sum(agg.rating_count))\
+        .group_by(agg.llm_id, agg.l1_dim_id)
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(query).all()
+            result.record(result.read_latencies, time.perf_counter() - started)
+        except OperationalError as e:
+            result.fail(e)
+        # Also lets other greenlets run when the command is started under gevent
+        time.sleep(think_time)
+
+
+def run_stress(writers: int = 100, readers: int = 10, seconds: float = 10.0,
+               api_latency: float = 0.05, read_interval: float = 0.01, profile: bool = True) -> StressResult:
+    """
+    Runs `writers` task-shaped writers against `readers` leaderboard readers on a scratch
+    database for `seconds`. With profile=False the engine is SQLAlchemy's stock SQLite setup,
+    for comparison. Writers and readers are threads, or greenlets when run under gevent.
+    """
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='sqlite-stress-')
+    os.close(fd)
+    if profile:
+        engine = create_engine(f'sqlite:///{path}', **SQLALCHEMY_ENGINE_OPTIONS)
+        configure_sqlite(engine)
+    else:
+        engine = create_engine(f'sqlite:///{path}', pool_size=writers + readers)
+    try:
+        db.metadata.create_all(engine)
+        seed(engine, questions=QUESTIONS, models=MODELS)
+
+        result, stop = StressResult(), threading.Event()
+        workers = [threading.Thread(target=_writer, args=(engine, result, stop, api_latency, i)) for i in range(writers)]
+        workers += [threading.Thread(target=_reader, args=(engine, result, stop, read_interval)) for _ in range(readers)]
+        for worker in workers:
+            worker.start()
+        time.sleep(seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        logger.info(f"SQLite stress run finished: {len(result.commit_latencies)} commits, {sum(result.errors.values())} errors.")
+        return result
+    finally:
+        engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
@@ -1,15 +1,28 @@
 # .\tasks.py
 
+import asyncio
 import logging
+import time
+import uuid
+import redis
 from app import create_app
 from extensions import db
 from models import Question, Answer, Setting, LLM, Rating
-from config import DEFAULT_CRITERIA, QUESTION_TEMPLATE, RATERS, DEFAULT_TOTAL_SCORE
-from llm import clients
+from config import DEFAULT_CRITERIA, QUESTION_TEMPLATE, RATERS, DEFAULT_TOTAL_SCORE, GENERATION_DEADLINE, BATCH_POLL_INTERVAL, UPDATE_ALL_MODE, GENERATION_PROFILES, RESULT_WRITE_MODE, UPDATE_ALL_STRATEGY, RUN_MAINTENANCE_MINUTES, PLAN_CHUNK_SIZE, POOL_WORKER_CHECK_INTERVAL, FANOUT_REGENERATION, FANOUT_CHUNK_SIZE
+from llm import asyncio_safe, clients
 from celery import Celery, group
 from celery.schedules import crontab
 from celery.signals import after_setup_logger
-from utils import setup_logging, rate_answer # <-- 1. 修改导入
+from utils import setup_logging, rate_answer, rating_failed # <-- 1. 修改导入
+from aggregates import delete_ratings
+from fingerprints import answer_fingerprint, rating_fingerprint, plan_update
+import batch
+import planner
+import pools
+import progress_feed
+import result_writer
+import runs
+from sqlite_profile import write_transaction
 
 logger = logging.getLogger('celery_tasks')
 
@@ -26,7 +39,16 @@ celery.conf.beat_schedule = {
         'task': 'tasks.update_all_models_task',
         'schedule': crontab(hour=0, minute=0, day_of_week='sunday'),
     },
+    'maintain-evaluation-runs': {
+        'task': 'tasks.maintain_runs_task',
+        'schedule': crontab(minute=f'*/{RUN_MAINTENANCE_MINUTES}'),
+    },
 }
+# Planned chunks are long and carry priorities; a prefetched backlog would let a worker sit on low-priority ones
+celery.conf.worker_prefetch_multiplier = 1
+
+QUEUE_CHECK_INTERVAL = 60  # 检查调度池队列是否有 worker 消费的最短间隔（秒）
+_checked_queues = {}  # queue -> time.monotonic() of the last check that found a consumer
 
 class ContextTask(celery.Task):
     def __call__(self, *args, **kwargs):
@@ -40,6 +62,129 @@ def setup_celery_logging(logger, **kwargs):
     setup_logging()
     logging.info("Celery worker logger configured.")
 
+def _all_rater_ids():
+    rater_llms_all = LLM.query.filter(LLM.name.in_([rater for raters in RATERS.values() for rater in raters])).all()
+    rater_ids_all = {rater.id for rater in rater_llms_all}
+    logger.info(f"[Master Task] Rater model IDs to be excluded: {rater_ids_all}")
+    return rater_ids_all
+
+def _rate(answer, question):
+    setting = Setting.query.filter_by(question_type=question.question_type).first()
+    criteria = setting.criteria if setting else DEFAULT_CRITERIA[question.question_type]
+    total_score = setting.total_score if setting else DEFAULT_TOTAL_SCORE
+    
+    rater_llms = LLM.query.filter(LLM.name.in_(RATERS[question.question_type])).all()
+    rater_ids = [rater.id for rater in rater_llms]
+    
+    logger.info(f"[Sub-Task] Rating Answer ID: {answer.id} with raters: {[r.name for r in rater_llms]}.")
+    
+    # <-- 2. 调用从 utils 导入的函数 -->
+    rating = rate_answer(answer, question, criteria, total_score, rater_ids)
+    if rating is not None:
+        rating.fingerprint = rating_fingerprint(
+            question.question_type, question.content, question.answer, criteria, total_score,
+            [(rater.name, rater.model, rater.base_url) for rater in rater_llms]
+        )
+    return rating
+
+def _result_key(kind, task, scope=''):
+    """Idempotency key for what a task writes; a redelivered or retried task keeps its id. `scope` tells apart the results of one task."""
+    return f"{kind}:{task.request.id or uuid.uuid4().hex}{scope}"
+
+def _save_results(answer=None, rating=None, replaces=()):
+    with write_transaction(db.session):
+        if answer is not None:
+            db.session.add(answer)
+            db.session.flush()
+            if rating is not None:
+                rating.answer_id = answer.id
+        if rating is not None:
+            db.session.add(rating)
+            if replaces:
+                # In the transaction the new rating lands in, so the answer is never left unrated
+                db.session.flush()
+                delete_ratings(Rating.id.in_(replaces))
+
+def _publish_results(answer=None, rating=None, run_id=None, replaces=()):
+    """Hands the results to the result writer; writes them here if the stream is unreachable. Returns True in that case."""
+    try:
+        result_writer.publish_results(answer, rating, run_id, replaces)
+        return False
+    except redis.RedisError as e:
+        logger.warning(f"Result stream unavailable ({e}); writing directly.")
+        _save_results(answer, rating, replaces)
+        return True
+
+def _pair_done(run_id, count=1):
+    # Old results replaced by a finished run are cleaned up in the background
+    if run_id is not None and runs.pair_done(run_id, count):
+        collect_superseded_task.delay()
+
+def _rate_saved_answer(answer, question, task, replaces=()):
+    """
+    Rates a saved answer; the ratings in `replaces` are deleted once the new one is written.
+    Returns True if its pair is settled here, False if the result writer settles it on write.
+    """
+    rating = _rate(answer, question)
+    if replaces and rating is not None and rating_failed(rating):
+        # A stale score is still a score; the next smart update tries again
+        logger.warning(f"[Sub-Task] No rater scored Answer ID {answer.id}; keeping its ratings {list(replaces)}.")
+        rating = None
+    written_here = True
+    if RESULT_WRITE_MODE == 'stream':
+        if rating is not None:
+            rating.idempotency_key = _result_key('rating', task, f':a{answer.id}')
+            written_here = _publish_results(rating=rating, run_id=answer.run_id, replaces=replaces)
+    else:
+        _save_results(rating=rating, replaces=replaces)
+    progress_feed.record(answer.run_id, answer.question_id, answer.llm_id, 'rated' if rating is not None else 'failed')
+    return written_here
+
+def _start_run(label, pairs, chunk_size=PLAN_CHUNK_SIZE, fanout=False):
+    """
+    Regenerates (llm_id, question_id) pairs under a new run, planned as prioritised chunks of
+    `chunk_size` pairs per message; the old results stay live until all are rated. Pairs
+    already in flight are not asked again; returns None if that leaves nothing to do.
+    With `fanout`, chunks of FANOUT_CHUNK_SIZE pairs go to the fan-out engine instead of
+    the pool queues, each asked all at once.
+    """
+    if not pairs:
+        return None
+    if fanout:
+        run, chunks, _ = planner.plan_run(label, pairs, FANOUT_CHUNK_SIZE, queue=pools.FANOUT_QUEUE)
+    else:
+        run, chunks, _ = planner.plan_run(label, pairs, chunk_size)
+    chunk_task = process_chunk_concurrently if fanout else process_pair_chunk
+    _ensure_consumed({queue for _, _, queue in chunks})
+    for chunk_id, priority, queue in chunks:
+        chunk_task.apply_async((chunk_id,), priority=priority, queue=queue)
+    return run
+
+def _ensure_consumed(queues):
+    """
+    Warns about chunk queues no worker consumes yet. `flask pool-workers` starts a worker
+    capped at the pool's concurrency for a new pool on its next pass; until then the
+    queue's chunks wait in Redis. They are not handed to the default queue's workers,
+    which would run them uncapped. The fan-out queue's workers are started by run.sh.
+    """
+    now = time.monotonic()
+    unchecked = {q for q in queues if now - _checked_queues.get(q, -QUEUE_CHECK_INTERVAL) >= QUEUE_CHECK_INTERVAL}
+    if not unchecked:
+        return
+    try:
+        replies = celery.control.inspect(timeout=1).active_queues()
+    except Exception as e:
+        logger.warning(f"Could not check which queues the workers consume: {e}")
+        return
+    if not replies:
+        return  # no worker up at all
+    consumed = {queue['name'] for worker_queues in replies.values() for queue in worker_queues}
+    for queue in unchecked:
+        if queue not in consumed:
+            logger.warning(f"No worker consumes '{queue}' yet; its chunks wait until `flask pool-workers` starts one "
+                           f"(within {POOL_WORKER_CHECK_INTERVAL}s if it is running).")
+        _checked_queues[queue] = now
+
 @celery.task
 def process_question(question_id):
     logger.info(f"--- [Master Task] FORCING REGENERATION for Question ID: {question_id} ---")
@@ -49,72 +194,197 @@ def process_question(question_id):
         logger.error(f"[Master Task] Failed: Could not find Question with ID {question_id}.")
         return
 
-    answer_ids_to_delete = db.session.query(Answer.id).filter(Answer.question_id == question_id).scalar_subquery()
-    logger.info(f"[Master Task] Deleting ALL old ratings for Question ID: {question_id}.")
-    Rating.query.filter(Rating.answer_id.in_(answer_ids_to_delete)).delete(synchronize_session=False)
-
-    logger.info(f"[Master Task] Deleting ALL old answers for Question ID: {question_id}.")
-    Answer.query.filter_by(question_id=question_id).delete(synchronize_session=False)
-    
-    db.session.commit()
-    logger.info(f"[Master Task] Old data cleared successfully for Question ID: {question_id}.")
-    
-    rater_llms_all = LLM.query.filter(LLM.name.in_([rater for raters in RATERS.values() for rater in raters])).all()
-    rater_ids_all = {rater.id for rater in rater_llms_all}
-    logger.info(f"[Master Task] Rater model IDs to be excluded: {rater_ids_all}")
+    rater_ids_all = _all_rater_ids()
 
     llms_to_process = LLM.query.filter(LLM.id.notin_(rater_ids_all)).all()
     if not llms_to_process:
         logger.warning(f"[Master Task] No models to process for Question ID {question_id} after excluding raters.")
         return
 
-    # from celery import group
-    job = group(
-        process_single_model.s(llm.id, question.id) for llm in llms_to_process
-    )
-    job.apply_async()
-    
-    logger.info(f"[Master Task] All sub-tasks for Question ID {question_id} have been queued for fresh generation.")
-    
+    # Through the fan-out engine the models answer in one message; otherwise one pair per message, so they still answer in parallel
+    run = _start_run(f'question {question_id}', [(llm.id, question.id) for llm in llms_to_process], chunk_size=1,
+                     fanout=FANOUT_REGENERATION)
+    if run is None:
+        logger.info(f"[Master Task] Every model is already working on Question ID {question_id}; nothing new queued.")
+        return
+    logger.info(f"[Master Task] All sub-tasks for Question ID {question_id} have been queued for fresh generation under run {run.id}.")
+
 @celery.task
-def process_single_model(model_id, question_id):
+def rate_single_answer(answer_id, replaces=None):
+    """Rates a saved answer; `replaces` are ids of its stale ratings, swapped out for the new one."""
+    answer = db.session.get(Answer, answer_id)
+    if not answer:
+        logger.error(f"[Rating Task] Failed: Could not find Answer with ID {answer_id}.")
+        return
+    if _rate_saved_answer(answer, answer.question, rate_single_answer, replaces or ()):
+        _pair_done(answer.run_id)
+    logger.info(f"[Rating Task] Finished rating Answer ID: {answer_id}.")
+    
+def _generate_and_rate(model_id, question_id, run_id, task):
+    """
+    Generates one model's answer to one question and rates it. Returns True if the pair is
+    settled here, False if its results went to the result writer, which settles it on write.
+    """
     logger.info(f"[Sub-Task] Started for Model ID: {model_id}, Question ID: {question_id}.")
     
     question = db.session.get(Question, question_id)
     llm = db.session.get(LLM, model_id)
     if not question or not llm:
         logger.error(f"[Sub-Task] Failed: Could not find Question {question_id} or LLM {model_id}.")
-        return
+        progress_feed.record(run_id, question_id, model_id, 'failed')
+        return True
 
     question_prompt = QUESTION_TEMPLATE[question.question_type].format(question.content)
-    response_content = clients.generate_response(question_prompt, llm.id)
+    response_content = clients.generate_response(question_prompt, llm.id, profile=GENERATION_PROFILES[question.question_type])
+    progress_feed.record(run_id, question_id, model_id, 'generated')
     
     answer = Answer(
         question_id=question.id,
         llm_id=llm.id,
-        content=response_content
+        content=response_content,
+        fingerprint=answer_fingerprint(question.question_type, question.content, llm.model, llm.base_url),
+        # Inside a run the answer stays off the leaderboard until the whole run is done
+        run_id=run_id,
+        is_current=run_id is None
     )
-    db.session.add(answer)
-    db.session.commit()
+    if RESULT_WRITE_MODE == 'stream':
+        # The answer is rated before it is saved; both go to the result writer together
+        pair_scope = f':m{model_id}-q{question_id}'
+        answer.idempotency_key = _result_key('answer', task, pair_scope)
+        rating = _rate(answer, question)
+        if rating is not None:
+            rating.idempotency_key = _result_key('rating', task, pair_scope)
+        written_here = _publish_results(answer, rating)
+        progress_feed.record(run_id, question_id, model_id, 'rated' if rating is not None else 'failed')
+        logger.info(f"[Sub-Task] Queued answer and rating for Model ID: {model_id}, Question ID: {question_id}.")
+        return written_here
+
+    with write_transaction(db.session):
+        db.session.add(answer)
     logger.info(f"[Sub-Task] Generated and saved Answer ID: {answer.id} for Model ID: {model_id}.")
 
-    setting = Setting.query.filter_by(question_type=question.question_type).first()
-    criteria = setting.criteria if setting else DEFAULT_CRITERIA[question.question_type]
-    total_score = setting.total_score if setting else DEFAULT_TOTAL_SCORE
-    
-    rater_llms = LLM.query.filter(LLM.name.in_(RATERS[question.question_type])).all()
-    rater_ids = [rater.id for rater in rater_llms]
-    
-    logger.info(f"[Sub-Task] Rating Answer ID: {answer.id} with raters: {[r.name for r in rater_llms]}.")
-    
-    # <-- 2. 调用从 utils 导入的函数 -->
-    rate_answer(answer, question, criteria, total_score, rater_ids)
-    
-    db.session.commit()
+    _rate_saved_answer(answer, question, task)
     logger.info(f"[Sub-Task] Finished processing for Model ID: {model_id}, Question ID: {question_id}.")
+    return True
+
+@celery.task
+def process_single_model(model_id, question_id, run_id=None):
+    if _generate_and_rate(model_id, question_id, run_id, process_single_model):
+        _pair_done(run_id)
+
+@celery.task
+def process_pair_chunk(chunk_id):
+    """
+    Works through one planned chunk of (model, question) pairs: one broker message instead of
+    one per pair. A pool's concurrency is that of the worker consuming its queue (see run.sh).
+    """
+    chunk = planner.start_chunk(chunk_id)
+    if chunk is None:
+        logger.warning(f"[Chunk Task] EvaluationChunk {chunk_id} is gone, already done or its run has finished; skipping.")
+        return
+    run_id, pairs = chunk.run_id, chunk.pairs
+    settled = 0
+    for model_id, question_id, *_ in pairs:
+        try:
+            settled += _generate_and_rate(model_id, question_id, run_id, process_pair_chunk)
+        except Exception as e:
+            # One failing pair must not cost the rest of the chunk; it counts as given up on
+            db.session.rollback()
+            logger.error(f"[Chunk Task] Model ID {model_id}, Question ID {question_id} failed: {e}", exc_info=True)
+            progress_feed.record(run_id, question_id, model_id, 'failed')
+            settled += 1
+    planner.finish_chunk(chunk)
+    if settled:
+        _pair_done(run_id, settled)
+    logger.info(f"[Chunk Task] Finished EvaluationChunk {chunk_id}: {len(pairs)} pairs of run {run_id}.")
+
+@celery.task
+def process_chunk_concurrently(chunk_id, timeout=GENERATION_DEADLINE):
+    """
+    The fan-out engine's counterpart of process_pair_chunk: every pair of the chunk is asked
+    at once from one event loop, so one worker slot keeps the whole chunk in flight instead of
+    a greenlet per request. Answers are saved as they arrive and rating is handed off to
+    rate_single_answer. It runs on the prefork workers of the fan-out queue (see run.sh); on a
+    gevent worker, where asyncio.run() is not safe, it works through the chunk pair by pair.
+    """
+    if not asyncio_safe():
+        logger.info(f"[Fan-out Task] No safe event loop on this worker; working through EvaluationChunk {chunk_id} pair by pair.")
+        return process_pair_chunk(chunk_id)
+
+    chunk = planner.start_chunk(chunk_id)
+    if chunk is None:
+        logger.warning(f"[Fan-out Task] EvaluationChunk {chunk_id} is gone, already done or its run has finished; skipping.")
+        return
+    run_id, pairs = chunk.run_id, chunk.pairs
+    # The models come from the LLM table, like process_question's; a worker may predate some of their clients
+    questions = {question.id: question for question in Question.query.filter(Question.id.in_({pair[1] for pair in pairs}))}
+    llms = {llm.id: llm for llm in LLM.query.filter(LLM.id.in_({pair[0] for pair in pairs}))}
+    clients.add_missing(llms.values())
+    calls = []
+    for model_id, question_id, fingerprint in pairs:
+        question = questions.get(question_id)
+        if question is None or model_id not in llms:
+            logger.error(f"[Fan-out Task] Failed: Could not find Question {question_id} or LLM {model_id}.")
+            progress_feed.record(run_id, question_id, model_id, 'failed')
+            continue
+        prompt = QUESTION_TEMPLATE[question.question_type].format(question.content)
+        calls.append(((model_id, question_id, fingerprint), model_id, prompt, GENERATION_PROFILES[question.question_type]))
+
+    async def collect():
+        answer_ids = []
+        async for (model_id, question_id, fingerprint), response_content in clients.agenerate(calls, timeout):
+            answer = Answer(question_id=question_id, llm_id=model_id, content=response_content,
+                            fingerprint=fingerprint, run_id=run_id, is_current=False)
+            try:
+                with write_transaction(db.session):
+                    db.session.add(answer)
+            except Exception as e:
+                # One answer that cannot be saved must not cost the rest of the chunk; it counts as given up on
+                logger.error(f"[Fan-out Task] Saving the answer of Model ID {model_id}, Question ID {question_id} failed: {e}", exc_info=True)
+                progress_feed.record(run_id, question_id, model_id, 'failed')
+                continue
+            progress_feed.record(run_id, question_id, model_id, 'generated')
+            answer_ids.append(answer.id)
+        return answer_ids
+
+    answer_ids = asyncio.run(collect())
+    planner.finish_chunk(chunk)
+    # Pairs without an answer are settled here; the others once their rating is written
+    if len(pairs) > len(answer_ids):
+        _pair_done(run_id, len(pairs) - len(answer_ids))
+    if answer_ids:
+        group(rate_single_answer.s(answer_id) for answer_id in answer_ids).apply_async()
+    logger.info(f"[Fan-out Task] Finished EvaluationChunk {chunk_id}: {len(answer_ids)} of {len(pairs)} pairs of run {run_id} answered; rating queued.")
 
 # <-- 3. 删除本地的 rate_answer 函数 -->
 
+@celery.task
+def smart_update_task(question_ids=None, llm_ids=None, via_batch=False):
+    """
+    Incremental counterpart of process_question: only (model, question) pairs whose answer
+    fingerprint is out of date are regenerated and only stale or missing ratings are redone.
+    Regenerated answers replace the old ones when their run finishes, and a stale rating
+    stays on the leaderboard until its replacement is written. Returns the counts of
+    regenerated, re-rated and skipped pairs.
+    """
+    plan = plan_update(question_ids, llm_ids)
+
+    if via_batch:
+        by_model = {}
+        for llm_id, question_id in plan.regenerate:
+            by_model.setdefault(llm_id, []).append(question_id)
+        for llm_id, stale_question_ids in by_model.items():
+            submit_batch_evaluation_task.delay([llm_id], stale_question_ids)
+    else:
+        _start_run('smart update', plan.regenerate)
+    if plan.rerate:
+        group(rate_single_answer.s(answer_id, plan.stale_ratings.get(answer_id)) for answer_id in plan.rerate).apply_async()
+
+    summary = plan.summary()
+    logger.info(f"[Smart Update] Regenerating {summary['regenerate']} pairs, re-rating {summary['rerate']} answers, "
+                f"skipped {summary['skipped']} up-to-date pairs.")
+    return summary
+
 @celery.task
 def update_all_questions_for_model(model_id):
     """
@@ -127,28 +397,109 @@ def update_all_questions_for_model(model_id):
         logger.warning(f"[Model Update Task] No questions found in the database. Nothing to do for Model ID: {model_id}.")
         return
         
-    # Create a group of tasks to process each question for the given model
-    job = group(
-        process_single_model.s(model_id, q_id[0]) for q_id in question_ids
-    )
-    job.apply_async()
+    # One run for the model: its new answers replace the old ones together once all are rated
+    run = _start_run(f'model {model_id}', [(model_id, q_id[0]) for q_id in question_ids])
     
-    logger.info(f"[Model Update Task] Queued {len(question_ids)} update sub-tasks for Model ID: {model_id}.")
+    if run is None:
+        logger.info(f"[Model Update Task] Every question is already in flight for Model ID: {model_id}; nothing new queued.")
+        return
+    logger.info(f"[Model Update Task] Queued {run.expected} update sub-tasks for Model ID: {model_id} under run {run.id}.")
+
+@celery.task
+def submit_batch_evaluation_task(llm_ids=None, question_ids=None):
+    """
+    Offline mode: writes one JSONL request file per model, submits each through its
+    batch backend and leaves the rest to poll_batch_jobs_task.
+    """
+    logger.info("--- [Batch Task] Building and submitting generation batches ---")
+    if llm_ids is None:
+        rater_ids_all = _all_rater_ids()
+        llm_ids = [llm_id for (llm_id,) in db.session.query(LLM.id).filter(LLM.id.notin_(rater_ids_all))]
+
+    submitted = 0
+    for llm_id in llm_ids:
+        job = batch.submit_generation_batch(llm_id, question_ids)
+        if job is not None and job.status == 'submitted':
+            submitted += 1
+    logger.info(f"[Batch Task] Submitted {submitted} batch jobs for {len(llm_ids)} models.")
+    if submitted:
+        poll_batch_jobs_task.apply_async(countdown=BATCH_POLL_INTERVAL)
+
+@celery.task
+def poll_batch_jobs_task():
+    """Advances every open batch job; completed ones are ingested and their answers queued for rating."""
+    open_jobs = db.session.scalars(batch.open_jobs_query()).all()
+    still_running = 0
+    for job in open_jobs:
+        try:
+            status = job.status if job.status == 'completed' else batch.poll_batch_job(job)
+            if status == 'in_progress' or status == 'submitted':
+                still_running += 1
+                continue
+            if status == 'completed':
+                answer_ids = batch.ingest_batch_job(job)
+                group(rate_single_answer.s(answer_id) for answer_id in answer_ids).apply_async()
+                logger.info(f"[Batch Task] BatchJob {job.id} ingested; {len(answer_ids)} answers queued for rating.")
+            else:
+                logger.error(f"[Batch Task] BatchJob {job.id} failed: {job.error}")
+        except Exception as e:
+            # One broken job must not stop the others; it stays open and is retried on the next poll
+            db.session.rollback()
+            logger.error(f"[Batch Task] BatchJob {job.id} could not be advanced, retrying later: {e}", exc_info=True)
+            still_running += 1
+
+    if still_running:
+        logger.info(f"[Batch Task] {still_running} batch jobs still running; polling again in {BATCH_POLL_INTERVAL}s.")
+        poll_batch_jobs_task.apply_async(countdown=BATCH_POLL_INTERVAL)
+
+def _regenerate_questions(label, question_ids):
+    """One run for every evaluated model on `question_ids`: the leaderboard switches to the new results in one step at the end."""
+    llm_ids = [llm_id for (llm_id,) in db.session.query(LLM.id).filter(LLM.id.notin_(_all_rater_ids()))]
+    return _start_run(label, [(llm_id, qid) for qid in question_ids for llm_id in llm_ids], fanout=FANOUT_REGENERATION)
 
 @celery.task
-def update_all_models_task():
+def update_questions_task(question_ids):
+    """Forced regeneration of a selection of questions by every model, planned as one run."""
+    run = _regenerate_questions(f'{len(question_ids)} selected questions', question_ids)
+    if run is None:
+        logger.info(f"[Update Task] Every pair of the {len(question_ids)} selected questions is already in flight; nothing new queued.")
+        return
+    logger.info(f"[Update Task] Queued {run.expected} pairs of {len(question_ids)} selected questions under run {run.id}.")
+
+@celery.task
+def update_all_models_task(strategy=None):
+    """The full update, weekly or from the leaderboard; `strategy` overrides UPDATE_ALL_STRATEGY."""
     logger.info("--- [Scheduled Task] Updating all models for all questions ---")
+    if (strategy or UPDATE_ALL_STRATEGY) == 'smart':
+        smart_update_task.delay(via_batch=(UPDATE_ALL_MODE == 'batch'))
+        logger.info("[Scheduled Task] Handed the update to the smart update task.")
+        return
+    if UPDATE_ALL_MODE == 'batch':
+        submit_batch_evaluation_task.delay()
+        logger.info("[Scheduled Task] Handed the full update to the batch pipeline.")
+        return
     try:
         all_question_ids = [q.id for q in Question.query.with_entities(Question.id).all()]
         if not all_question_ids:
             logger.warning("[Scheduled Task] No questions found, skipping.")
             return
         
-        job = group(
-            process_question.s(qid) for qid in all_question_ids
-        )
-        job.apply_async()
+        run = _regenerate_questions('full update', all_question_ids)
             
-        logger.info(f"[Scheduled Task] Successfully queued updates for {len(all_question_ids)} questions.")
+        logger.info(f"[Scheduled Task] Successfully queued updates for {len(all_question_ids)} questions under run {run.id if run else '-'}.")
     except Exception as e:
         logger.error(f"[Scheduled Task] Failed to queue update tasks: {e}", exc_info=True)
+
+@celery.task
+def collect_superseded_task():
+    """Deletes answers and ratings replaced by finished runs, a small batch per transaction."""
+    deleted = runs.collect_superseded()
+    logger.info(f"[Run Cleanup] Deleted {deleted} replaced answers.")
+
+@celery.task
+def maintain_runs_task():
+    """Periodic: finishes runs past their deadline, then cleans up what finished runs replaced."""
+    overdue = runs.finish_overdue_runs()
+    if overdue:
+        logger.warning(f"[Run Cleanup] Finished overdue runs: {overdue}.")
+    collect_superseded_task.delay()
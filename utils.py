@@ -1,21 +1,38 @@
 # .\utils.py
 
+import hashlib
 import logging
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 import datetime
 
-from models import Answer, Question, Rating, LLM, Dimension
+from models import Answer, Question, Rating, LLM, Dimension, LeaderboardAggregate
 from extensions import db
 from config import (
     RATING_TEMPLATE, 
     RATING_FAIL_RETRIES, 
     SUBJECTIVE_QUESTION_WEIGHT, 
-    OBJECTIVE_QUESTION_WEIGHT
+    OBJECTIVE_QUESTION_WEIGHT,
+    RATING_MEMO_TTL,
+    RATING_MEMO_LOCK_TIMEOUT,
+    RATING_DEADLINE,
+    GENERATION_PROFILES
 )
 from llm import clients
-from sqlalchemy.orm import aliased
+from singleflight import SingleFlight
+from objective_scorer import objective_scorer
+
+# What a rater's part of a rating comment says when it produced no score
+RATING_FAILED = 'Rating Failed'
+RATING_TIMED_OUT = 'Rating Timed Out'
+
+
+def rating_failed(rating: Rating) -> bool:
+    """Whether no rater scored the rating, so its 0 stands for nothing."""
+    return all(line.endswith((RATING_FAILED, RATING_TIMED_OUT)) for line in (rating.comment or '').split('\n'))
 
 
 # --- 1. 日志设置工具 (原 module_logger.py) ---
@@ -45,7 +62,8 @@ def setup_logging(
         datefmt=None
     )
     if console:
-        console_handler = logging.StreamHandler(sys.stdout)
+        # stderr, so what a `flask` command prints to stdout can be piped without the app's log lines
+        console_handler = logging.StreamHandler(sys.stderr)
         console_handler.setFormatter(formatter)
         root_logger.addHandler(console_handler)
     log_path = Path(log_dir)
@@ -76,8 +94,35 @@ def calculate_weighted_average(
 
 # --- 3. 答案评分工具 (原 tasks.py 中的 rate_answer) ---
 
-def rate_answer(answer: Answer, question: Question, criteria: str, total_score: float, rater_ids: list[int]):
-    """Rates a given answer using specified raters and criteria."""
+# Identical rating prompts (e.g. dozens of models answering "B") are rated once and shared
+rating_memo = SingleFlight('rating_memo', ttl=RATING_MEMO_TTL, lock_timeout=RATING_MEMO_LOCK_TIMEOUT, wait_timeout=RATING_MEMO_LOCK_TIMEOUT)
+
+def criteria_version(criteria: str, total_score: float) -> str:
+    """Short hash of everything besides the prompt that decides whether a score is valid."""
+    return hashlib.sha256(f"{total_score}\n{criteria}".encode('utf-8')).hexdigest()[:16]
+
+def _score_with_rater(rater_id: int, rating_prompt: str, total_score: float, answer_id: int, deadline: float) -> float:
+    """Asks one rater for a score, retrying unparseable or out-of-range replies. Returns -1.0 on failure."""
+    logger = logging.getLogger('utils.rate_answer')
+    for i in range(RATING_FAIL_RETRIES):
+        if time.monotonic() >= deadline:
+            logger.warning(f"Rater ID {rater_id} ran out of time for Answer ID {answer_id} after {i} tries.")
+            break
+        # A cached reply that failed to parse would fail again, so retries go to the rater
+        raw_score = clients.generate_response(rating_prompt, rater_id, use_cache=(i == 0), profile=GENERATION_PROFILES['rating'])
+        try:
+            parsed_score = float(raw_score)
+            if 0 <= parsed_score <= total_score:
+                logger.info(f"Rater ID {rater_id} gave a valid score: {parsed_score} for Answer ID {answer_id}.")
+                return parsed_score
+            else:
+                logger.warning(f"Rater ID {rater_id} gave out-of-range score: {parsed_score}. Retrying... ({i+1}/{RATING_FAIL_RETRIES})")
+        except (ValueError, TypeError):
+            logger.warning(f"Failed to parse score from rater ID {rater_id}. Raw: '{raw_score}'. Retrying... ({i+1}/{RATING_FAIL_RETRIES})")
+    return -1.0
+
+def rate_answer(answer: Answer, question: Question, criteria: str, total_score: float, rater_ids: list[int]) -> Rating | None:
+    """Rates a given answer using specified raters and criteria; returns the unsaved Rating."""
     valid_scores = []
     rater_comments = []
     logger = logging.getLogger('utils.rate_answer')
@@ -85,7 +130,7 @@ def rate_answer(answer: Answer, question: Question, criteria: str, total_score:
     prompt_template = RATING_TEMPLATE.get(question.question_type)
     if not prompt_template:
         logger.error(f"No rating template found for question type: {question.question_type}")
-        return
+        return None
 
     format_args = {
         'question': question.content,
@@ -94,74 +139,92 @@ def rate_answer(answer: Answer, question: Question, criteria: str, total_score:
     }
     if question.question_type == 'objective':
         format_args['answer'] = question.answer
+        # Letter-vs-letter comparisons are settled here; only unclear replies reach the raters
+        local_score = objective_scorer.score(answer.content, question.answer, criteria, total_score)
+        if local_score is not None:
+            logger.info(f"Objective answer ID {answer.id} scored locally: {local_score}.")
+            return _build_rating(answer, local_score, [f'local_scorer: {local_score}'])
 
     rating_prompt = prompt_template.format(**format_args)
+    version = criteria_version(criteria, total_score)
 
-    for rater_id in rater_ids:
-        score = -1.0
-        for i in range(RATING_FAIL_RETRIES):
-            raw_score = clients.generate_response(rating_prompt, rater_id)
-            try:
-                parsed_score = float(raw_score)
-                if 0 <= parsed_score <= total_score:
-                    score = parsed_score
-                    logger.info(f"Rater ID {rater_id} gave a valid score: {score} for Answer ID {answer.id}.")
-                    break
-                else:
-                    logger.warning(f"Rater ID {rater_id} gave out-of-range score: {parsed_score}. Retrying... ({i+1}/{RATING_FAIL_RETRIES})")
-            except (ValueError, TypeError):
-                logger.warning(f"Failed to parse score from rater ID {rater_id}. Raw: '{raw_score}'. Retrying... ({i+1}/{RATING_FAIL_RETRIES})")
-        
-        rater_llm = db.session.get(LLM, rater_id)
-        rater_name = rater_llm.name if rater_llm else f"RaterID_{rater_id}"
+    # One query for every rater's name, done before fanning out so worker threads never touch the session
+    rater_names = dict(db.session.query(LLM.id, LLM.name).filter(LLM.id.in_(rater_ids)).all())
+    deadline = time.monotonic() + RATING_DEADLINE
+
+    def score_with_memo(rater_id: int) -> float:
+        memo_key = hashlib.sha256(f"{rater_id}\n{version}\n{rating_prompt}".encode('utf-8')).hexdigest()
+        return rating_memo.do(
+            memo_key,
+            lambda: _score_with_rater(rater_id, rating_prompt, total_score, answer.id, deadline),
+            cacheable=lambda value: value != -1.0
+        )
+
+    executor = ThreadPoolExecutor(max_workers=max(1, len(rater_ids)), thread_name_prefix='rater')
+    futures = {rater_id: executor.submit(score_with_memo, rater_id) for rater_id in rater_ids}
+    wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for rater_id, future in futures.items():
+        rater_name = rater_names.get(rater_id, f"RaterID_{rater_id}")
+        if not future.done():
+            logger.error(f"Rating for Answer ID: {answer.id} by Rater '{rater_name}' missed the {RATING_DEADLINE}s deadline.")
+            rater_comments.append(f'{rater_name}: {RATING_TIMED_OUT}')
+            continue
+        try:
+            score = future.result()
+        except Exception as e:
+            logger.error(f"Rater '{rater_name}' raised while rating Answer ID: {answer.id}: {e}", exc_info=True)
+            score = -1.0
 
         if score != -1.0:
             valid_scores.append(score)
         else:
             logger.error(f"Rating failed for Answer ID: {answer.id} by Rater '{rater_name}' after {RATING_FAIL_RETRIES} retries.")
-        rater_comments.append(f'{rater_name}: {score if score != -1.0 else "Rating Failed"}')
+        rater_comments.append(f'{rater_name}: {score if score != -1.0 else RATING_FAILED}')
     
     final_score = sum(valid_scores) / len(valid_scores) if valid_scores else 0.0
+    return _build_rating(answer, final_score, rater_comments)
+
+def _build_rating(answer: Answer, final_score: float, rater_comments: list[str]) -> Rating:
     is_responsive = not (2.5 <= final_score <= 3.5)
-    logger.info(f"Final score for Answer ID {answer.id} is {final_score:.2f}. Is responsive: {is_responsive}.")
+    logging.getLogger('utils.rate_answer').info(f"Final score for Answer ID {answer.id} is {final_score:.2f}. Is responsive: {is_responsive}.")
 
-    rating = Rating(
+    return Rating(
         answer_id=answer.id,
         llm_id=answer.llm_id,
         score=final_score,
         is_responsive=is_responsive,
         comment='\n'.join(rater_comments)
     )
-    db.session.add(rating)
 
 
 # --- 4. 公共榜单数据生成工具 ---
 
+def leaderboard_totals_query(llm_ids: list[int]):
+    """
+    One row per (model, L1 dimension), with the question types split by CASE sums. The rows
+    come from the pre-aggregated table, so the cost does not grow with the rating count.
+    """
+    agg = LeaderboardAggregate
+    return db.select(
+        agg.llm_id,
+        agg.l1_dim_id,
+        db.func.sum(db.case((agg.question_type == 'subjective', agg.score_sum), else_=0)).label('subj_score_total'),
+        db.func.sum(db.case((agg.question_type == 'subjective', agg.rating_count), else_=0)).label('subj_count'),
+        db.func.sum(db.case((agg.question_type == 'objective', agg.score_sum), else_=0)).label('obj_score_total'),
+        db.func.sum(db.case((agg.question_type == 'objective', agg.rating_count), else_=0)).label('obj_count'),
+        db.func.sum(agg.responsive_count).label('responsive_count'),
+        db.func.sum(agg.rating_count).label('total_rating_count')
+    ).where(agg.llm_id.in_(llm_ids))\
+     .group_by(agg.llm_id, agg.l1_dim_id)
+
 def generate_leaderboard_data(rater_names: list[str]) -> dict:
     """Fetches and processes all data required for the public leaderboard."""
     models = LLM.query.filter(LLM.name.notin_(rater_names)).all()
     l1_dims_objects = Dimension.query.filter_by(level=1).order_by(Dimension.id).all()
     l1_dims = [{'id': dim.id, 'name': dim.name} for dim in l1_dims_objects]
 
-    dim_level3 = aliased(Dimension)
-    dim_level2 = aliased(Dimension)
-    dim_level1 = aliased(Dimension)
-
-    ratings_query = db.session.query(
-        Rating.score,
-        Rating.is_responsive,
-        Answer.llm_id,
-        Question.question_type,
-        dim_level1.id.label('l1_dim_id')
-    ).join(Answer, Rating.answer_id == Answer.id)\
-     .join(Question, Answer.question_id == Question.id)\
-     .join(dim_level3, Question.dimension_id == dim_level3.id)\
-     .join(dim_level2, dim_level3.parent == dim_level2.id)\
-     .join(dim_level1, dim_level2.parent == dim_level1.id)\
-     .filter(Answer.llm_id.in_([m.id for m in models]))
-
-    all_ratings_data = ratings_query.all()
-
     model_scores = {}
     for model in models:
         model_scores[model.id] = {
@@ -174,31 +237,19 @@ def generate_leaderboard_data(rater_names: list[str]) -> dict:
                     'subj_score_total': 0.0, 'subj_count': 0,
                     'obj_score_total': 0.0, 'obj_count': 0,
                 } for dim in l1_dims
-            }
+            },
+            'ranks': {}
         }
 
-    for r in all_ratings_data:
-        if r.llm_id not in model_scores: continue
-        
-        if r.question_type == 'subjective':
-            model_scores[r.llm_id]['subj_score_total'] += r.score
-            model_scores[r.llm_id]['subj_count'] += 1
-        elif r.question_type == 'objective':
-            model_scores[r.llm_id]['obj_score_total'] += r.score
-            model_scores[r.llm_id]['obj_count'] += 1
-        
-        dim_data = model_scores[r.llm_id]['dim_scores'].get(r.l1_dim_id)
+    # Streamed, so memory does not grow with the number of rows either
+    for r in db.session.execute(leaderboard_totals_query([m.id for m in models]).execution_options(yield_per=1000)):
+        data = model_scores[r.llm_id]
+        for field in ('subj_score_total', 'subj_count', 'obj_score_total', 'obj_count', 'responsive_count', 'total_rating_count'):
+            data[field] += getattr(r, field)
+        dim_data = data['dim_scores'].get(r.l1_dim_id)
         if dim_data:
-            if r.question_type == 'subjective':
-                dim_data['subj_score_total'] += r.score
-                dim_data['subj_count'] += 1
-            elif r.question_type == 'objective':
-                dim_data['obj_score_total'] += r.score
-                dim_data['obj_count'] += 1
-
-        model_scores[r.llm_id]['total_rating_count'] += 1
-        if r.is_responsive:
-            model_scores[r.llm_id]['responsive_count'] += 1
+            for field in ('subj_score_total', 'subj_count', 'obj_score_total', 'obj_count'):
+                dim_data[field] += getattr(r, field)
 
     leaderboard_data = []
     for model_id, data in model_scores.items():
@@ -215,16 +266,12 @@ def generate_leaderboard_data(rater_names: list[str]) -> dict:
             )
         leaderboard_data.append(data)
 
+    # Ranks come from ordering each dimension's averages; the list itself is sorted once, at the end
     for dim in l1_dims:
-        leaderboard_data.sort(key=lambda x: x['dim_scores'][dim['id']]['avg'], reverse=True)
-        for i, model_data in enumerate(leaderboard_data):
-            if 'ranks' not in model_data:
-                model_data['ranks'] = {}
-            total_dim_count = model_data['dim_scores'][dim['id']]['subj_count'] + model_data['dim_scores'][dim['id']]['obj_count']
-            if total_dim_count > 0:
-                model_data['ranks'][dim['id']] = i + 1
-            else:
-                model_data['ranks'][dim['id']] = '-'
+        dim_order = sorted(leaderboard_data, key=lambda x: x['dim_scores'][dim['id']]['avg'], reverse=True)
+        for i, model_data in enumerate(dim_order):
+            dim_data = model_data['dim_scores'][dim['id']]
+            model_data['ranks'][dim['id']] = i + 1 if dim_data['subj_count'] + dim_data['obj_count'] > 0 else '-'
 
     leaderboard_data.sort(key=lambda x: x['avg_score'], reverse=True)
     